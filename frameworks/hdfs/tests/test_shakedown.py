@@ -75,10 +75,10 @@ def test_kill_journal_node():
     data_ids = tasks.get_task_ids(PACKAGE_NAME, 'data')
 
     tasks.kill_task_with_pattern('journalnode', 'journal-0-node.hdfs.mesos')
-    tasks.check_tasks_updated(PACKAGE_NAME, 'journal', journal_ids)
-    tasks.check_tasks_not_updated(PACKAGE_NAME, 'name', name_ids)
-    tasks.check_tasks_not_updated(PACKAGE_NAME, 'zkfc', zkfc_ids)
-    tasks.check_tasks_not_updated(PACKAGE_NAME, 'data', data_ids)
+    tasks.check_tasks(
+        PACKAGE_NAME,
+        updated={'journal': journal_ids},
+        not_updated={'name': name_ids, 'zkfc': zkfc_ids, 'data': data_ids})
     check_healthy()
 
 
@@ -92,10 +92,10 @@ def test_kill_name_node():
     data_ids = tasks.get_task_ids(PACKAGE_NAME, 'data')
 
     tasks.kill_task_with_pattern('namenode', 'name-0-node.hdfs.mesos')
-    tasks.check_tasks_updated(PACKAGE_NAME, 'name', name_ids)
-    tasks.check_tasks_not_updated(PACKAGE_NAME, 'journal', journal_ids)
-    tasks.check_tasks_not_updated(PACKAGE_NAME, 'zkfc', zkfc_ids)
-    tasks.check_tasks_not_updated(PACKAGE_NAME, 'data', data_ids)
+    tasks.check_tasks(
+        PACKAGE_NAME,
+        updated={'name': name_ids},
+        not_updated={'journal': journal_ids, 'zkfc': zkfc_ids, 'data': data_ids})
     check_healthy()
 
 
@@ -109,10 +109,10 @@ def test_kill_data_node():
     zkfc_ids = tasks.get_task_ids(PACKAGE_NAME, 'zkfc')
 
     tasks.kill_task_with_pattern('datanode', 'data-0-node.hdfs.mesos')
-    tasks.check_tasks_updated(PACKAGE_NAME, 'data', data_ids)
-    tasks.check_tasks_not_updated(PACKAGE_NAME, 'journal', journal_ids)
-    tasks.check_tasks_not_updated(PACKAGE_NAME, 'name', name_ids)
-    tasks.check_tasks_not_updated(PACKAGE_NAME, 'zkfc', zkfc_ids)
+    tasks.check_tasks(
+        PACKAGE_NAME,
+        updated={'data': data_ids},
+        not_updated={'journal': journal_ids, 'name': name_ids, 'zkfc': zkfc_ids})
     check_healthy()
 
 
@@ -136,10 +136,10 @@ def test_kill_all_journalnodes():
     for host in shakedown.get_service_ips(PACKAGE_NAME):
         tasks.kill_task_with_pattern('journalnode', host)
 
-    tasks.check_tasks_updated(PACKAGE_NAME, 'journal', journal_ids)
-    tasks.check_tasks_not_updated(PACKAGE_NAME, 'name', name_ids)
-    tasks.check_tasks_not_updated(PACKAGE_NAME, 'zkfc', zkfc_ids)
-    tasks.check_tasks_not_updated(PACKAGE_NAME, 'data', data_ids)
+    tasks.check_tasks(
+        PACKAGE_NAME,
+        updated={'journal': journal_ids},
+        not_updated={'name': name_ids, 'zkfc': zkfc_ids, 'data': data_ids})
     check_healthy()
 
 
@@ -155,10 +155,10 @@ def test_kill_all_namenodes():
     for host in shakedown.get_service_ips(PACKAGE_NAME):
         tasks.kill_task_with_pattern('namenode', host)
 
-    tasks.check_tasks_updated(PACKAGE_NAME, 'name', name_ids)
-    tasks.check_tasks_not_updated(PACKAGE_NAME, 'journal', journal_ids)
-    tasks.check_tasks_not_updated(PACKAGE_NAME, 'zkfc', zkfc_ids)
-    tasks.check_tasks_not_updated(PACKAGE_NAME, 'data', data_ids)
+    tasks.check_tasks(
+        PACKAGE_NAME,
+        updated={'name': name_ids},
+        not_updated={'journal': journal_ids, 'zkfc': zkfc_ids, 'data': data_ids})
     check_healthy()
 
 
@@ -174,10 +174,10 @@ def test_kill_all_datanodes():
     for host in shakedown.get_service_ips(PACKAGE_NAME):
         tasks.kill_task_with_pattern('datanode', host)
 
-    tasks.check_tasks_updated(PACKAGE_NAME, 'data', data_ids)
-    tasks.check_tasks_not_updated(PACKAGE_NAME, 'journal', journal_ids)
-    tasks.check_tasks_not_updated(PACKAGE_NAME, 'name', name_ids)
-    tasks.check_tasks_not_updated(PACKAGE_NAME, 'zkfc', zkfc_ids)
+    tasks.check_tasks(
+        PACKAGE_NAME,
+        updated={'data': data_ids},
+        not_updated={'journal': journal_ids, 'name': name_ids, 'zkfc': zkfc_ids})
     check_healthy()
 
 
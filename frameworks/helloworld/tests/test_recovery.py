@@ -1,9 +1,8 @@
-import json
 import pytest
 import shakedown
 import time
 
-import sdk_cmd as cmd
+import sdk_api as api
 import sdk_install as install
 import sdk_tasks as tasks
 
@@ -39,11 +38,9 @@ def test_pods_restart():
     hello_ids = tasks.get_task_ids(PACKAGE_NAME, 'hello-0')
 
     # get current agent id:
-    stdout = cmd.run_cli('hello-world pods info hello-0')
-    old_agent = json.loads(stdout)[0]['info']['slaveId']['value']
+    old_agent = api.get_pod_info(PACKAGE_NAME, 'hello-0')[0]['info']['slaveId']['value']
 
-    stdout = cmd.run_cli('hello-world pods restart hello-0')
-    jsonobj = json.loads(stdout)
+    jsonobj = api.restart_pod(PACKAGE_NAME, 'hello-0')
     assert len(jsonobj) == 2
     assert jsonobj['pod'] == 'hello-0'
     assert len(jsonobj['tasks']) == 1
@@ -53,8 +50,7 @@ def test_pods_restart():
     check_running()
 
     # check agent didn't move:
-    stdout = cmd.run_cli('hello-world pods info hello-0')
-    new_agent = json.loads(stdout)[0]['info']['slaveId']['value']
+    new_agent = api.get_pod_info(PACKAGE_NAME, 'hello-0')[0]['info']['slaveId']['value']
     assert old_agent == new_agent
 
 
@@ -64,10 +60,9 @@ def test_pods_replace():
     world_ids = tasks.get_task_ids(PACKAGE_NAME, 'world-0')
 
     # get current agent id:
-    stdout = cmd.run_cli('hello-world pods info world-0')
-    old_agent = json.loads(stdout)[0]['info']['slaveId']['value']
+    old_agent = api.get_pod_info(PACKAGE_NAME, 'world-0')[0]['info']['slaveId']['value']
 
-    jsonobj = json.loads(cmd.run_cli('hello-world pods replace world-0'))
+    jsonobj = api.replace_pod(PACKAGE_NAME, 'world-0')
     assert len(jsonobj) == 2
     assert jsonobj['pod'] == 'world-0'
     assert len(jsonobj['tasks']) == 1
@@ -77,7 +72,6 @@ def test_pods_replace():
     check_running()
 
     # check agent moved:
-    stdout = cmd.run_cli('hello-world pods info world-0')
-    new_agent = json.loads(stdout)[0]['info']['slaveId']['value']
+    new_agent = api.get_pod_info(PACKAGE_NAME, 'world-0')[0]['info']['slaveId']['value']
     # TODO: enable assert if/when agent is guaranteed to change (may randomly move back to old agent)
     #assert old_agent != new_agent
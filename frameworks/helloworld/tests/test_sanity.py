@@ -1,9 +1,9 @@
 import dcos.marathon
-import json
 import pytest
 import re
 import shakedown
 
+import sdk_api as api
 import sdk_cmd as cmd
 import sdk_install as install
 import sdk_marathon as marathon
@@ -123,8 +123,7 @@ def test_bump_hello_nodes():
 
 @pytest.mark.sanity
 def test_pods_list():
-    stdout = cmd.run_cli('hello-world pods list')
-    jsonobj = json.loads(stdout)
+    jsonobj = api.get_pods(PACKAGE_NAME)
     assert len(jsonobj) == configured_task_count()
     # expect: X instances of 'hello-#' followed by Y instances of 'world-#',
     # in alphanumerical order
@@ -142,8 +141,7 @@ def test_pods_list():
 
 @pytest.mark.sanity
 def test_pods_status_all():
-    stdout = cmd.run_cli('hello-world pods status')
-    jsonobj = json.loads(stdout)
+    jsonobj = api.get_pod_statuses(PACKAGE_NAME)
     assert len(jsonobj) == configured_task_count()
     for k, v in jsonobj.items():
         assert re.match('(hello|world)-[0-9]+', k)
@@ -157,8 +155,7 @@ def test_pods_status_all():
 
 @pytest.mark.sanity
 def test_pods_status_one():
-    stdout = cmd.run_cli('hello-world pods status hello-0')
-    jsonobj = json.loads(stdout)
+    jsonobj = api.get_pod_status(PACKAGE_NAME, 'hello-0')
     assert len(jsonobj) == 1
     task = jsonobj[0]
     assert len(task) == 3
@@ -169,8 +166,7 @@ def test_pods_status_one():
 
 @pytest.mark.sanity
 def test_pods_info():
-    stdout = cmd.run_cli('hello-world pods info world-1')
-    jsonobj = json.loads(stdout)
+    jsonobj = api.get_pod_info(PACKAGE_NAME, 'world-1')
     assert len(jsonobj) == 1
     task = jsonobj[0]
     assert len(task) == 2
@@ -183,17 +179,14 @@ def test_pods_info():
 def test_state_properties_get():
     # 'suppressed' could be missing if the scheduler recently started, loop for a bit just in case:
     def check_for_nonempty_properties():
-        stdout = cmd.run_cli('hello-world state properties')
-        return len(json.loads(stdout)) > 0
+        return len(api.get_state_properties(PACKAGE_NAME)) > 0
     spin.time_wait_noisy(lambda: check_for_nonempty_properties(), timeout_seconds=30.)
 
-    stdout = cmd.run_cli('hello-world state properties')
-    jsonobj = json.loads(stdout)
+    jsonobj = api.get_state_properties(PACKAGE_NAME)
     assert len(jsonobj) == 1
     assert jsonobj[0] == "suppressed"
 
-    stdout = cmd.run_cli('hello-world state property suppressed')
-    assert stdout == "true\n"
+    assert api.get_state_property(PACKAGE_NAME, 'suppressed') is True
 
 
 @pytest.mark.speedy
@@ -206,10 +199,7 @@ def test_state_refresh_disable_cache():
     stdout = cmd.run_cli('hello-world state refresh_cache')
     assert "Received cmd: refresh" in stdout
 
-    config = marathon.get_config(PACKAGE_NAME)
-    cpus = float(config['env']['HELLO_CPUS'])
-    config['env']['DISABLE_STATE_CACHE'] = 'any-text-here'
-    cmd.request('put', marathon.api_url('apps/' + PACKAGE_NAME), json=config)
+    marathon.patch_env(PACKAGE_NAME, {'DISABLE_STATE_CACHE': 'any-text-here'})
 
     tasks.check_tasks_not_updated(PACKAGE_NAME, '', task_ids)
     check_running()
@@ -224,10 +214,7 @@ def test_state_refresh_disable_cache():
         return False
     spin.time_wait_noisy(lambda: check_cache_refresh_fails_409conflict(), timeout_seconds=120.)
 
-    config = marathon.get_config(PACKAGE_NAME)
-    cpus = float(config['env']['HELLO_CPUS'])
-    del config['env']['DISABLE_STATE_CACHE']
-    cmd.request('put', marathon.api_url('apps/' + PACKAGE_NAME), json=config)
+    marathon.patch_env(PACKAGE_NAME, {'DISABLE_STATE_CACHE': None})
 
     tasks.check_tasks_not_updated(PACKAGE_NAME, '', task_ids)
     check_running()
@@ -1,9 +1,7 @@
-import json
 import pytest
-import re
 import shakedown
 
-import sdk_cmd as cmd
+import sdk_api as api
 import sdk_install as install
 import sdk_marathon as marathon
 import sdk_spin as spin
@@ -29,7 +27,7 @@ def test_upgrade_downgrade():
     test_version = get_pkg_version()
     print('Found test version: {}'.format(test_version))
 
-    repositories = json.loads(cmd.run_cli('package repo list --json'))['repositories']
+    repositories = api.list_repos()
     print("Repositories: " + str(repositories))
     universe_url = "fail"
     for repo in repositories:
@@ -74,10 +72,7 @@ def get_test_repo_info():
 
 
 def get_pkg_version():
-    pkg_description = cmd.run_cli('package describe {}'.format(PACKAGE_NAME))
-    regex = r'"version": "(\S+)"'
-    match = re.search(regex, pkg_description)
-    return match.group(1)
+    return api.get_package_version(PACKAGE_NAME)
 
 
 def add_repo(repo_name, repo_url, prev_version, index):
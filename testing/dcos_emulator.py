@@ -0,0 +1,1030 @@
+#!/usr/bin/env python3
+'''A local stand-in for the DC/OS cluster APIs used by the sdk_* test helpers, for running the helpers
+offline, eg to regression-test or benchmark their polling and HTTP overhead.
+
+Serves the same paths as adminrouter:
+- Marathon: /service/marathon/v2/apps[/<id>], /v2/deployments, /v2/events
+- Mesos: /mesos/master/state[.json], /mesos/master/frameworks, /mesos/master/slaves
+- Cosmos: /capabilities, /package/{describe,install,uninstall,list}, /package/repository/{list,add,delete}
+- Each installed service's scheduler: /service/<name>/v1/{plans,pods,state,configurations,endpoints}
+
+Installing a package creates its Marathon app and a scheduler framework whose tasks are launched on
+emulated agents. State then changes on a fixed schedule: tasks are RUNNING task_launch_seconds after
+being launched, deployments complete after deployment_seconds, and uninstalled frameworks are removed
+after uninstall_seconds. Additional transitions (eg killing a task, with or without a relaunch) may be
+scripted up front, or triggered at any time via the /emulator/ control API:
+- GET /emulator/stats, POST /emulator/stats/reset: request counts and bytes transferred, per route
+- PUT /emulator/timings: {"task_launch_seconds": 1, ...}
+- POST /emulator/packages: {"name": "kafka", "version": "1.0", "pods": {"broker": 3}}
+- POST /emulator/actions: {"action": "kill_task", "service": "kafka", "task": "broker-0-broker",
+  "after": 5, "relaunch_after": 2}. See ClusterState.run_action() for the available actions.
+- POST /emulator/reset: removes all services and apps
+
+Point the helpers at the emulator with 'dcos config set core.dcos_url http://<host>:<port>'. Run with:
+  $ ./dcos_emulator.py [--host 127.0.0.1] [--port 0] [--script actions.json] [--verbose]
+or in-process, via DCOSEmulator(...).start().'''
+
+import heapq
+import itertools
+import json
+import re
+import sys
+import threading
+import time
+import traceback
+import uuid
+
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import urlparse
+
+# Default timings of state transitions, in seconds. See ClusterState.set_timings().
+DEFAULT_TIMINGS = {
+    'task_launch_seconds': 1,
+    'deployment_seconds': 1,
+    'uninstall_seconds': 1,
+}
+DEFAULT_AGENT_COUNT = 3
+
+# Packages in the emulated Cosmos catalog: name => version and pod type => instance count. Each pod
+# instance gets one task named '<pod type>-<index>-server', as in hello-world.
+DEFAULT_PACKAGES = {
+    'hello-world': {'version': '1.0.0', 'pods': {'hello': 1, 'world': 2}},
+}
+
+TERMINAL_TASK_STATES = ['TASK_FINISHED', 'TASK_FAILED', 'TASK_KILLED', 'TASK_LOST', 'TASK_ERROR']
+
+MARATHON_FRAMEWORK_ID = 'emulator-marathon-0000'
+
+
+class Scheduler(object):
+    '''Runs callbacks at scheduled times, on a single background thread'''
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._queue = []
+        self._counter = itertools.count()
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, name='emulator-scheduler', daemon=True)
+        self._thread.start()
+
+    def after(self, seconds, fn):
+        with self._condition:
+            heapq.heappush(self._queue, (time.time() + max(0, seconds), next(self._counter), fn))
+            self._condition.notify()
+
+    def clear(self):
+        with self._condition:
+            self._queue = []
+
+    def stop(self):
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._stopped and (not self._queue or self._queue[0][0] > time.time()):
+                    self._condition.wait(self._queue[0][0] - time.time() if self._queue else None)
+                if self._stopped:
+                    return
+                _, _, fn = heapq.heappop(self._queue)
+            try:
+                fn()
+            except Exception:
+                # a failed event shouldn't stop the events scheduled after it:
+                print('Scheduled event failed:\n{}'.format(traceback.format_exc()), file=sys.stderr)
+
+
+class Service(object):
+    '''An installed SDK service: its scheduler's framework, tasks, and API state'''
+
+    def __init__(self, name, package_name, package_version, pods, options, agents):
+        self.name = name
+        self.package_name = package_name
+        self.package_version = package_version
+        self.pods = pods
+        self.options = options
+        self.framework_id = 'emulator-{}-{}'.format(name.strip('/').replace('/', '.'), uuid.uuid4())
+        self.active = True
+        # task name => current task, and all terminal tasks which have since been replaced
+        self.tasks = {}
+        self.completed_tasks = []
+        self.deploy_complete = False
+        self.plan_ids = {}
+        self.config_ids = [str(uuid.uuid4())]
+        self.properties = {'last-completed-update-type': 'DEPLOY'}
+        self._agents = agents
+        self._task_indexes = dict((name, index) for index, name in enumerate(self.task_names()))
+
+    def task_names(self, pod_type=None):
+        names = []
+        for candidate_type in sorted(self.pods.keys()):
+            if pod_type is None or candidate_type == pod_type:
+                names.extend('{}-{}-server'.format(candidate_type, index)
+                             for index in range(self.pods[candidate_type]))
+        return names
+
+    def pod_of(self, task_name):
+        return task_name.rsplit('-', 1)[0]
+
+    def new_task(self, task_name):
+        '''Replaces any current task of that name with a newly launched one. Returns the new task.'''
+        old_task = self.tasks.get(task_name)
+        if old_task is not None:
+            if old_task['state'] not in TERMINAL_TASK_STATES:
+                set_task_state(old_task, 'TASK_KILLED')
+            self.completed_tasks.append(old_task)
+        index = self._task_indexes.get(task_name, len(self.tasks))
+        agent = self._agents[index % len(self._agents)]
+        port = 31000 + index
+        task = {
+            'id': '{}__{}'.format(task_name, uuid.uuid4()),
+            'name': task_name,
+            'framework_id': self.framework_id,
+            'executor_id': '{}__{}'.format(self.pod_of(task_name), uuid.uuid4()),
+            'slave_id': agent['id'],
+            'state': 'TASK_STAGING',
+            'resources': {'cpus': 0.1, 'mem': 256.0, 'disk': 0.0, 'ports': '[{}-{}]'.format(port, port)},
+            'statuses': [],
+            'labels': [{'key': 'goal_state', 'value': 'RUNNING'}, {'key': 'target_configuration',
+                                                                   'value': self.config_ids[-1]}],
+            'discovery': {'visibility': 'EXTERNAL', 'name': task_name, 'ports': {'ports': [
+                {'number': port, 'name': self.pod_of(task_name).rsplit('-', 1)[0], 'protocol': 'tcp'}]}},
+            'container': {'type': 'MESOS', 'network_infos': [{'ip_addresses': [{'ip_address': agent['ip']}]}]},
+        }
+        set_task_state(task, 'TASK_STAGING')
+        self.tasks[task_name] = task
+        return task
+
+    def plan(self, plan_name):
+        '''Returns (plan json, is complete), or None if the plan doesn't exist'''
+        if plan_name == 'deploy':
+            phases = []
+            for pod_type in sorted(self.pods.keys()):
+                steps = []
+                for task_name in self.task_names(pod_type):
+                    task = self.tasks.get(task_name)
+                    if self.deploy_complete or (task and task['state'] == 'TASK_RUNNING'):
+                        status = 'COMPLETE'
+                    elif task and task['state'] not in TERMINAL_TASK_STATES:
+                        status = 'STARTING'
+                    else:
+                        status = 'PENDING'
+                    steps.append(self._plan_element('deploy', task_name, status, {
+                        'message': "'{} [{}]' has status: '{}'.".format(
+                            task_name, task['id'] if task else '', status)}))
+                phases.append(self._plan_element('deploy', pod_type, _rollup([s['status'] for s in steps]),
+                                                 {'steps': steps}))
+        elif plan_name == 'recovery':
+            steps = []
+            if self.deploy_complete:
+                for task_name in self.task_names():
+                    task = self.tasks.get(task_name)
+                    if task and task['state'] != 'TASK_RUNNING':
+                        status = 'PENDING' if task['state'] in TERMINAL_TASK_STATES else 'STARTING'
+                        steps.append(self._plan_element('recovery', task_name, status, {
+                            'message': "'{}' is being recovered".format(task_name)}))
+            phases = [self._plan_element('recovery', 'permanent-node-failure-recovery',
+                                         _rollup([s['status'] for s in steps]), {'steps': steps})]
+        else:
+            return None
+        status = _rollup([p['status'] for p in phases])
+        return ({'phases': phases, 'errors': [], 'status': status}, status == 'COMPLETE')
+
+    def _plan_element(self, plan_name, name, status, content):
+        key = '{}/{}'.format(plan_name, name)
+        if key not in self.plan_ids:
+            self.plan_ids[key] = str(uuid.uuid4())
+        element = {'id': self.plan_ids[key], 'name': name, 'status': status}
+        element.update(content)
+        return element
+
+    def pod_tasks(self, pod_name):
+        return [t for name, t in sorted(self.tasks.items()) if self.pod_of(name) == pod_name]
+
+    def endpoints(self):
+        endpoints = {}
+        for task in self.tasks.values():
+            if task['state'] != 'TASK_RUNNING':
+                continue
+            agent = [a for a in self._agents if a['id'] == task['slave_id']][0]
+            for port in task['discovery']['ports']['ports']:
+                endpoint = endpoints.setdefault(port['name'], {'address': [], 'dns': []})
+                endpoint['address'].append('{}:{}'.format(agent['ip'], port['number']))
+                endpoint['dns'].append('{}.{}.autoip.dcos.thisdcos.directory:{}'.format(
+                    task['name'], self.name.strip('/'), port['number']))
+        return endpoints
+
+
+def set_task_state(task, state):
+    task['state'] = state
+    task['statuses'].append({'state': state, 'timestamp': time.time(), 'container_status': {}})
+
+
+def _rollup(statuses):
+    if all(s == 'COMPLETE' for s in statuses):
+        return 'COMPLETE'
+    if all(s == 'PENDING' for s in statuses):
+        return 'PENDING'
+    return 'IN_PROGRESS'
+
+
+class ClusterState(object):
+    '''The emulated cluster's Marathon apps, Mesos frameworks, Cosmos catalog and repositories, and the
+    state of each installed service. All access is guarded by the lock.'''
+
+    def __init__(self, agent_count=DEFAULT_AGENT_COUNT, packages=DEFAULT_PACKAGES):
+        self.lock = threading.RLock()
+        self.timings = dict(DEFAULT_TIMINGS)
+        self.packages = json.loads(json.dumps(packages))
+        self.agents = [{'id': 'emulator-S{}'.format(i), 'hostname': '10.0.0.{}'.format(i + 1),
+                        'ip': '10.0.0.{}'.format(i + 1)} for i in range(agent_count)]
+        self.repositories = [{'name': 'Universe', 'uri': 'https://universe.mesosphere.com/repo'}]
+        self._scheduler = Scheduler()
+        # Marathon event stream: (sequence, event type, event), with waiters notified of new events
+        self.events = []
+        self.events_condition = threading.Condition(self.lock)
+        self._event_counter = itertools.count()
+        self._last_version_millis = 0
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self._scheduler.clear()
+            # app id ('/name') => app, and deployment id => deployment
+            self.apps = {}
+            self.deployments = {}
+            # service name => Service, including frameworks which are being torn down
+            self.services = {}
+
+    def stop(self):
+        self._scheduler.stop()
+
+    def set_timings(self, timings):
+        with self.lock:
+            for key, value in timings.items():
+                if key not in DEFAULT_TIMINGS:
+                    raise ValueError('Unknown timing: {}'.format(key))
+                self.timings[key] = float(value)
+
+    def add_package(self, name, version, pods):
+        with self.lock:
+            self.packages[name] = {'version': version, 'pods': pods}
+
+    # Cosmos
+
+    def describe_package(self, name, version=None):
+        with self.lock:
+            package = self.packages.get(name)
+            if package is None or (version and version != package['version']):
+                return None
+            return {'package': {
+                'name': name, 'version': package['version'], 'packagingVersion': '3.0',
+                'description': 'Emulated {} package'.format(name), 'maintainer': 'emulator',
+                'tags': [], 'framework': True, 'selected': False}}
+
+    def install_package(self, name, version, options):
+        '''Returns the new app's id, or None if the package doesn't exist'''
+        with self.lock:
+            package = self.packages.get(name)
+            if package is None or (version and version != package['version']):
+                return None
+            service_name = options.get('service', {}).get('name', name)
+            app_id = '/' + service_name.strip('/')
+            if app_id in self.apps:
+                raise ValueError('App {} is already installed'.format(app_id))
+            self.apps[app_id] = {
+                'id': app_id, 'instances': 1, 'cpus': 1.0, 'mem': 1024.0, 'cmd': 'scheduler',
+                'env': {'PACKAGE_NAME': name, 'PACKAGE_VERSION': package['version'],
+                        'FRAMEWORK_NAME': service_name},
+                'labels': {'DCOS_PACKAGE_NAME': name, 'DCOS_PACKAGE_VERSION': package['version'],
+                           'DCOS_PACKAGE_FRAMEWORK_NAME': service_name,
+                           'DCOS_PACKAGE_OPTIONS': json.dumps(options)},
+                'uris': [], 'version': self._new_app_version(), 'tasksRunning': 0, 'tasksStaged': 1,
+            }
+            service = Service(service_name, name, package['version'], package['pods'], options, self.agents)
+            self.services[service_name] = service
+            self._deploy(app_id, lambda: self._launch_tasks(service, service.task_names()))
+            return app_id
+
+    def uninstall_package(self, name, app_id=None):
+        '''Returns the uninstalled apps' (id, package version)'''
+        with self.lock:
+            results = []
+            for candidate_id, app in list(self.apps.items()):
+                if app['labels'].get('DCOS_PACKAGE_NAME') != name or (app_id and candidate_id != app_id):
+                    continue
+                results.append((candidate_id, app['labels']['DCOS_PACKAGE_VERSION']))
+                self._remove_app(candidate_id)
+            return results
+
+    def list_packages(self):
+        with self.lock:
+            return [{'appId': app_id, 'packageInformation': {'packageDefinition': {
+                'name': app['labels']['DCOS_PACKAGE_NAME'], 'version': app['labels']['DCOS_PACKAGE_VERSION']}}}
+                    for app_id, app in sorted(self.apps.items()) if 'DCOS_PACKAGE_NAME' in app['labels']]
+
+    def add_repository(self, name, uri, index=None):
+        with self.lock:
+            if any(r['name'] == name or r['uri'] == uri for r in self.repositories):
+                raise ValueError('Repository {} {} already exists'.format(name, uri))
+            repo = {'name': name, 'uri': uri}
+            if index is None:
+                self.repositories.append(repo)
+            else:
+                self.repositories.insert(int(index), repo)
+            return list(self.repositories)
+
+    def remove_repository(self, name):
+        with self.lock:
+            if not any(r['name'] == name for r in self.repositories):
+                return None
+            self.repositories = [r for r in self.repositories if r['name'] != name]
+            return list(self.repositories)
+
+    # Marathon
+
+    def get_app(self, app_id):
+        with self.lock:
+            app = self.apps.get(app_id)
+            if app is None:
+                return None
+            app = json.loads(json.dumps(app))
+            app['deployments'] = [{'id': d['id']} for d in self.deployments.values()
+                                  if app_id in d['affectedApps']]
+            return app
+
+    def update_app(self, app_id, changes):
+        '''Returns the resulting deployment, or None if the app doesn't exist. As with Marathon, only
+        the provided fields are changed. The service's scheduler is restarted, and it relaunches all tasks
+        with the new config.'''
+        with self.lock:
+            app = self.apps.get(app_id)
+            if app is None:
+                return None
+            changes = dict(changes)
+            changes.pop('id', None)
+            app.update(changes)
+            app['version'] = self._new_app_version()
+            service = self.services.get(app_id.strip('/'))
+            if service is None:
+                return self._deploy(app_id, lambda: None)
+            service.config_ids.append(str(uuid.uuid4()))
+            service.deploy_complete = False
+            service.properties['last-completed-update-type'] = 'UPDATE'
+            return self._deploy(app_id, lambda: self._launch_tasks(service, service.task_names()))
+
+    def create_app(self, app):
+        with self.lock:
+            app_id = '/' + app['id'].strip('/')
+            if app_id in self.apps:
+                return None
+            app = dict(app, id=app_id, version=self._new_app_version())
+            app.setdefault('env', {})
+            app.setdefault('labels', {})
+            app.setdefault('uris', [])
+            self.apps[app_id] = app
+            self._deploy(app_id, lambda: None)
+            return app
+
+    def destroy_app(self, app_id):
+        with self.lock:
+            if app_id not in self.apps:
+                return None
+            return self._remove_app(app_id)
+
+    def _new_app_version(self):
+        # as with Marathon, each change to an app gets a new (and unique) version:
+        self._last_version_millis = max(int(time.time() * 1000), self._last_version_millis + 1)
+        return _timestamp(self._last_version_millis)
+
+    def _remove_app(self, app_id):
+        del self.apps[app_id]
+        service = self.services.get(app_id.strip('/'))
+        if service is not None:
+            self._scheduler.after(self.timings['uninstall_seconds'], lambda: self._teardown(service))
+        return self._deploy(app_id, lambda: None)
+
+    def _deploy(self, app_id, on_success):
+        deployment = {'id': str(uuid.uuid4()), 'version': _timestamp(), 'affectedApps': [app_id],
+                      'currentStep': 1, 'totalSteps': 1}
+        self.deployments[deployment['id']] = deployment
+
+        def finish():
+            with self.lock:
+                if self.deployments.pop(deployment['id'], None) is None:
+                    return  # reset in the meantime
+                on_success()
+                self._add_event('deployment_success', {'id': deployment['id'], 'plan': deployment})
+        self._scheduler.after(self.timings['deployment_seconds'], finish)
+        return deployment
+
+    def _teardown(self, service):
+        with self.lock:
+            if self.services.get(service.name) is not service:
+                return
+            for task in service.tasks.values():
+                if task['state'] not in TERMINAL_TASK_STATES:
+                    set_task_state(task, 'TASK_KILLED')
+            del self.services[service.name]
+
+    def _add_event(self, event_type, event):
+        event = dict(event, eventType=event_type, timestamp=_timestamp())
+        self.events.append((next(self._event_counter), event_type, event))
+        # only recent events are needed by followers of the stream:
+        del self.events[:-1000]
+        self.events_condition.notify_all()
+
+    # Tasks
+
+    def _launch_tasks(self, service, task_names, delay=None):
+        '''Launches new instances of the named tasks, which become RUNNING after the launch delay'''
+        with self.lock:
+            if self.services.get(service.name) is not service:
+                return
+            tasks = [service.new_task(name) for name in task_names]
+        self._scheduler.after(self.timings['task_launch_seconds'] if delay is None else delay,
+                              lambda: self._tasks_running(service, tasks))
+
+    def _tasks_running(self, service, tasks):
+        with self.lock:
+            for task in tasks:
+                if service.tasks.get(task['name']) is task and task['state'] not in TERMINAL_TASK_STATES:
+                    set_task_state(task, 'TASK_RUNNING')
+            if all(t['state'] == 'TASK_RUNNING' for t in service.tasks.values()):
+                service.deploy_complete = True
+
+    def run_action(self, action):
+        '''Runs a scripted transition, immediately or after action['after'] seconds:
+        - kill_task: service, task. Kills the named task. If relaunch_after is set, the scheduler relaunches
+          it after that many seconds, in addition to the usual launch delay.
+        - fail_task: same as kill_task, but the task ends up TASK_FAILED
+        - restart_pod: service, pod. Relaunches all tasks in the pod, eg 'hello-0'.
+        - set_timings: timings. Same as PUT /emulator/timings.'''
+        name = action.get('action')
+        handlers = {
+            'kill_task': lambda: self._end_task(action, 'TASK_KILLED'),
+            'fail_task': lambda: self._end_task(action, 'TASK_FAILED'),
+            'restart_pod': lambda: self.restart_pod(action['service'], action['pod']),
+            'set_timings': lambda: self.set_timings(action['timings']),
+        }
+        if name not in handlers:
+            raise ValueError('Unknown action: {}'.format(name))
+        after = float(action.get('after', 0))
+        if after > 0:
+            self._scheduler.after(after, handlers[name])
+        else:
+            handlers[name]()
+
+    def _end_task(self, action, state):
+        with self.lock:
+            service = self.services.get(action['service'])
+            task = service.tasks.get(action['task']) if service else None
+            if task is None or task['state'] in TERMINAL_TASK_STATES:
+                return
+            set_task_state(task, state)
+            relaunch_after = action.get('relaunch_after')
+            if relaunch_after is not None:
+                self._scheduler.after(float(relaunch_after), lambda: self._launch_tasks(service, [task['name']]))
+
+    def restart_pod(self, service_name, pod_name):
+        '''Returns the names of the pod's tasks, or None if the pod doesn't exist'''
+        with self.lock:
+            service = self.services.get(service_name)
+            tasks = service.pod_tasks(pod_name) if service else []
+            if not tasks:
+                return None
+            task_names = [t['name'] for t in tasks]
+            self._launch_tasks(service, task_names)
+            return task_names
+
+    # Mesos
+
+    def mesos_state(self):
+        with self.lock:
+            frameworks = [{'id': MARATHON_FRAMEWORK_ID, 'name': 'marathon', 'active': True,
+                           'hostname': 'master.mesos', 'tasks': [], 'completed_tasks': []}]
+            for service in self.services.values():
+                current = [t for t in service.tasks.values() if t['state'] not in TERMINAL_TASK_STATES]
+                ended = [t for t in service.tasks.values() if t['state'] in TERMINAL_TASK_STATES]
+                frameworks.append({
+                    'id': service.framework_id, 'name': service.name, 'active': service.active,
+                    'hostname': 'scheduler.{}.marathon.mesos'.format(service.name),
+                    'webui_url': 'http://scheduler.{}.marathon.mesos:8080'.format(service.name),
+                    'tasks': current, 'completed_tasks': service.completed_tasks + ended,
+                })
+            return json.loads(json.dumps({
+                'version': '1.2.0', 'hostname': 'master.mesos', 'activated_slaves': len(self.agents),
+                'frameworks': frameworks, 'completed_frameworks': [],
+                'slaves': [{'id': a['id'], 'hostname': a['hostname'], 'active': True,
+                            'resources': {'cpus': 4.0, 'mem': 14000.0, 'disk': 30000.0}} for a in self.agents],
+            }))
+
+
+def _timestamp(millis=None):
+    if millis is None:
+        millis = int(time.time() * 1000)
+    return '{}.{:03d}Z'.format(time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(millis // 1000)), millis % 1000)
+
+
+class RequestStats(object):
+    '''Counts of requests and bytes transferred, per route'''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def add(self, route, bytes_in, bytes_out):
+        with self._lock:
+            stats = self._routes.setdefault(route, {'requests': 0, 'bytes_in': 0, 'bytes_out': 0})
+            stats['requests'] += 1
+            stats['bytes_in'] += bytes_in
+            stats['bytes_out'] += bytes_out
+
+    def get(self):
+        with self._lock:
+            routes = json.loads(json.dumps(self._routes))
+        totals = {'requests': 0, 'bytes_in': 0, 'bytes_out': 0}
+        for stats in routes.values():
+            for key in totals.keys():
+                totals[key] += stats[key]
+        return {'routes': routes, 'totals': totals}
+
+    def reset(self):
+        with self._lock:
+            self._routes = {}
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message=''):
+        super(HTTPError, self).__init__(message)
+        self.status = status
+        self.message = message
+
+
+class EmulatorRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # headers and body are written separately: don't let small responses wait on a delayed ACK
+    disable_nagle_algorithm = True
+
+    # (method, route name, path pattern), matched in order. The route name is used for request stats.
+    ROUTES = [(method, name, re.compile('^{}$'.format(pattern))) for method, name, pattern in [
+        ('GET', 'marathon_apps', r'/service/marathon/v2/apps/?'),
+        ('POST', 'marathon_create_app', r'/service/marathon/v2/apps/?'),
+        ('GET', 'marathon_app', r'/service/marathon/v2/apps/(?P<app_id>.+?)/?'),
+        ('PUT', 'marathon_update_app', r'/service/marathon/v2/apps/(?P<app_id>.+?)/?'),
+        ('DELETE', 'marathon_destroy_app', r'/service/marathon/v2/apps/(?P<app_id>.+?)/?'),
+        ('GET', 'marathon_deployments', r'/service/marathon/v2/deployments/?'),
+        ('GET', 'marathon_events', r'/service/marathon/v2/events/?'),
+        ('GET', 'mesos_state', r'/mesos/master/state(\.json)?/?'),
+        ('GET', 'mesos_frameworks', r'/mesos/master/frameworks/?'),
+        ('GET', 'mesos_slaves', r'/mesos/master/slaves/?'),
+        ('POST', 'cosmos_describe', r'/package/describe'),
+        ('POST', 'cosmos_install', r'/package/install'),
+        ('POST', 'cosmos_uninstall', r'/package/uninstall'),
+        ('POST', 'cosmos_list', r'/package/list'),
+        ('POST', 'cosmos_repo_list', r'/package/repository/list'),
+        ('POST', 'cosmos_repo_add', r'/package/repository/add'),
+        ('POST', 'cosmos_repo_delete', r'/package/repository/delete'),
+        ('GET', 'cosmos_capabilities', r'/capabilities'),
+        ('POST', 'acs_login', r'/acs/api/v1/auth/login'),
+        ('GET', 'scheduler_plans', r'/service/(?P<service>.+?)/v1/plans/?'),
+        ('GET', 'scheduler_plan', r'/service/(?P<service>.+?)/v1/plans/(?P<plan>[^/]+)/?'),
+        ('POST', 'scheduler_plan_cmd', r'/service/(?P<service>.+?)/v1/plans/(?P<plan>[^/]+)/(?P<cmd>[^/]+)/?'),
+        ('GET', 'scheduler_pods', r'/service/(?P<service>.+?)/v1/pods/?'),
+        ('GET', 'scheduler_pod_statuses', r'/service/(?P<service>.+?)/v1/pods/status/?'),
+        ('GET', 'scheduler_pod_status', r'/service/(?P<service>.+?)/v1/pods/(?P<pod>[^/]+)/status/?'),
+        ('GET', 'scheduler_pod_info', r'/service/(?P<service>.+?)/v1/pods/(?P<pod>[^/]+)/info/?'),
+        ('POST', 'scheduler_pod_restart', r'/service/(?P<service>.+?)/v1/pods/(?P<pod>[^/]+)/(?P<cmd>restart|replace)/?'),
+        ('GET', 'scheduler_framework_id', r'/service/(?P<service>.+?)/v1/state/frameworkId/?'),
+        ('GET', 'scheduler_properties', r'/service/(?P<service>.+?)/v1/state/properties/?'),
+        ('GET', 'scheduler_property', r'/service/(?P<service>.+?)/v1/state/properties/(?P<key>[^/]+)/?'),
+        ('GET', 'scheduler_configs', r'/service/(?P<service>.+?)/v1/configurations/?'),
+        ('GET', 'scheduler_config_target_id', r'/service/(?P<service>.+?)/v1/configurations/targetId/?'),
+        ('GET', 'scheduler_config_target', r'/service/(?P<service>.+?)/v1/configurations/target/?'),
+        ('GET', 'scheduler_config', r'/service/(?P<service>.+?)/v1/configurations/(?P<config_id>[^/]+)/?'),
+        ('GET', 'scheduler_endpoints', r'/service/(?P<service>.+?)/v1/endpoints/?'),
+        ('GET', 'scheduler_endpoint', r'/service/(?P<service>.+?)/v1/endpoints/(?P<name>[^/]+)/?'),
+        ('GET', 'emulator_stats', r'/emulator/stats/?'),
+        ('POST', 'emulator_stats_reset', r'/emulator/stats/reset/?'),
+        ('PUT', 'emulator_timings', r'/emulator/timings/?'),
+        ('POST', 'emulator_packages', r'/emulator/packages/?'),
+        ('POST', 'emulator_actions', r'/emulator/actions/?'),
+        ('POST', 'emulator_reset', r'/emulator/reset/?'),
+    ]]
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_POST(self):
+        self._handle('POST')
+
+    def do_PUT(self):
+        self._handle('PUT')
+
+    def do_DELETE(self):
+        self._handle('DELETE')
+
+    def _handle(self, method):
+        # adminrouter tolerates doubled slashes, eg from dcos_service_url() + '/v1/...':
+        path = re.sub('/+', '/', urlparse(self.path).path)
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        route_name = 'not_found'
+        try:
+            for route_method, name, pattern in self.ROUTES:
+                match = pattern.match(path)
+                if match and route_method == method:
+                    route_name = name
+                    status, content = getattr(self, '_' + name)(self._parse_json(body), **match.groupdict())
+                    break
+            else:
+                raise HTTPError(404, 'No route for {} {}'.format(method, path))
+        except HTTPError as e:
+            status, content = e.status, {'message': e.message}
+        except (KeyError, ValueError) as e:
+            status, content = 400, {'message': 'Invalid request: {}'.format(e)}
+        if content is None:
+            # already responded, eg the event stream
+            self.server.stats.add(route_name, length, 0)
+            return
+        payload = (content if isinstance(content, str) else json.dumps(content)).encode('utf-8')
+        # counted before responding, so that the stats include every request the client has seen a response to:
+        self.server.stats.add(route_name, length, len(payload))
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/plain' if isinstance(content, str) else self._content_type())
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _parse_json(self, body):
+        if not body:
+            return {}
+        return json.loads(body.decode('utf-8'))
+
+    def _content_type(self):
+        # Cosmos clients ask for a versioned media type, and expect it back:
+        accept = self.headers.get('Accept', '')
+        if accept.startswith('application/vnd.dcos.'):
+            return accept.split(',')[0]
+        return 'application/json'
+
+    def _service(self, service):
+        service = self.server.state.services.get(service.strip('/'))
+        if service is None or not service.active:
+            raise HTTPError(404, 'Service not found')
+        return service
+
+    # Marathon
+
+    def _marathon_apps(self, body):
+        with self.server.state.lock:
+            return 200, {'apps': [self.server.state.get_app(app_id) for app_id in sorted(self.server.state.apps)]}
+
+    def _marathon_create_app(self, body):
+        app = self.server.state.create_app(body)
+        if app is None:
+            raise HTTPError(409, 'An app with id [{}] already exists.'.format(body['id']))
+        return 201, app
+
+    def _marathon_app(self, body, app_id):
+        app = self.server.state.get_app('/' + app_id)
+        if app is None:
+            raise HTTPError(404, "App '/{}' does not exist".format(app_id))
+        return 200, {'app': app}
+
+    def _marathon_update_app(self, body, app_id):
+        deployment = self.server.state.update_app('/' + app_id, body)
+        if deployment is None:
+            raise HTTPError(404, "App '/{}' does not exist".format(app_id))
+        return 200, {'deploymentId': deployment['id'], 'version': deployment['version']}
+
+    def _marathon_destroy_app(self, body, app_id):
+        deployment = self.server.state.destroy_app('/' + app_id)
+        if deployment is None:
+            raise HTTPError(404, "App '/{}' does not exist".format(app_id))
+        return 200, {'deploymentId': deployment['id'], 'version': deployment['version']}
+
+    def _marathon_deployments(self, body):
+        with self.server.state.lock:
+            return 200, list(self.server.state.deployments.values())
+
+    def _marathon_events(self, body):
+        '''Streams Marathon events as server-sent events, until the client disconnects'''
+        state = self.server.state
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        # as with Marathon, each event is sent as its own chunk, so clients see it without waiting for more:
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+        with state.lock:
+            last_sequence = state.events[-1][0] if state.events else -1
+        try:
+            while not self.server.stopping:
+                with state.events_condition:
+                    pending = [e for e in state.events if e[0] > last_sequence]
+                    if not pending:
+                        state.events_condition.wait(1)
+                        continue
+                for sequence, event_type, event in pending:
+                    chunk = 'event: {}\ndata: {}\n\n'.format(event_type, json.dumps(event)).encode('utf-8')
+                    self.wfile.write('{:x}\r\n'.format(len(chunk)).encode('utf-8') + chunk + b'\r\n')
+                    last_sequence = sequence
+                self.wfile.flush()
+            self.wfile.write(b'0\r\n\r\n')
+        except (IOError, OSError):
+            pass  # client disconnected
+        return None, None
+
+    # Mesos
+
+    def _mesos_state(self, body):
+        return 200, self.server.state.mesos_state()
+
+    def _mesos_frameworks(self, body):
+        state = self.server.state.mesos_state()
+        return 200, {'frameworks': state['frameworks'], 'completed_frameworks': state['completed_frameworks']}
+
+    def _mesos_slaves(self, body):
+        return 200, {'slaves': self.server.state.mesos_state()['slaves']}
+
+    # Cosmos
+
+    def _cosmos_describe(self, body):
+        description = self.server.state.describe_package(body['packageName'], body.get('packageVersion'))
+        if description is None:
+            raise HTTPError(400, 'Package [{}] not found'.format(body['packageName']))
+        return 200, description
+
+    def _cosmos_install(self, body):
+        try:
+            app_id = self.server.state.install_package(
+                body['packageName'], body.get('packageVersion'), body.get('options') or {})
+        except ValueError as e:
+            raise HTTPError(409, str(e))
+        if app_id is None:
+            raise HTTPError(400, 'Package [{}] not found'.format(body['packageName']))
+        return 200, {'packageName': body['packageName'], 'appId': app_id,
+                     'packageVersion': self.server.state.packages[body['packageName']]['version']}
+
+    def _cosmos_uninstall(self, body):
+        results = self.server.state.uninstall_package(body['packageName'], body.get('appId'))
+        if not results:
+            raise HTTPError(404, 'Package [{}] is not installed'.format(body['packageName']))
+        return 200, {'results': [{'packageName': body['packageName'], 'appId': app_id, 'packageVersion': version}
+                                 for app_id, version in results]}
+
+    def _cosmos_list(self, body):
+        return 200, {'packages': self.server.state.list_packages()}
+
+    def _cosmos_repo_list(self, body):
+        with self.server.state.lock:
+            return 200, {'repositories': list(self.server.state.repositories)}
+
+    def _cosmos_repo_add(self, body):
+        try:
+            return 200, {'repositories': self.server.state.add_repository(body['name'], body['uri'], body.get('index'))}
+        except ValueError as e:
+            raise HTTPError(409, str(e))
+
+    def _cosmos_repo_delete(self, body):
+        repositories = self.server.state.remove_repository(body['name'])
+        if repositories is None:
+            raise HTTPError(400, 'Repository [{}] not found'.format(body['name']))
+        return 200, {'repositories': repositories}
+
+    def _cosmos_capabilities(self, body):
+        # checked by the CLI's package manager before any package calls:
+        return 200, {'capabilities': [{'name': 'PACKAGE_MANAGEMENT'}, {'name': 'SUPPORT_CLUSTER_REPORT'},
+                                      {'name': 'METRONOME'}]}
+
+    def _acs_login(self, body):
+        return 200, {'token': 'emulator-token'}
+
+    # Scheduler
+
+    def _scheduler_plans(self, body, service):
+        with self.server.state.lock:
+            self._service(service)
+        return 200, ['deploy', 'recovery']
+
+    def _scheduler_plan(self, body, service, plan):
+        with self.server.state.lock:
+            result = self._service(service).plan(plan)
+        if result is None:
+            return 404, 'Element not found'
+        plan_json, complete = result
+        return (200 if complete else 503), plan_json
+
+    def _scheduler_plan_cmd(self, body, service, plan, cmd):
+        with self.server.state.lock:
+            if self._service(service).plan(plan) is None:
+                return 404, 'Element not found'
+        return 200, {'message': 'Received cmd: {}'.format(cmd)}
+
+    def _scheduler_pods(self, body, service):
+        with self.server.state.lock:
+            s = self._service(service)
+            return 200, sorted(set(s.pod_of(name) for name in s.tasks.keys()))
+
+    def _scheduler_pod_statuses(self, body, service):
+        with self.server.state.lock:
+            s = self._service(service)
+            statuses = {}
+            for name in sorted(s.tasks.keys()):
+                task = s.tasks[name]
+                statuses.setdefault(s.pod_of(name), []).append(
+                    {'id': task['id'], 'name': name, 'state': task['state']})
+            return 200, statuses
+
+    def _scheduler_pod_status(self, body, service, pod):
+        with self.server.state.lock:
+            tasks = self._service(service).pod_tasks(pod)
+            if not tasks:
+                raise HTTPError(404)
+            return 200, [{'id': t['id'], 'name': t['name'], 'state': t['state']} for t in tasks]
+
+    def _scheduler_pod_info(self, body, service, pod):
+        with self.server.state.lock:
+            tasks = self._service(service).pod_tasks(pod)
+            if not tasks:
+                raise HTTPError(404)
+            return 200, [{'info': {'name': t['name'], 'taskId': {'value': t['id']},
+                                   'slaveId': {'value': t['slave_id']}, 'resources': t['resources'],
+                                   'labels': {'labels': t['labels']}, 'discovery': t['discovery']},
+                          'status': {'taskId': {'value': t['id']}, 'state': t['state'],
+                                     'timestamp': t['statuses'][-1]['timestamp']}} for t in tasks]
+
+    def _scheduler_pod_restart(self, body, service, pod, cmd):
+        with self.server.state.lock:
+            self._service(service)
+            task_names = self.server.state.restart_pod(service.strip('/'), pod)
+        if task_names is None:
+            raise HTTPError(404)
+        return 200, {'pod': pod, 'tasks': task_names}
+
+    def _scheduler_framework_id(self, body, service):
+        with self.server.state.lock:
+            return 200, [self._service(service).framework_id]
+
+    def _scheduler_properties(self, body, service):
+        with self.server.state.lock:
+            return 200, sorted(self._service(service).properties.keys())
+
+    def _scheduler_property(self, body, service, key):
+        with self.server.state.lock:
+            properties = self._service(service).properties
+            if key not in properties:
+                raise HTTPError(404)
+            return 200, properties[key]
+
+    def _scheduler_configs(self, body, service):
+        with self.server.state.lock:
+            return 200, list(self._service(service).config_ids)
+
+    def _scheduler_config_target_id(self, body, service):
+        with self.server.state.lock:
+            return 200, [self._service(service).config_ids[-1]]
+
+    def _scheduler_config_target(self, body, service):
+        with self.server.state.lock:
+            return 200, self._service_config(self._service(service))
+
+    def _scheduler_config(self, body, service, config_id):
+        with self.server.state.lock:
+            s = self._service(service)
+            if config_id not in s.config_ids:
+                raise HTTPError(404)
+            return 200, self._service_config(s)
+
+    def _service_config(self, service):
+        return {'name': service.name, 'role': '{}-role'.format(service.name), 'principal': '{}-principal'.format(service.name),
+                'pods': [{'type': pod_type, 'count': count, 'tasks': [{'name': 'server', 'goal': 'RUNNING',
+                                                                       'resource-set': {'cpus': 0.1, 'memory': 256}}]}
+                         for pod_type, count in sorted(service.pods.items())],
+                'options': service.options}
+
+    def _scheduler_endpoints(self, body, service):
+        with self.server.state.lock:
+            return 200, sorted(self._service(service).endpoints().keys())
+
+    def _scheduler_endpoint(self, body, service, name):
+        with self.server.state.lock:
+            endpoint = self._service(service).endpoints().get(name)
+            if endpoint is None:
+                raise HTTPError(404)
+            return 200, endpoint
+
+    # Emulator control
+
+    def _emulator_stats(self, body):
+        return 200, self.server.stats.get()
+
+    def _emulator_stats_reset(self, body):
+        self.server.stats.reset()
+        return 200, {}
+
+    def _emulator_timings(self, body):
+        self.server.state.set_timings(body)
+        return 200, self.server.state.timings
+
+    def _emulator_packages(self, body):
+        self.server.state.add_package(body['name'], body['version'], body['pods'])
+        return 200, {}
+
+    def _emulator_actions(self, body):
+        for action in (body if isinstance(body, list) else [body]):
+            self.server.state.run_action(action)
+        return 200, {}
+
+    def _emulator_reset(self, body):
+        self.server.state.reset()
+        self.server.stats.reset()
+        return 200, {}
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            print('{} {}'.format(self.client_address[0], format % args))
+
+
+class EmulatorHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self, server_address, state, verbose=False):
+        HTTPServer.__init__(self, server_address, EmulatorRequestHandler)
+        self.state = state
+        self.stats = RequestStats()
+        self.verbose = verbose
+        self.stopping = False
+
+
+class DCOSEmulator(object):
+    '''Runs the emulator in a background thread of the current process'''
+
+    def __init__(self, host='127.0.0.1', port=0, agent_count=DEFAULT_AGENT_COUNT, packages=DEFAULT_PACKAGES,
+                 verbose=False):
+        self.state = ClusterState(agent_count, packages)
+        self._server = EmulatorHTTPServer((host, port), self.state, verbose)
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return 'http://{}:{}'.format(host, port)
+
+    @property
+    def stats(self):
+        return self._server.stats
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name='emulator-http', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.stopping = True
+        self._server.shutdown()
+        self._server.server_close()
+        self.state.stop()
+
+
+def main(argv):
+    host, port, script_path, verbose = '127.0.0.1', 0, None, False
+    args = argv[1:]
+    while args:
+        arg = args.pop(0)
+        if arg == '--host' and args:
+            host = args.pop(0)
+        elif arg == '--port' and args:
+            port = int(args.pop(0))
+        elif arg == '--script' and args:
+            script_path = args.pop(0)
+        elif arg == '--verbose':
+            verbose = True
+        else:
+            print('Syntax: {} [--host 127.0.0.1] [--port 0] [--script actions.json] [--verbose]'.format(argv[0]))
+            return 1
+    emulator = DCOSEmulator(host, port, verbose=verbose)
+    if script_path:
+        with open(script_path) as script_file:
+            for action in json.load(script_file):
+                emulator.state.run_action(action)
+    # the url is printed first and alone on its line, for scripts which start the emulator:
+    print(emulator.url)
+    sys.stdout.flush()
+    emulator.start()
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        emulator.stop()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,326 @@
+#!/usr/bin/env python3
+'''Generates concurrent load against a scheduler's HTTP API, like that of dashboards and CLIs polling it,
+and reports the resulting latencies and throughput.
+
+Requests are spread across these resources, weighted by a configurable mix:
+- plans: /v1/plans and each /v1/plans/<plan>
+- pods: /v1/pods, /v1/pods/status, and each /v1/pods/<pod>/status and /v1/pods/<pod>/info
+- state: /v1/state/frameworkId, /v1/state/properties and each /v1/state/properties/<key>
+- config: /v1/configurations, /v1/configurations/targetId and /v1/configurations/target
+- endpoints: /v1/endpoints and each /v1/endpoints/<name>
+The plan, pod, property and endpoint names are listed from the scheduler at startup. All requests are
+GETs: they don't change the service.
+
+The target is the base url of the scheduler's API, either of a scheduler run locally (eg
+http://localhost:<api port>) or via adminrouter (eg https://<cluster>/service/<name>, with --token). If no
+url is provided, a local dcos_emulator.py is started with hello-world installed, and targeted instead.
+
+Results are printed as JSON: for each resource and in total, the request and error counts, responses
+per status code, latency percentiles in milliseconds, and requests per second. Responses with a 503 are
+not errors: plans return a 503 while they're incomplete. Run with:
+  $ ./scheduler_loadgen.py [url] [--mix plans=4,pods=3,state=1,config=1,endpoints=1] [--concurrency 10]
+      [--duration 30] [--rate <total requests per second>] [--token <auth token>] [--output results.json]'''
+
+import asyncio
+import contextlib
+import json
+import os.path
+import random
+import ssl
+import subprocess
+import sys
+import time
+import urllib.parse
+import urllib.request
+
+DEFAULT_MIX = {'plans': 4, 'pods': 3, 'state': 1, 'config': 1, 'endpoints': 1}
+DEFAULT_CONCURRENCY = 10
+DEFAULT_DURATION_SECONDS = 30
+REQUEST_TIMEOUT_SECONDS = 30
+
+EMULATOR_PACKAGE = 'hello-world'
+
+
+class Connection(object):
+    '''A keep-alive HTTP/1.1 connection to the scheduler, reopened whenever the server closes it'''
+
+    def __init__(self, url, token=None):
+        self._url = urllib.parse.urlparse(url)
+        self._headers = 'Host: {}\r\nAccept: application/json\r\n'.format(self._url.netloc)
+        if token:
+            self._headers += 'Authorization: token={}\r\n'.format(token)
+        self._reader = None
+        self._writer = None
+
+    async def get(self, path):
+        '''Returns (status code, body bytes)'''
+        if self._writer is None:
+            secure = self._url.scheme == 'https'
+            self._reader, self._writer = await asyncio.open_connection(
+                self._url.hostname, self._url.port or (443 if secure else 80),
+                ssl=_insecure_ssl_context() if secure else None)
+        try:
+            self._writer.write('GET {}/{} HTTP/1.1\r\n{}\r\n'.format(
+                self._url.path.rstrip('/'), path, self._headers).encode('utf-8'))
+            status, headers = await self._read_head()
+            if headers.get('transfer-encoding', '').lower() == 'chunked':
+                body = await self._read_chunked()
+            elif 'content-length' in headers:
+                body = await self._reader.readexactly(int(headers['content-length']))
+            else:
+                body = await self._reader.read()
+                headers['connection'] = 'close'
+        except Exception:
+            self.close()
+            raise
+        if headers.get('connection', '').lower() == 'close':
+            self.close()
+        return status, body
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+        self._reader, self._writer = None, None
+
+    async def _read_head(self):
+        status_line = await self._reader.readline()
+        if not status_line:
+            raise ConnectionError('Connection closed by server')
+        status = int(status_line.split()[1])
+        headers = {}
+        while True:
+            line = (await self._reader.readline()).decode('latin-1').strip()
+            if not line:
+                return status, headers
+            key, _, value = line.partition(':')
+            headers[key.strip().lower()] = value.strip()
+
+    async def _read_chunked(self):
+        body = b''
+        while True:
+            size = int((await self._reader.readline()).split(b';')[0], 16)
+            if size == 0:
+                # trailers (if any), then a blank line:
+                while (await self._reader.readline()).strip():
+                    pass
+                return body
+            body += await self._reader.readexactly(size)
+            await self._reader.readline()
+
+
+def _insecure_ssl_context():
+    # clusters under test typically use self-signed certs, as with 'core.ssl_verify = false'
+    context = ssl.create_default_context()
+    context.check_hostname = False
+    context.verify_mode = ssl.CERT_NONE
+    return context
+
+
+class Results(object):
+    '''Latencies and status codes of completed requests, per resource'''
+
+    def __init__(self, resources):
+        self._latencies = dict((resource, []) for resource in resources)
+        self._statuses = dict((resource, {}) for resource in resources)
+        self._errors = dict((resource, 0) for resource in resources)
+
+    def add(self, resource, seconds, status):
+        self._latencies[resource].append(seconds)
+        self._statuses[resource][str(status)] = self._statuses[resource].get(str(status), 0) + 1
+        if status >= 400 and status != 503:
+            self._errors[resource] += 1
+
+    def add_error(self, resource):
+        self._errors[resource] += 1
+        self._statuses[resource]['failed'] = self._statuses[resource].get('failed', 0) + 1
+
+    def summary(self, elapsed_seconds):
+        resources = dict((resource, _summarize(self._latencies[resource], self._statuses[resource],
+                                               self._errors[resource], elapsed_seconds))
+                         for resource in self._latencies.keys())
+        statuses = {}
+        for resource_statuses in self._statuses.values():
+            for status, count in resource_statuses.items():
+                statuses[status] = statuses.get(status, 0) + count
+        total = _summarize([l for latencies in self._latencies.values() for l in latencies],
+                           statuses, sum(self._errors.values()), elapsed_seconds)
+        return {'elapsed_seconds': round(elapsed_seconds, 3), 'total': total, 'resources': resources}
+
+
+def _summarize(latencies, statuses, errors, elapsed_seconds):
+    latencies = sorted(latencies)
+    summary = {
+        'requests': len(latencies),
+        'errors': errors,
+        'statuses': statuses,
+        'requests_per_second': round(len(latencies) / elapsed_seconds, 1) if elapsed_seconds else 0,
+    }
+    if latencies:
+        summary.update({
+            'mean_ms': round(1000 * sum(latencies) / len(latencies), 2),
+            'p50_ms': round(1000 * _percentile(latencies, 50), 2),
+            'p90_ms': round(1000 * _percentile(latencies, 90), 2),
+            'p99_ms': round(1000 * _percentile(latencies, 99), 2),
+            'max_ms': round(1000 * latencies[-1], 2),
+        })
+    return summary
+
+
+def _percentile(sorted_values, percent):
+    # nearest-rank: the smallest value which is >= percent% of the values
+    index = max(0, int(-(-len(sorted_values) * percent // 100)) - 1)
+    return sorted_values[index]
+
+
+def get_resource_paths(url, token=None):
+    '''Returns resource => paths to request, listing the plan, pod, property and endpoint names from the
+    scheduler'''
+    def get_json(path):
+        request = urllib.request.Request('{}/{}'.format(url.rstrip('/'), path))
+        if token:
+            request.add_header('Authorization', 'token={}'.format(token))
+        with urllib.request.urlopen(request, context=_insecure_ssl_context()) as response:
+            return json.loads(response.read().decode('utf-8'))
+
+    pods = get_json('v1/pods')
+    return {
+        'plans': ['v1/plans'] + ['v1/plans/{}'.format(plan) for plan in get_json('v1/plans')],
+        'pods': ['v1/pods', 'v1/pods/status'] + [
+            'v1/pods/{}/{}'.format(pod, info) for pod in pods for info in ['status', 'info']],
+        'state': ['v1/state/frameworkId', 'v1/state/properties'] + [
+            'v1/state/properties/{}'.format(key) for key in get_json('v1/state/properties')],
+        'config': ['v1/configurations', 'v1/configurations/targetId', 'v1/configurations/target'],
+        'endpoints': ['v1/endpoints'] + ['v1/endpoints/{}'.format(name) for name in get_json('v1/endpoints')],
+    }
+
+
+async def run_load(url, resource_paths, mix, concurrency, duration_seconds, rate=None, token=None):
+    '''Sends requests from 'concurrency' connections for the duration, each picking resources according
+    to the weights in mix, and each resource's paths in turn. If a rate is provided, requests are sent at
+    that total rate (so long as the connections keep up), rather than as fast as possible.
+    Returns the summary of the results.'''
+    resources = [resource for resource in sorted(mix.keys()) if mix[resource] > 0]
+    weights = [mix[resource] for resource in resources]
+    next_path_index = dict((resource, 0) for resource in resources)
+    results = Results(resources)
+    start = time.time()
+    deadline = start + duration_seconds
+    # when rate limited, each worker claims the next send time from the shared schedule:
+    schedule = {'next': start}
+
+    async def worker():
+        connection = Connection(url, token)
+        try:
+            while True:
+                if rate:
+                    send_time = schedule['next']
+                    schedule['next'] += 1.0 / rate
+                    if send_time >= deadline:
+                        return
+                    await asyncio.sleep(max(0, send_time - time.time()))
+                elif time.time() >= deadline:
+                    return
+                resource = random.choices(resources, weights)[0]
+                paths = resource_paths[resource]
+                path = paths[next_path_index[resource] % len(paths)]
+                next_path_index[resource] += 1
+                request_start = time.time()
+                try:
+                    status, _ = await asyncio.wait_for(connection.get(path), REQUEST_TIMEOUT_SECONDS)
+                except Exception as e:
+                    print('Request to {} failed: {}'.format(path, e), file=sys.stderr)
+                    connection.close()
+                    results.add_error(resource)
+                    continue
+                results.add(resource, time.time() - request_start, status)
+        finally:
+            connection.close()
+
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    return results.summary(time.time() - start)
+
+
+@contextlib.contextmanager
+def _emulated_scheduler():
+    '''Yields the url of a hello-world scheduler in a newly started emulator, which is stopped afterwards'''
+    process = subprocess.Popen(
+        [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'dcos_emulator.py')],
+        stdout=subprocess.PIPE, universal_newlines=True)
+    try:
+        emulator_url = process.stdout.readline().strip()
+        urllib.request.urlopen(urllib.request.Request(
+            '{}/package/install'.format(emulator_url), method='POST',
+            data=json.dumps({'packageName': EMULATOR_PACKAGE}).encode('utf-8'))).read()
+        service_url = '{}/service/{}'.format(emulator_url, EMULATOR_PACKAGE)
+        # wait for the deployment, so that all pods and endpoints are listed:
+        for _ in range(300):
+            try:
+                if urllib.request.urlopen('{}/v1/plans/deploy'.format(service_url)).status == 200:
+                    break
+            except Exception:
+                pass
+            time.sleep(0.1)
+        print('Started emulated {} scheduler at {}'.format(EMULATOR_PACKAGE, service_url), file=sys.stderr)
+        yield service_url
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def _parse_mix(mix_arg):
+    mix = {}
+    for entry in mix_arg.split(','):
+        resource, _, weight = entry.partition('=')
+        if resource not in DEFAULT_MIX:
+            raise ValueError('Unknown resource "{}", expected one of: {}'.format(
+                resource, ', '.join(sorted(DEFAULT_MIX.keys()))))
+        mix[resource] = float(weight or 1)
+    return mix
+
+
+def main(argv):
+    url, mix, concurrency, duration_seconds, rate, token, output_path = (
+        None, DEFAULT_MIX, DEFAULT_CONCURRENCY, DEFAULT_DURATION_SECONDS, None, None, None)
+    args = argv[1:]
+    try:
+        while args:
+            arg = args.pop(0)
+            if arg == '--mix' and args:
+                mix = _parse_mix(args.pop(0))
+            elif arg == '--concurrency' and args:
+                concurrency = int(args.pop(0))
+            elif arg == '--duration' and args:
+                duration_seconds = float(args.pop(0))
+            elif arg == '--rate' and args:
+                rate = float(args.pop(0))
+            elif arg == '--token' and args:
+                token = args.pop(0)
+            elif arg == '--output' and args:
+                output_path = args.pop(0)
+            elif not arg.startswith('--') and url is None:
+                url = arg
+            else:
+                raise ValueError('Unexpected argument: {}'.format(arg))
+    except ValueError as e:
+        print('{}\nSyntax: {} [url] [--mix plans=4,pods=3,state=1,config=1,endpoints=1] [--concurrency 10] '
+              '[--duration 30] [--rate <requests/s>] [--token <auth token>] [--output <file>]'.format(e, argv[0]))
+        return 1
+
+    with (contextlib.nullcontext(url) if url else _emulated_scheduler()) as target_url:
+        resource_paths = get_resource_paths(target_url, token)
+        print('Sending {} for {}s from {} connections to {}: {}'.format(
+            'up to {} requests/s'.format(rate) if rate else 'requests', duration_seconds, concurrency,
+            target_url, json.dumps(mix, sort_keys=True)), file=sys.stderr)
+        summary = asyncio.run(run_load(target_url, resource_paths, mix, concurrency, duration_seconds, rate, token))
+    report = json.dumps(dict(summary, url=target_url, mix=mix, concurrency=concurrency, rate=rate),
+                        indent=2, sort_keys=True)
+    if output_path:
+        with open(output_path, 'w') as output_file:
+            output_file.write(report + '\n')
+    else:
+        print(report)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,141 @@
+'''Utilities relating to querying Cosmos and service HTTP APIs in-process, rather than forking the dcos CLI.
+
+Each call returns the parsed JSON response. If the API can't be reached directly, the equivalent CLI
+command is run instead. Service calls assume the service's CLI module is named after the service,
+which holds for default installs.'''
+
+import json
+import requests.exceptions
+import sdk_cmd
+import shakedown
+
+
+def describe_package(package_name, package_version=None):
+    payload = {'packageName': package_name}
+    if package_version:
+        payload['packageVersion'] = package_version
+    cli_cmd = 'package describe {}'.format(package_name)
+    if package_version:
+        cli_cmd += ' --package-version={}'.format(package_version)
+    return _with_cli_fallback(
+        lambda: _cosmos_request('package/describe', payload),
+        cli_cmd)
+
+
+def get_package_version(package_name):
+    '''Returns the version of the package which would currently be installed by default'''
+    description = describe_package(package_name)
+    # the CLI fallback may print the package without the enclosing response object:
+    return description.get('package', description)['version']
+
+
+def list_repos():
+    return _with_cli_fallback(
+        lambda: _cosmos_request('package/repository/list', {}),
+        'package repo list --json')['repositories']
+
+
+def add_repo(repo_name, repo_url, index=None):
+    '''Returns the updated list of repositories'''
+    payload = {'name': repo_name, 'uri': repo_url}
+    cli_cmd = 'package repo add {} {}'.format(repo_name, repo_url)
+    if index is not None:
+        payload['index'] = index
+        cli_cmd = 'package repo add --index={} {} {}'.format(index, repo_name, repo_url)
+    return _with_cli_fallback(
+        lambda: _cosmos_request('package/repository/add', payload)['repositories'],
+        cli_cmd,
+        parse=lambda stdout: list_repos())
+
+
+def remove_repo(repo_name):
+    '''Returns the updated list of repositories'''
+    return _with_cli_fallback(
+        lambda: _cosmos_request('package/repository/delete', {'name': repo_name})['repositories'],
+        'package repo remove {}'.format(repo_name),
+        parse=lambda stdout: list_repos())
+
+
+def get_pods(service_name):
+    return _service_get(service_name, 'v1/pods', 'pods list')
+
+
+def get_pod_statuses(service_name):
+    return _service_get(service_name, 'v1/pods/status', 'pods status')
+
+
+def get_pod_status(service_name, pod_name):
+    return _service_get(service_name, 'v1/pods/{}/status'.format(pod_name), 'pods status {}'.format(pod_name))
+
+
+def get_pod_info(service_name, pod_name):
+    return _service_get(service_name, 'v1/pods/{}/info'.format(pod_name), 'pods info {}'.format(pod_name))
+
+
+def restart_pod(service_name, pod_name):
+    return _service_post(service_name, 'v1/pods/{}/restart'.format(pod_name), 'pods restart {}'.format(pod_name))
+
+
+def replace_pod(service_name, pod_name):
+    return _service_post(service_name, 'v1/pods/{}/replace'.format(pod_name), 'pods replace {}'.format(pod_name))
+
+
+def get_plans(service_name):
+    return _service_get(service_name, 'v1/plans', 'plan list')
+
+
+def get_plan(service_name, plan):
+    return _service_get(service_name, 'v1/plans/{}'.format(plan), 'plan show {}'.format(plan))
+
+
+def get_state_properties(service_name):
+    return _service_get(service_name, 'v1/state/properties', 'state properties')
+
+
+def get_state_property(service_name, key):
+    return _service_get(service_name, 'v1/state/properties/{}'.format(key), 'state property {}'.format(key))
+
+
+def get_framework_id(service_name):
+    return _service_get(service_name, 'v1/state/frameworkId', 'state framework_id')
+
+
+def _cosmos_request(action, payload):
+    # eg 'package/repository/list' => 'application/vnd.dcos.package.repository.list-request+json;...'
+    media_type = 'application/vnd.dcos.{}-{{}}+json;charset=utf-8;version=v1'.format(action.replace('/', '.'))
+    response = sdk_cmd.request(
+        'post',
+        '{}/{}'.format(shakedown.dcos_url().rstrip('/'), action),
+        retry=False,
+        json=payload,
+        headers={
+            'Content-Type': media_type.format('request'),
+            'Accept': media_type.format('response')})
+    return response.json()
+
+
+def _service_get(service_name, path, cli_cmd):
+    return _with_cli_fallback(
+        lambda: sdk_cmd.request('get', _service_url(service_name, path), retry=False).json(),
+        '{} {}'.format(service_name, cli_cmd))
+
+
+def _service_post(service_name, path, cli_cmd):
+    return _with_cli_fallback(
+        lambda: sdk_cmd.request('post', _service_url(service_name, path), retry=False).json(),
+        '{} {}'.format(service_name, cli_cmd))
+
+
+def _service_url(service_name, path):
+    return '{}/{}'.format(shakedown.dcos_service_url(service_name), path)
+
+
+def _with_cli_fallback(fn, cli_cmd, parse=json.loads):
+    '''Runs fn(), falling back to the equivalent CLI command if the API couldn't be reached at all,
+    with parse() converting the CLI's stdout to fn()'s return format. Error responses from the API are
+    raised as-is: the CLI would get the same response.'''
+    try:
+        return fn()
+    except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+        print('Failed to reach API directly, falling back to "dcos {}": {}'.format(cli_cmd, e))
+    return parse(sdk_cmd.run_cli(cli_cmd))
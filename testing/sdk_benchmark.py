@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+'''Benchmarks the sdk_* helpers against a local DC/OS emulator (see dcos_emulator.py), so that changes
+to their polling or HTTP usage show up as numbers rather than as slower CI runs across every framework.
+
+For each task count, a package with that many tasks is installed, and each of these flows is measured:
+- install: sdk_install.install()
+- get_config: sdk_marathon.get_config() with nothing cached, then get_config_cached: the same call again
+- update_app: sdk_marathon.update_app() with a changed env
+- check_tasks_updated: sdk_tasks.check_tasks_updated() until all tasks are relaunched by the update
+- get_plan: sdk_plan.get_plan() of the deploy plan, which waits for the update to complete
+- uninstall: sdk_install.uninstall(). The janitor is skipped: the emulator has no nodes to run it on.
+
+Each result lists the flow's wall time and CPU time (of this process only: the emulator runs separately),
+and the requests and bytes received by the emulator, in total and per emulated API route. The results are
+printed as JSON, while the helpers' own output goes to stderr.
+
+Requires the test requirements (shakedown and the dcos CLI modules). Run with:
+  $ ./sdk_benchmark.py [--tasks 10,100,1000] [--launch-seconds 1] [--url http://<running emulator>] [--output results.json]'''
+
+import contextlib
+import json
+import os
+import os.path
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+import sdk_cmd
+import sdk_install
+import sdk_marathon
+import sdk_plan
+import sdk_tasks
+import shakedown
+
+DEFAULT_TASK_COUNTS = [10, 100, 1000]
+# Name of the emulated package (and of the pod type of its tasks), suffixed with the task count
+PACKAGE_PREFIX = 'benchmark'
+
+
+def run_benchmarks(emulator_url, task_counts, launch_seconds):
+    _emulator_request(emulator_url, 'PUT', 'emulator/timings', {
+        'task_launch_seconds': launch_seconds,
+        'deployment_seconds': launch_seconds,
+        'uninstall_seconds': launch_seconds})
+    results = []
+    for task_count in task_counts:
+        package_name = '{}-{}'.format(PACKAGE_PREFIX, task_count)
+        _emulator_request(emulator_url, 'POST', 'emulator/packages', {
+            'name': package_name, 'version': '1.0.0', 'pods': {PACKAGE_PREFIX: task_count}})
+        results.extend(_run_flows(emulator_url, package_name, task_count))
+    return results
+
+
+def _run_flows(emulator_url, service_name, task_count):
+    # start each task count from a clean slate, as a test module would:
+    sdk_cmd.reset_session()
+    sdk_marathon.invalidate_config()
+    sdk_tasks.invalidate_snapshots()
+    results = []
+
+    def measure(flow, fn):
+        result, value = _measure(emulator_url, flow, task_count, fn)
+        results.append(result)
+        print('Benchmarked {} with {} tasks: {}'.format(flow, task_count, json.dumps(result)))
+        return value
+
+    measure('install', lambda: sdk_install.install(service_name, task_count))
+    measure('get_config', lambda: sdk_marathon.get_config(service_name))
+    config = measure('get_config_cached', lambda: sdk_marathon.get_config(service_name))
+    old_task_ids = sdk_tasks.get_task_ids(service_name, PACKAGE_PREFIX)
+    config.setdefault('env', {})['BENCHMARK_UPDATE'] = str(time.time())
+    measure('update_app', lambda: sdk_marathon.update_app(service_name, config))
+    measure('check_tasks_updated', lambda: sdk_tasks.check_tasks_updated(service_name, PACKAGE_PREFIX, old_task_ids))
+    measure('get_plan', lambda: sdk_plan.get_plan(service_name, 'deploy'))
+    with _without_janitor():
+        measure('uninstall', lambda: sdk_install.uninstall(service_name))
+    return results
+
+
+def _measure(emulator_url, flow, task_count, fn):
+    '''Returns (result, fn's return value)'''
+    _emulator_request(emulator_url, 'POST', 'emulator/stats/reset')
+    client_before = sdk_cmd.connection_stats()
+    wall_start = time.time()
+    cpu_start = time.process_time()
+    value = fn()
+    cpu_seconds = time.process_time() - cpu_start
+    wall_seconds = time.time() - wall_start
+    client_after = sdk_cmd.connection_stats()
+
+    # leave out our own calls to the control API:
+    routes = {name: stats for name, stats in _emulator_request(emulator_url, 'GET', 'emulator/stats')['routes'].items()
+              if not name.startswith('emulator_')}
+    result = {
+        'flow': flow,
+        'tasks': task_count,
+        'wall_seconds': round(wall_seconds, 3),
+        'cpu_seconds': round(cpu_seconds, 3),
+        'requests': sum(stats['requests'] for stats in routes.values()),
+        'bytes_in': sum(stats['bytes_in'] for stats in routes.values()),
+        'bytes_out': sum(stats['bytes_out'] for stats in routes.values()),
+        'new_connections': client_after['new_connections'] - client_before['new_connections'],
+        'routes': routes,
+    }
+    return result, value
+
+
+@contextlib.contextmanager
+def _without_janitor():
+    '''Skips the commands which uninstall() runs on the master via SSH'''
+    run_command_on_master = shakedown.run_command_on_master
+    shakedown.run_command_on_master = lambda *args, **kwargs: (True, '')
+    try:
+        yield
+    finally:
+        shakedown.run_command_on_master = run_command_on_master
+
+
+def _emulator_request(emulator_url, method, path, payload=None):
+    # sent separately from sdk_cmd's session, so as not to affect its connection stats:
+    request = urllib.request.Request(
+        '{}/{}'.format(emulator_url.rstrip('/'), path),
+        data=json.dumps(payload).encode('utf-8') if payload is not None else None,
+        method=method)
+    with urllib.request.urlopen(request) as response:
+        return json.loads(response.read().decode('utf-8'))
+
+
+@contextlib.contextmanager
+def _emulator(emulator_url):
+    '''Yields the url of the provided emulator, or of a newly started one which is stopped afterwards'''
+    if emulator_url:
+        yield emulator_url
+        return
+    process = subprocess.Popen(
+        [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'dcos_emulator.py')],
+        stdout=subprocess.PIPE, universal_newlines=True)
+    try:
+        yield process.stdout.readline().strip()
+    finally:
+        process.terminate()
+        process.wait()
+
+
+@contextlib.contextmanager
+def _dcos_config(emulator_url):
+    '''Points the dcos modules (and therefore shakedown) at the emulator via a temporary DCOS_CONFIG'''
+    config_dir = tempfile.mkdtemp(prefix='sdk-benchmark-')
+    config_path = os.path.join(config_dir, 'dcos.toml')
+    with open(config_path, 'w') as config_file:
+        config_file.write('[core]\ndcos_url = "{}"\ndcos_acs_token = "emulator-token"\nssl_verify = "false"\n'.format(
+            emulator_url))
+    # the CLI refuses to use a config which is readable by others:
+    os.chmod(config_path, 0o600)
+    previous = os.environ.get('DCOS_CONFIG')
+    os.environ['DCOS_CONFIG'] = config_path
+    try:
+        yield
+    finally:
+        if previous is None:
+            del os.environ['DCOS_CONFIG']
+        else:
+            os.environ['DCOS_CONFIG'] = previous
+        shutil.rmtree(config_dir, ignore_errors=True)
+
+
+def main(argv):
+    task_counts, launch_seconds, emulator_url, output_path = DEFAULT_TASK_COUNTS, 1, None, None
+    args = argv[1:]
+    while args:
+        arg = args.pop(0)
+        if arg == '--tasks' and args:
+            task_counts = [int(count) for count in args.pop(0).split(',')]
+        elif arg == '--launch-seconds' and args:
+            launch_seconds = float(args.pop(0))
+        elif arg == '--url' and args:
+            emulator_url = args.pop(0)
+        elif arg == '--output' and args:
+            output_path = args.pop(0)
+        else:
+            print('Syntax: {} [--tasks 10,100,1000] [--launch-seconds 1] [--url <emulator url>] [--output <file>]'.format(
+                argv[0]))
+            return 1
+
+    start = time.time()
+    with _emulator(emulator_url) as url, _dcos_config(url), contextlib.redirect_stdout(sys.stderr):
+        results = run_benchmarks(url, task_counts, launch_seconds)
+    report = json.dumps({
+        'timestamp': int(start),
+        'python': platform.python_version(),
+        'task_launch_seconds': launch_seconds,
+        'results': results,
+    }, indent=2, sort_keys=True)
+    if output_path:
+        with open(output_path, 'w') as output_file:
+            output_file.write(report + '\n')
+    else:
+        print(report)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -1,16 +1,34 @@
 '''Utilities relating to running commands and HTTP requests'''
 
-import dcos.http
+import dcos.config
+import dcos.errors
+import requests
+import requests.adapters
 import sdk_spin
 import shakedown
 
+import threading
+
+# Connections kept open per host. Requests beyond this open (and then discard) an extra connection rather
+# than waiting for a free one, so that a leaked connection, eg of an unclosed streaming response, can't
+# leave later requests waiting forever.
+POOL_MAXSIZE = 10
+# Distinct hosts which get their own pool (adminrouter, plus any directly accessed services).
+POOL_HOSTS = 10
+DEFAULT_TIMEOUT_SECONDS = 60
+
+_session = None
+_session_lock = threading.Lock()
+
 
 def request(method, url, retry=True, **kwargs):
     def fn():
-        response = dcos.http.request(method, url, **kwargs)
+        response = _send(method, url, **kwargs)
         print('Got {} for {} {} (args: {})'.format(
             response.status_code, method.upper(), url, kwargs))
-        response.raise_for_status()
+        if not 200 <= response.status_code < 300:
+            # as raised by dcos.http.request(), which callers may already be handling:
+            raise dcos.errors.DCOSHTTPException(response)
         return response
     if retry:
         return sdk_spin.time_wait_return(lambda: fn())
@@ -18,6 +36,68 @@ def request(method, url, retry=True, **kwargs):
         return fn()
 
 
+def get_session():
+    '''Returns the shared keep-alive session used by request(), creating it if needed'''
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(
+                pool_connections=POOL_HOSTS, pool_maxsize=POOL_MAXSIZE, pool_block=False)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            session.verify = _get_ssl_verify()
+            _session = session
+        return _session
+
+
+def connection_stats():
+    '''Returns counts of requests sent via the shared session, and of how many of them needed a new
+    connection (TCP+TLS handshake) vs reused an already open one.'''
+    stats = {'requests': 0, 'new_connections': 0, 'reused_connections': 0}
+    with _session_lock:
+        session = _session
+    if session is None:
+        return stats
+    for adapter in set(session.adapters.values()):
+        pools = adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools[key]
+            stats['requests'] += pool.num_requests
+            stats['new_connections'] += pool.num_connections
+    stats['reused_connections'] = stats['requests'] - stats['new_connections']
+    return stats
+
+
+def reset_session():
+    '''Closes all pooled connections, eg after the cluster or its credentials have changed'''
+    global _session
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+        _session = None
+
+
+def _send(method, url, **kwargs):
+    # the token is refetched on every request, in case the CLI has been logged in again:
+    headers = kwargs.pop('headers', {}).copy()
+    token = shakedown.dcos_acs_token()
+    if token:
+        headers['Authorization'] = 'token={}'.format(token)
+    kwargs.setdefault('timeout', DEFAULT_TIMEOUT_SECONDS)
+    return get_session().request(method, url, headers=headers, **kwargs)
+
+
+def _get_ssl_verify():
+    # same semantics as the CLI: 'true', 'false', or a path to a CA bundle
+    ssl_verify = dcos.config.get_config_val('core.ssl_verify')
+    if ssl_verify is None or str(ssl_verify).lower() == 'true':
+        return True
+    if str(ssl_verify).lower() == 'false':
+        return False
+    return ssl_verify
+
+
 def run_cli(cmd):
     (stdout, stderr, ret) = shakedown.run_dcos_command(cmd)
     if ret != 0:
@@ -1,14 +1,19 @@
 '''Utilities relating to installing services'''
 
 import collections
+import concurrent.futures
 import dcos.errors
-import dcos.marathon
+import sdk_marathon
 import sdk_spin
 import sdk_tasks
 import shakedown
 
 import os
 import time
+import traceback
+
+# Upper bound on the number of services which install_many()/uninstall_many() operate on at once
+MAX_CONCURRENT_SERVICES = 8
 
 
 def install(package_name, running_task_count, service_name=None, additional_options={}, package_version=None):
@@ -21,27 +26,12 @@ def install(package_name, running_task_count, service_name=None, additional_opti
     # to give some visibility, install in the following order:
     # 1. install package
     shakedown.install_package(package_name, package_version=package_version, options_json=merged_options)
+    sdk_marathon.invalidate_config(service_name)
     # 2. wait for expected tasks to come up
     print("Waiting for expected tasks to come up...")
     sdk_tasks.check_running(service_name, running_task_count)
     # 3. check service health
-    marathon_client = dcos.marathon.create_client()
-
-    def fn():
-        # TODO(nickbp): upstream fix to shakedown, which currently checks for ANY deployments rather
-        #               than the one we care about
-        deploying_apps = set([])
-        print("Getting deployments")
-        deployments = marathon_client.get_deployments()
-        print("Found {} deployments".format(len(deployments)))
-        for d in deployments:
-            print("Deployment: {}".format(d))
-            for a in d.get('affectedApps', []):
-                print("Adding {}".format(a))
-                deploying_apps.add(a)
-        print('Checking deployment of {} has ended:\n- Deploying apps: {}'.format(service_name, deploying_apps))
-        return not '/{}'.format(service_name) in deploying_apps
-    sdk_spin.time_wait_noisy(lambda: fn(), timeout_seconds=30)
+    sdk_marathon.wait_for_deployment(service_name, timeout_seconds=30)
     print('Install done after {}'.format(sdk_spin.pretty_time(time.time() - start)))
 
 
@@ -51,6 +41,7 @@ def uninstall(service_name, package_name=None):
     if package_name is None:
         package_name = service_name
     print('Uninstalling/janitoring {}'.format(service_name))
+    sdk_marathon.invalidate_config(service_name)
     try:
         shakedown.uninstall_package_and_wait(package_name, service_name=service_name)
     except (dcos.errors.DCOSException, ValueError) as e:
@@ -74,6 +65,58 @@ def uninstall(service_name, package_name=None):
         sdk_spin.pretty_time(finish - start)))
 
 
+def install_many(installs, max_workers=MAX_CONCURRENT_SERVICES):
+    '''Installs several independent services concurrently. Each entry is a dict of install() arguments,
+    eg {'package_name': 'hdfs', 'running_task_count': 10}. Once all installs have finished, raises an
+    exception listing every install which failed.'''
+    _run_many('Install', [
+        (i.get('service_name') or i['package_name'], lambda i=i: install(**i)) for i in installs
+    ], max_workers)
+
+
+def uninstall_many(uninstalls, max_workers=MAX_CONCURRENT_SERVICES):
+    '''Uninstalls and janitors several services concurrently. Each entry is either a service name, or a
+    dict of uninstall() arguments. Once all uninstalls have finished, raises an exception listing every
+    uninstall which failed.'''
+    uninstalls = [{'service_name': u} if isinstance(u, str) else u for u in uninstalls]
+    _run_many('Uninstall', [
+        (u['service_name'], lambda u=u: uninstall(**u)) for u in uninstalls
+    ], max_workers)
+
+
+def _run_many(operation, calls, max_workers):
+    start = time.time()
+    durations = {}
+    errors = {}
+
+    def run(service_name, fn):
+        call_start = time.time()
+        try:
+            fn()
+        except Exception as e:
+            traceback.print_exc()
+            errors[service_name] = e
+        finally:
+            durations[service_name] = time.time() - call_start
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(calls)))) as executor:
+        for future in [executor.submit(run, service_name, fn) for service_name, fn in calls]:
+            future.result()
+
+    print('{} of {} services done after {}:\n{}'.format(
+        operation,
+        len(calls),
+        sdk_spin.pretty_time(time.time() - start),
+        '\n'.join(['- {}: {} ({})'.format(
+            service_name,
+            'FAILED' if service_name in errors else 'OK',
+            sdk_spin.pretty_time(durations[service_name])) for service_name, fn in calls])))
+    if errors:
+        raise Exception('{} failed for {} of {} services:\n{}'.format(
+            operation, len(errors), len(calls),
+            '\n'.join(['- {}: {}'.format(service_name, e) for service_name, e in sorted(errors.items())])))
+
+
 def get_package_options(additional_options={}):
     # expected SECURITY values: 'permissive', 'strict', 'disabled'
     if os.environ.get('SECURITY', '') == 'strict':
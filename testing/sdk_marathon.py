@@ -1,28 +1,185 @@
 '''Utilities relating to interaction with Marathon'''
 
+import collections
+import copy
+import json
 import sdk_cmd
 import sdk_spin
+import sdk_tasks
 import shakedown
+import threading
+import time
+
+# app name => (version, config) of the app's most recently fetched config
+_config_cache = {}
+_config_cache_lock = threading.Lock()
+
+# Marathon events which signal that a deployment is no longer in progress
+DEPLOYMENT_DONE_EVENTS = ['deployment_success', 'deployment_failed']
+
+# Ids of deployments reported as done by the /v2/events stream, if it's been started, oldest first. Each id
+# is dropped once it's been waited on, and the oldest are dropped beyond MAX_FINISHED_DEPLOYMENTS, eg of
+# other apps' deployments which nobody waits on.
+MAX_FINISHED_DEPLOYMENTS = 1000
+_finished_deployments = collections.OrderedDict()
+_finished_deployments_lock = threading.Lock()
+_event_stream_lock = threading.Lock()
+_event_stream_thread = None
 
 
 def get_config(app_name):
-    def fn():
-        return sdk_cmd.request('get', api_url('apps/{}'.format(app_name)), retry=False)
+    '''Returns the app's Marathon config, minus 'uris' and 'version'. The config is fetched once and then
+    reused until the app is changed via update_app() or patch_env(), or get_deployment_ids() sees a newer
+    version of the app. After changing the app by other means, eg a test's own Marathon client, call
+    invalidate_config().'''
+    with _config_cache_lock:
+        cached = _config_cache.get(app_name)
+    if cached is None:
+        def fn():
+            return sdk_cmd.request('get', api_url('apps/{}'.format(app_name)), retry=False)
+
+        config = sdk_spin.time_wait_return(lambda: fn()).json()['app']
+        del config['uris']
+        version = config.pop('version')
+        cached = (version, config)
+        with _config_cache_lock:
+            _config_cache[app_name] = cached
+    # callers are free to modify the returned config, e.g. to pass it back to update_app():
+    return copy.deepcopy(cached[1])
+
 
-    config = sdk_spin.time_wait_return(lambda: fn()).json()['app']
-    del config['uris']
-    del config['version']
+def get_config_version(app_name):
+    '''Returns the Marathon app version which get_config() currently returns'''
+    get_config(app_name)
+    with _config_cache_lock:
+        return _config_cache[app_name][0]
 
-    return config
+
+def invalidate_config(app_name=None):
+    '''Discards cached configs for the app, or for all apps if none is specified. Only needed if the app
+    was changed without using update_app() or patch_env().'''
+    with _config_cache_lock:
+        if app_name is None:
+            _config_cache.clear()
+        else:
+            _config_cache.pop(app_name, None)
 
 
 def update_app(app_name, config):
+    '''Returns the id of the resulting Marathon deployment, for use with wait_for_deployment()'''
+    return _put_app(app_name, config)
+
+
+def patch_env(app_name, env_changes):
+    '''Updates only the listed env values of the app, removing any whose value is None. Only the
+    resulting env is sent to Marathon, rather than the whole app config. Returns the id of the
+    resulting Marathon deployment, or None if the env was already up to date.'''
+    env = get_config(app_name).get('env', {})
+    new_env = env.copy()
+    for key, value in env_changes.items():
+        if value is None:
+            new_env.pop(key, None)
+        else:
+            new_env[key] = value
+    if new_env == env:
+        print('Env of {} is already up to date: {}'.format(app_name, env_changes))
+        return None
+    return _put_app(app_name, {'env': new_env})
+
+
+def _put_app(app_name, config):
     response = sdk_cmd.request('put', api_url('apps/{}'.format(app_name)), json=config)
     assert response.ok, "Marathon configuration update failed for {} with config {}".format(app_name, config)
+    invalidate_config(app_name)
+    # the update will result in the service's tasks being relaunched:
+    sdk_tasks.invalidate_snapshots(app_name)
+    return response.json().get('deploymentId')
+
+
+def get_deployment_ids(app_name):
+    '''Returns the ids of the deployments in progress for the app. Unlike /v2/deployments, this only
+    fetches the app's own deployments rather than every deployment on the cluster.'''
+    app = sdk_cmd.request('get', api_url('apps/{}'.format(app_name)), retry=False).json()['app']
+    # we got the app's current version for free, drop any cached config for an older version:
+    with _config_cache_lock:
+        cached = _config_cache.get(app_name)
+        if cached is not None and cached[0] != app.get('version'):
+            del _config_cache[app_name]
+    return [d['id'] for d in app.get('deployments', [])]
+
+
+def wait_for_deployment(app_name, deployment_id=None, timeout_seconds=sdk_spin.DEFAULT_TIMEOUT):
+    '''Waits for the specified deployment of the app to finish, or for all of the app's deployments to
+    finish if no deployment id is provided. If the event stream has been started, completion is
+    noticed as soon as Marathon reports it, rather than on the next poll.'''
+    def fn():
+        if deployment_id is not None and _pop_finished_deployment(deployment_id):
+            return True
+        deployment_ids = get_deployment_ids(app_name)
+        if deployment_id is None:
+            print('Waiting for deployments of {} to finish: {}'.format(app_name, deployment_ids))
+            return len(deployment_ids) == 0
+        print('Waiting for deployment {} of {} to finish'.format(deployment_id, app_name))
+        return deployment_id not in deployment_ids
+    sdk_spin.time_wait_noisy(lambda: fn(), timeout_seconds=timeout_seconds)
+    if deployment_id is not None:
+        # in case the wait was ended by polling, before the event stream reported the deployment:
+        _pop_finished_deployment(deployment_id)
+
+
+def start_event_stream():
+    '''Subscribes to Marathon's /v2/events stream in a background thread, so that deployment waits are
+    woken up as soon as a deployment finishes. Calling this more than once has no further effect.'''
+    global _event_stream_thread
+    with _event_stream_lock:
+        if _event_stream_thread is not None and _event_stream_thread.is_alive():
+            return
+        _event_stream_thread = threading.Thread(
+            target=_follow_event_stream, name='marathon-events', daemon=True)
+        _event_stream_thread.start()
+
+
+def _follow_event_stream():
+    while True:
+        response = None
+        try:
+            response = sdk_cmd.request(
+                'get', api_url('events'), retry=False, stream=True,
+                headers={'Accept': 'text/event-stream'},
+                timeout=(sdk_cmd.DEFAULT_TIMEOUT_SECONDS, None))
+            for line in response.iter_lines(decode_unicode=True):
+                # only the 'data: {...}' lines are of interest, the 'event: ...' lines repeat its eventType
+                if not line or not line.startswith('data:'):
+                    continue
+                event = json.loads(line[len('data:'):])
+                if event.get('eventType') in DEPLOYMENT_DONE_EVENTS:
+                    _add_finished_deployment(event.get('id'))
+                    sdk_spin.wake_up()
+        except Exception as e:
+            print('Marathon event stream failed, reconnecting: {}'.format(e))
+        finally:
+            # otherwise the connection would remain checked out of the session's pool:
+            if response is not None:
+                response.close()
+        time.sleep(sdk_spin.MIN_INTERVAL_SECONDS)
+
+
+def _add_finished_deployment(deployment_id):
+    with _finished_deployments_lock:
+        _finished_deployments[deployment_id] = True
+        while len(_finished_deployments) > MAX_FINISHED_DEPLOYMENTS:
+            _finished_deployments.popitem(last=False)
+
+
+def _pop_finished_deployment(deployment_id):
+    '''Returns whether the event stream has reported the deployment as done, forgetting it if so'''
+    with _finished_deployments_lock:
+        return _finished_deployments.pop(deployment_id, None) is not None
 
 
 def destroy_app(app_name):
     sdk_cmd.request('delete', api_url_with_param('apps', app_name))
+    invalidate_config(app_name)
 
     # Make sure the scheduler has been destroyed
     sdk_spin.time_wait_noisy(lambda: (shakedown.get_service(app_name) is None))
@@ -1,29 +1,24 @@
 '''Utilities relating to package management'''
 
-import shakedown
-import sdk_cmd
+import sdk_api
 import sdk_spin
 
-import re
-
 
 def get_pkg_version(package_name):
-    return re.search(
-        r'"version": "(\S+)"',
-        sdk_cmd.run_cli('dcos package describe {}'.format(package_name))).group(1)
+    return sdk_api.get_package_version(package_name)
 
 
 def get_repo_list():
-    return shakedown.get_package_repos()['repositories']
+    return sdk_api.list_repos()
 
 
 def remove_repo(repo_name, package_name, prev_version):
-    assert shakedown.remove_package_repo(repo_name)
+    sdk_api.remove_repo(repo_name)
     check_default_version_available(package_name, prev_version)
 
 
 def add_repo(repo_name, repo_url, package_name, prev_version):
-    assert shakedown.add_package_repo(repo_name, repo_url, 0)
+    sdk_api.add_repo(repo_name, repo_url, 0)
     # Make sure the new repo packages are available
     # The above invocation's effects don't occur immediately
     # so we spin until they do
@@ -1,6 +1,6 @@
 '''Utilities relating to interaction with service plans'''
 
-import dcos
+import sdk_cmd
 import sdk_spin
 import shakedown
 
@@ -18,14 +18,16 @@ def start_sidecar_plan(service_name, parameters=None):
 
 
 def start_plan(service_name, plan, parameters=None):
-    return dcos.http.post("{}/v1/plans/{}/start".format(shakedown.dcos_service_url(service_name), plan),
-                          json=parameters if parameters is not None else {})
+    return sdk_cmd.request(
+        'post',
+        "{}/v1/plans/{}/start".format(shakedown.dcos_service_url(service_name), plan),
+        retry=False,
+        json=parameters if parameters is not None else {})
 
 
 def get_plan(service_name, plan):
     def fn():
-        response = dcos.http.get("{}/v1/plans/{}".format(shakedown.dcos_service_url(service_name), plan))
-        response.raise_for_status()
-        return response
+        return sdk_cmd.request(
+            'get', "{}/v1/plans/{}".format(shakedown.dcos_service_url(service_name), plan), retry=False)
 
     return sdk_spin.time_wait_return(lambda: fn())
@@ -2,16 +2,49 @@
 
 import shakedown
 
+import random
+import threading
 import time
 import traceback
 
 DEFAULT_TIMEOUT=15 * 60
 
-#TODO(nickbp): Upstream into shakedown's time_wait()
+# Interval between predicate evaluations: starts short to catch quick transitions, then backs off
+# towards the max for operations which take a while. Each sleep is randomized by +/- JITTER so that
+# parallel waiters don't all hit the cluster in lockstep.
+MIN_INTERVAL_SECONDS=1
+MAX_INTERVAL_SECONDS=10
+BACKOFF_FACTOR=1.5
+JITTER=0.2
 
+# Minimum interval between polls of a given endpoint, shared across all waiters in the process.
+# Waiters opt in by passing endpoint='...'. See set_endpoint_interval().
+_endpoint_intervals = {}
+_endpoint_last_poll = {}
+_endpoint_lock = threading.Lock()
 
-def time_wait_return(predicate, timeout_seconds=DEFAULT_TIMEOUT, ignore_exceptions=True):
-    '''Wrapper of shakedown's spinner which returns the first value that doesn't evaluate as falsy'''
+# Incremented by wake_up(). Sleeping waiters watch for a change and re-evaluate immediately.
+_wakeup_generation = 0
+_wakeup_condition = threading.Condition()
+
+
+def set_endpoint_interval(endpoint, seconds):
+    '''Sets the minimum interval between predicate evaluations which query the named endpoint'''
+    with _endpoint_lock:
+        _endpoint_intervals[endpoint] = seconds
+
+
+def wake_up():
+    '''Early wake-up hook for event sources (eg the Marathon/Mesos event streams): causes all
+    sleeping waiters to re-evaluate their predicates now, and to reset their backoff.'''
+    global _wakeup_generation
+    with _wakeup_condition:
+        _wakeup_generation += 1
+        _wakeup_condition.notify_all()
+
+
+def time_wait_return(predicate, timeout_seconds=DEFAULT_TIMEOUT, ignore_exceptions=True, endpoint=None):
+    '''Wrapper of time_wait_noisy() which returns the first value that doesn't evaluate as falsy'''
     ret = None
     def wrapper():
         nonlocal ret
@@ -28,12 +61,13 @@ def time_wait_return(predicate, timeout_seconds=DEFAULT_TIMEOUT, ignore_exceptio
             else:
                 raise
     time_wait_noisy(
-        lambda: wrapper(), timeout_seconds=timeout_seconds, ignore_exceptions=ignore_exceptions)
+        lambda: wrapper(), timeout_seconds=timeout_seconds, ignore_exceptions=ignore_exceptions, endpoint=endpoint)
     return ret
 
 
-def time_wait_noisy(predicate, timeout_seconds=DEFAULT_TIMEOUT, ignore_exceptions=True):
-    '''Wrapper of shakedown's spinner which logs the duration of the spin'''
+def time_wait_noisy(predicate, timeout_seconds=DEFAULT_TIMEOUT, ignore_exceptions=True, endpoint=None):
+    '''Waits for the predicate to return a truthy value, logging the duration of the spin.
+    Returns the number of seconds spent waiting, or raises shakedown.TimeoutExpired.'''
     start = time.time()
     def wrapper():
         try:
@@ -49,9 +83,85 @@ def time_wait_noisy(predicate, timeout_seconds=DEFAULT_TIMEOUT, ignore_exception
                 pretty_time(time.time() - start),
                 pretty_time(timeout_seconds)))
         return result
-    # we perform our own custom handling of exceptions, disable the underlying version:
-    duration = shakedown.time_wait(
-        lambda: wrapper(), timeout_seconds=timeout_seconds, ignore_exceptions=False)
+    return _wait(lambda: wrapper(), timeout_seconds, endpoint)
+
+
+def time_wait_all(predicates, snapshot_fn=lambda: None, timeout_seconds=DEFAULT_TIMEOUT,
+                  ignore_exceptions=True, endpoint=None):
+    '''Waits on several named predicates with a single polling loop. Each tick fetches one snapshot
+    via snapshot_fn and passes it to every pending predicate, in the order they're listed in
+    predicates. A predicate is done once it returns a truthy value, and isn't evaluated again after
+    that. Returns the number of seconds spent waiting, or raises shakedown.TimeoutExpired.'''
+    start = time.time()
+    pending = set(predicates.keys())
+    def tick():
+        try:
+            snapshot = snapshot_fn()
+        except Exception as e:
+            if ignore_exceptions:
+                traceback.print_exc()
+                return False
+            else:
+                raise
+        elapsed = time.time() - start
+        for name in [name for name in predicates.keys() if name in pending]:
+            try:
+                done = predicates[name](snapshot)
+            except Exception as e:
+                if ignore_exceptions:
+                    traceback.print_exc()
+                    done = False
+                else:
+                    raise
+            if done:
+                pending.remove(name)
+        if pending:
+            print('[{}/{}] Waiting for {}/{}: {}'.format(
+                pretty_time(elapsed),
+                pretty_time(timeout_seconds),
+                len(pending), len(predicates),
+                ', '.join(sorted(pending))))
+        return not pending
+    return _wait(lambda: tick(), timeout_seconds, endpoint)
+
+
+def _wait(predicate, timeout_seconds, endpoint=None):
+    start = time.time()
+    deadline = start + timeout_seconds
+    interval = MIN_INTERVAL_SECONDS
+    while True:
+        _throttle_endpoint(endpoint, deadline)
+        if predicate():
+            return time.time() - start
+        now = time.time()
+        if now >= deadline:
+            raise shakedown.TimeoutExpired(timeout_seconds, getattr(predicate, '__name__', 'predicate'))
+        sleep_seconds = min(interval * random.uniform(1 - JITTER, 1 + JITTER), deadline - now)
+        if _sleep_unless_woken(sleep_seconds):
+            interval = MIN_INTERVAL_SECONDS
+        else:
+            interval = min(interval * BACKOFF_FACTOR, MAX_INTERVAL_SECONDS)
+
+
+def _throttle_endpoint(endpoint, deadline):
+    '''Sleeps until the endpoint's minimum interval has passed since its last poll, then claims the
+    current time as the endpoint's last poll.'''
+    if endpoint is None:
+        return
+    with _endpoint_lock:
+        now = time.time()
+        next_allowed = _endpoint_last_poll.get(endpoint, 0) + _endpoint_intervals.get(endpoint, 0)
+        poll_time = max(now, min(next_allowed, deadline))
+        _endpoint_last_poll[endpoint] = poll_time
+    if poll_time > now:
+        time.sleep(poll_time - now)
+
+
+def _sleep_unless_woken(seconds):
+    '''Returns whether the sleep was cut short by wake_up()'''
+    with _wakeup_condition:
+        generation = _wakeup_generation
+        return _wakeup_condition.wait_for(lambda: _wakeup_generation != generation, timeout=seconds)
 
 
 def pretty_time(seconds):
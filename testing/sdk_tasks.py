@@ -1,24 +1,85 @@
 '''Utilities relating to running commands and HTTP requests'''
 
+import collections
 import dcos.errors
 import sdk_spin
 import shakedown
+import threading
+import time
+
+# How long check_tasks_not_updated() waits for unexpected task changes to settle before giving up
+NOT_UPDATED_TIMEOUT = 60
+
+# How long a service's task listing is reused, so that back-to-back lookups within a test step share
+# one Mesos state query. Kept below sdk_spin's minimum poll interval so that each tick of a wait still
+# sees current state.
+SNAPSHOT_TTL_SECONDS = 0.5
+
+_snapshots = {}
+_snapshots_lock = threading.Lock()
+
+
+class TaskSnapshot(object):
+    '''A service's task listing at a point in time, indexed by name prefix, state, and agent id'''
+
+    def __init__(self, service_name, tasks):
+        self.service_name = service_name
+        self.tasks = tasks
+        self.timestamp = time.time()
+        self._by_prefix = {}
+        self._by_state = collections.defaultdict(list)
+        self._by_agent = collections.defaultdict(list)
+        for t in tasks:
+            self._by_state[t['state']].append(t)
+            self._by_agent[t.get('slave_id')].append(t)
+
+    def with_prefix(self, prefix):
+        matching_tasks = self._by_prefix.get(prefix)
+        if matching_tasks is None:
+            matching_tasks = [t for t in self.tasks if t['name'].startswith(prefix)]
+            self._by_prefix[prefix] = matching_tasks
+        return matching_tasks
+
+    def with_state(self, state):
+        return self._by_state.get(state, [])
+
+    def on_agent(self, agent_id):
+        return self._by_agent.get(agent_id, [])
+
+    def ids(self, prefix=''):
+        return [t['id'] for t in self.with_prefix(prefix)]
+
+    def age(self):
+        return time.time() - self.timestamp
+
+
+def get_snapshot(service_name, max_age_seconds=SNAPSHOT_TTL_SECONDS):
+    '''Returns the service's tasks, reusing a prior listing if it's at most max_age_seconds old'''
+    with _snapshots_lock:
+        snapshot = _snapshots.get(service_name)
+    if snapshot is not None and snapshot.age() <= max_age_seconds:
+        return snapshot
+    snapshot = TaskSnapshot(service_name, shakedown.get_service_tasks(service_name))
+    with _snapshots_lock:
+        _snapshots[service_name] = snapshot
+    return snapshot
+
+
+def invalidate_snapshots(service_name=None):
+    '''Discards cached task listings for the service, or for all services if none is specified'''
+    with _snapshots_lock:
+        if service_name is None:
+            _snapshots.clear()
+        else:
+            _snapshots.pop(service_name, None)
 
 
 def check_running(service_name, expected_task_count):
     def fn():
-        try:
-            tasks = shakedown.get_service_tasks(service_name)
-        except dcos.errors.DCOSHTTPException:
-            print('Failed to get tasks for service {}'.format(service_name))
-            tasks = []
-        running_task_names = []
-        other_tasks = []
-        for t in tasks:
-            if t['state'] == 'TASK_RUNNING':
-                running_task_names.append(t['name'])
-            else:
-                other_tasks.append('{}={}'.format(t['name'], t['state']))
+        snapshot = _get_snapshot_or_empty(service_name)
+        tasks = snapshot.tasks
+        running_task_names = [t['name'] for t in snapshot.with_state('TASK_RUNNING')]
+        other_tasks = ['{}={}'.format(t['name'], t['state']) for t in tasks if t['state'] != 'TASK_RUNNING']
         print('Waiting for {} running tasks, got {} running/{} total:\n- running: {}\n- other: {}'.format(
             expected_task_count,
             len(running_task_names), len(tasks),
@@ -29,53 +90,112 @@ def check_running(service_name, expected_task_count):
 
 
 def get_task_ids(service_name, task_prefix):
-    tasks = shakedown.get_service_tasks(service_name)
-    matching_tasks = [t for t in tasks if t['name'].startswith(task_prefix)]
-    return [t['id'] for t in matching_tasks]
+    return get_snapshot(service_name).ids(task_prefix)
 
 
 def check_tasks_updated(service_name, prefix, old_task_ids):
     def fn():
-        try:
-            task_ids = get_task_ids(service_name, prefix)
-        except dcos.errors.DCOSHTTPException:
-            print('Failed to get task ids for service {}'.format(service_name))
-            task_ids = []
-
-        print('Waiting for tasks starting with "{}" to be updated:\n- Old tasks: {}\n- Current tasks: {}'.format(
-            prefix, old_task_ids, task_ids))
-        all_updated = True
-        for id in task_ids:
-            if id in old_task_ids:
-                all_updated = False
-        if len(task_ids) < len(old_task_ids):
-            all_updated = False
-        return all_updated
+        return _tasks_updated(prefix, old_task_ids, _get_task_ids_or_empty(service_name, prefix))
 
     sdk_spin.time_wait_noisy(lambda: fn())
 
 
 def check_tasks_not_updated(service_name, prefix, old_task_ids):
     def fn():
-        try:
-            task_ids = get_task_ids(service_name, prefix)
-        except dcos.errors.DCOSHTTPException:
-            print('Failed to get task ids for service {}'.format(service_name))
-            task_ids = []
-
-        print('Checking prior tasks starting with "{}" are undisturbed:\n- Old tasks: {}\n- Current tasks: {}'.format(
-            prefix, old_task_ids, task_ids))
-        for task_id in task_ids:
-            if task_id not in old_task_ids:
-                return False
-        return True
+        return _tasks_not_updated(prefix, old_task_ids, _get_task_ids_or_empty(service_name, prefix))
 
     try:
-        sdk_spin.time_wait_noisy(lambda: fn(), timeout_seconds=60)
+        sdk_spin.time_wait_noisy(lambda: fn(), timeout_seconds=NOT_UPDATED_TIMEOUT)
     except shakedown.TimeoutExpired:
         print('Timeout reached as expected')
 
 
+def check_tasks(service_name, updated=None, not_updated=None):
+    '''Equivalent to calling check_tasks_updated() for each prefix => old_task_ids entry in
+    'updated', followed by check_tasks_not_updated() for each entry in 'not_updated'. However all the
+    checks share a single task listing per tick, so the total wait is that of the slowest check rather
+    than the sum of all of them.'''
+    if updated is None:
+        updated = {}
+    if not_updated is None:
+        not_updated = {}
+    updates_pending = set(updated.keys())
+    updates_done_time = []
+
+    def updated_fn(prefix, old_task_ids):
+        def fn(snapshot):
+            if not _tasks_updated(prefix, old_task_ids, snapshot.ids(prefix)):
+                return False
+            updates_pending.discard(prefix)
+            if not updates_pending:
+                updates_done_time.append(time.time())
+            return True
+        return fn
+
+    def not_updated_fn(prefix, old_task_ids):
+        def fn(snapshot):
+            # like the sequential calls, only look for disturbed tasks once all updates have completed
+            if updates_pending:
+                return False
+            if _tasks_not_updated(prefix, old_task_ids, snapshot.ids(prefix)):
+                return True
+            if updates_done_time and time.time() - updates_done_time[0] >= NOT_UPDATED_TIMEOUT:
+                print('Timeout reached as expected')
+                return True
+            return False
+        return fn
+
+    predicates = collections.OrderedDict()
+    for prefix, old_task_ids in updated.items():
+        predicates['updated:{}'.format(prefix)] = updated_fn(prefix, old_task_ids)
+    if not updates_pending:
+        updates_done_time.append(time.time())
+    for prefix, old_task_ids in not_updated.items():
+        predicates['not_updated:{}'.format(prefix)] = not_updated_fn(prefix, old_task_ids)
+
+    sdk_spin.time_wait_all(
+        predicates,
+        snapshot_fn=lambda: _get_snapshot_or_empty(service_name),
+        timeout_seconds=sdk_spin.DEFAULT_TIMEOUT + NOT_UPDATED_TIMEOUT)
+
+
+def _get_task_ids_or_empty(service_name, prefix):
+    try:
+        return get_task_ids(service_name, prefix)
+    except dcos.errors.DCOSHTTPException:
+        print('Failed to get task ids for service {}'.format(service_name))
+        return []
+
+
+def _get_snapshot_or_empty(service_name):
+    try:
+        return get_snapshot(service_name)
+    except dcos.errors.DCOSHTTPException:
+        print('Failed to get tasks for service {}'.format(service_name))
+        return TaskSnapshot(service_name, [])
+
+
+def _tasks_updated(prefix, old_task_ids, task_ids):
+    print('Waiting for tasks starting with "{}" to be updated:\n- Old tasks: {}\n- Current tasks: {}'.format(
+        prefix, old_task_ids, task_ids))
+    all_updated = True
+    for id in task_ids:
+        if id in old_task_ids:
+            all_updated = False
+    if len(task_ids) < len(old_task_ids):
+        all_updated = False
+    return all_updated
+
+
+def _tasks_not_updated(prefix, old_task_ids, task_ids):
+    print('Checking prior tasks starting with "{}" are undisturbed:\n- Old tasks: {}\n- Current tasks: {}'.format(
+        prefix, old_task_ids, task_ids))
+    for task_id in task_ids:
+        if task_id not in old_task_ids:
+            return False
+    return True
+
+
 def kill_task_with_pattern(pattern, host=None):
     command = (
         "sudo kill -9 "
@@ -85,6 +205,8 @@ def kill_task_with_pattern(pattern, host=None):
         result = shakedown.run_command_on_master(command)
     else:
         result = shakedown.run_command_on_agent(host, command)
+    # the killed process may belong to any service's task:
+    invalidate_snapshots()
 
     if not result:
         raise RuntimeError('Failed to kill task with pattern "{}"'.format(pattern))
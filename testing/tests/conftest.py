@@ -0,0 +1,92 @@
+'''Fixtures for testing the sdk_* utils without a cluster, against a local DC/OS emulator (see
+dcos_emulator.py) or fakes of their own. Without the test requirements (shakedown and the dcos CLI
+modules), the utils are imported against the stand-ins in standins/.'''
+
+import os.path
+import sys
+
+import pytest
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# the utils are imported by name, as they are by the framework tests:
+sys.path.insert(0, os.path.dirname(TESTS_DIR))
+try:
+    import shakedown
+except ImportError:
+    sys.path.append(os.path.join(TESTS_DIR, 'standins'))
+
+import dcos_emulator
+
+# Fast enough to keep the tests short, while still leaving tasks and deployments visibly in progress
+TIMINGS = {
+    'task_launch_seconds': 0.2,
+    'deployment_seconds': 0.2,
+    'uninstall_seconds': 0.2,
+}
+# sdk_spin poll intervals to match
+MIN_INTERVAL_SECONDS = 0.05
+MAX_INTERVAL_SECONDS = 0.2
+
+
+def write_dcos_config(config_dir, dcos_url):
+    '''Writes a CLI config for the cluster at dcos_url to config_dir, and returns its path'''
+    config_path = os.path.join(config_dir, 'dcos.toml')
+    with open(config_path, 'w') as config_file:
+        config_file.write('[core]\ndcos_url = "{}"\ndcos_acs_token = "test-token"\nssl_verify = "false"\n'.format(
+            dcos_url))
+    # the CLI refuses to use a config which is readable by others:
+    os.chmod(config_path, 0o600)
+    return config_path
+
+
+@pytest.fixture
+def dcos_config(tmp_path, monkeypatch):
+    '''Returns a function which points the dcos modules (and therefore shakedown) at a cluster url, via a
+    DCOS_CONFIG of the test's own. The utils' shared session is reset around the test.'''
+    import sdk_cmd
+
+    def set_url(dcos_url):
+        monkeypatch.setenv('DCOS_CONFIG', write_dcos_config(str(tmp_path), dcos_url))
+        sdk_cmd.reset_session()
+    sdk_cmd.reset_session()
+    yield set_url
+    sdk_cmd.reset_session()
+
+
+@pytest.fixture(scope='session')
+def emulator(tmp_path_factory):
+    '''An emulator running in the background of the test process, with DCOS_CONFIG pointing at it'''
+    emulator = dcos_emulator.DCOSEmulator().start()
+    try:
+        with pytest.MonkeyPatch.context() as monkeypatch:
+            monkeypatch.setenv('DCOS_CONFIG', write_dcos_config(str(tmp_path_factory.mktemp('dcos')), emulator.url))
+            yield emulator
+    finally:
+        emulator.stop()
+
+
+@pytest.fixture
+def cluster(emulator, monkeypatch):
+    '''The emulator, emptied of services and with its request stats reset, and with the utils' caches
+    and poll intervals reset to match.'''
+    import sdk_cmd
+    import sdk_marathon
+    import sdk_spin
+    import sdk_tasks
+    emulator.state.reset()
+    emulator.state.set_timings(TIMINGS)
+    emulator.stats.reset()
+    monkeypatch.setattr(sdk_spin, 'MIN_INTERVAL_SECONDS', MIN_INTERVAL_SECONDS)
+    monkeypatch.setattr(sdk_spin, 'MAX_INTERVAL_SECONDS', MAX_INTERVAL_SECONDS)
+    sdk_cmd.reset_session()
+    sdk_marathon.invalidate_config()
+    sdk_tasks.invalidate_snapshots()
+    yield emulator
+    sdk_cmd.reset_session()
+
+
+@pytest.fixture
+def route_requests(cluster):
+    '''Returns a function which returns the number of requests the emulator has received for a route'''
+    return lambda route: cluster.stats.get()['routes'].get(route, {}).get('requests', 0)
@@ -0,0 +1 @@
+'''A stand-in for the parts of the dcos CLI modules used by the sdk_* utils'''
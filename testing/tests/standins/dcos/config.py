@@ -0,0 +1,22 @@
+import os
+import re
+
+
+def get_config_val(name, config=None):
+    '''Returns the value of a 'section.key' setting in the CLI config at DCOS_CONFIG, or None'''
+    path = os.environ.get('DCOS_CONFIG')
+    if not path or not os.path.isfile(path):
+        return None
+    section_name, key = name.rsplit('.', 1)
+    section = None
+    with open(path) as config_file:
+        for line in config_file:
+            line = line.strip()
+            header = re.match(r'^\[(.+)\]$', line)
+            if header:
+                section = header.group(1)
+                continue
+            setting = re.match(r'^([^=\s]+)\s*=\s*"(.*)"$', line)
+            if setting and section == section_name and setting.group(1) == key:
+                return setting.group(2)
+    return None
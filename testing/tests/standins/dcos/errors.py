@@ -0,0 +1,16 @@
+class DCOSException(Exception):
+    pass
+
+
+class DCOSHTTPException(DCOSException):
+    '''An error response, as raised by dcos.http.request()'''
+
+    def __init__(self, response):
+        self.response = response
+
+    def status(self):
+        return self.response.status_code
+
+    def __str__(self):
+        return 'Error while fetching [{}]: HTTP {}: {}'.format(
+            self.response.request.url, self.status(), self.response.reason)
@@ -0,0 +1,24 @@
+import requests
+
+import dcos.config
+import dcos.errors
+
+
+def request(method, url, timeout=60, **kwargs):
+    '''Sends a request with the CLI config's auth token, and raises DCOSHTTPException for an error response'''
+    headers = dict(kwargs.pop('headers', None) or {})
+    token = dcos.config.get_config_val('core.dcos_acs_token')
+    if token:
+        headers.setdefault('Authorization', 'token={}'.format(token))
+    response = requests.request(method, url, headers=headers, timeout=timeout, **kwargs)
+    if not 200 <= response.status_code < 300:
+        raise dcos.errors.DCOSHTTPException(response)
+    return response
+
+
+def get(url, **kwargs):
+    return request('get', url, **kwargs)
+
+
+def post(url, **kwargs):
+    return request('post', url, **kwargs)
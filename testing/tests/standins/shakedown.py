@@ -0,0 +1,100 @@
+'''A stand-in for the parts of shakedown used by the sdk_* utils, so that the utils' tests can be run
+without the test requirements. Cluster calls are sent over HTTP to the cluster in the CLI config, eg
+a dcos_emulator.py. Commands on cluster nodes aren't supported.'''
+
+import subprocess
+import time
+
+import dcos.config
+import dcos.http
+
+# Cosmos media types, eg 'application/vnd.dcos.package.install-request+json;charset=utf-8;version=v1'
+COSMOS_MEDIA_TYPE = 'application/vnd.dcos.package.{}-{}+json;charset=utf-8;version=v1'
+POLL_INTERVAL_SECONDS = 0.05
+
+
+class TimeoutExpired(Exception):
+    def __init__(self, timeout_seconds, what):
+        self.timeout_seconds = timeout_seconds
+        self.what = what
+
+    def __str__(self):
+        return 'Timed out after {} seconds waiting for {}'.format(self.timeout_seconds, self.what)
+
+
+def dcos_url():
+    return dcos.config.get_config_val('core.dcos_url')
+
+
+def dcos_service_url(service):
+    return '{}/service/{}/'.format(dcos_url().rstrip('/'), service)
+
+
+def dcos_acs_token():
+    return dcos.config.get_config_val('core.dcos_acs_token')
+
+
+def run_dcos_command(command, raise_on_error=False, print_output=True):
+    '''Returns the (stdout, stderr, return code) of the command, run via the dcos CLI if it's installed'''
+    process = subprocess.Popen('dcos {}'.format(command), shell=True,
+                               stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    stdout, stderr = process.communicate()
+    if print_output:
+        print(stdout, stderr)
+    if raise_on_error and process.returncode != 0:
+        raise Exception('Got return code {} from "dcos {}": {}'.format(process.returncode, command, stderr))
+    return stdout, stderr, process.returncode
+
+
+def install_package(package_name, package_version=None, service_name=None, options_json=None, **kwargs):
+    payload = {'packageName': package_name, 'options': options_json or {}}
+    if package_version:
+        payload['packageVersion'] = package_version
+    if service_name:
+        payload['appId'] = '/' + service_name
+    return _cosmos_request('install', payload)
+
+
+def uninstall_package_and_wait(package_name, service_name=None, timeout_sec=600, **kwargs):
+    service_name = service_name or package_name
+    _cosmos_request('uninstall', {'packageName': package_name, 'appId': '/' + service_name})
+    deadline = time.time() + timeout_sec
+    while get_service(service_name) is not None:
+        if time.time() >= deadline:
+            raise TimeoutExpired(timeout_sec, 'uninstall of {}'.format(service_name))
+        time.sleep(POLL_INTERVAL_SECONDS)
+
+
+def get_service(service_name, inactive=False, completed=False):
+    '''Returns the Mesos framework with the service's name, or None'''
+    state = dcos.http.get('{}/mesos/master/state.json'.format(dcos_url().rstrip('/'))).json()
+    frameworks = state['frameworks'] + (state['completed_frameworks'] if completed else [])
+    for framework in frameworks:
+        if framework['name'] == service_name and (inactive or framework['active']):
+            return framework
+    return None
+
+
+def get_service_tasks(service_name, inactive=False, completed=False):
+    service = get_service(service_name, inactive, completed)
+    if service is None:
+        return []
+    return service['tasks'] + (service['completed_tasks'] if completed else [])
+
+
+def run_command_on_master(command, **kwargs):
+    print('Cluster nodes are not reachable from the stand-in, not running: {}'.format(command))
+    return False, ''
+
+
+def run_command_on_agent(host, command, **kwargs):
+    print('Cluster nodes are not reachable from the stand-in, not running on {}: {}'.format(host, command))
+    return False, ''
+
+
+def _cosmos_request(action, payload):
+    return dcos.http.post(
+        '{}/package/{}'.format(dcos_url().rstrip('/'), action),
+        json=payload,
+        headers={'Content-Type': COSMOS_MEDIA_TYPE.format(action, 'request'),
+                 'Accept': COSMOS_MEDIA_TYPE.format(action, 'response')}).json()
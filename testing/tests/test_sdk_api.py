@@ -0,0 +1,77 @@
+import dcos.errors
+import pytest
+import requests
+
+import sdk_api
+import sdk_cmd
+import sdk_install
+
+PACKAGE_NAME = 'hello-world'
+# see dcos_emulator.DEFAULT_PACKAGES
+TASK_COUNT = 3
+
+
+@pytest.fixture
+def cli_cmds(monkeypatch):
+    '''Records the CLI commands run by the fallback, each of which prints a list of pods'''
+    cli_cmds = []
+
+    def run_cli(cmd):
+        cli_cmds.append(cmd)
+        return '["hello-0"]'
+    monkeypatch.setattr(sdk_cmd, 'run_cli', run_cli)
+    return cli_cmds
+
+
+def test_cli_fallback(cli_cmds):
+    def unreachable():
+        raise requests.exceptions.ConnectionError('unreachable')
+    assert sdk_api._with_cli_fallback(unreachable, 'hello-world pods list') == ['hello-0']
+    assert cli_cmds == ['hello-world pods list']
+
+
+def test_error_response_not_retried_via_cli(cli_cmds):
+    def error_response():
+        response = requests.Response()
+        response.status_code = 500
+        raise dcos.errors.DCOSHTTPException(response)
+    with pytest.raises(dcos.errors.DCOSHTTPException):
+        sdk_api._with_cli_fallback(error_response, 'hello-world pods list')
+    assert cli_cmds == []
+
+
+def test_describe_package(cluster):
+    assert sdk_api.describe_package(PACKAGE_NAME)['package']['name'] == PACKAGE_NAME
+    assert sdk_api.get_package_version(PACKAGE_NAME) == '1.0.0'
+    with pytest.raises(dcos.errors.DCOSHTTPException):
+        sdk_api.describe_package(PACKAGE_NAME, '0.0.1')
+
+
+def test_repos(cluster):
+    repos = sdk_api.list_repos()
+    try:
+        assert sdk_api.add_repo('test', 'http://example.com/repo', index=0) == (
+            [{'name': 'test', 'uri': 'http://example.com/repo'}] + repos)
+        assert sdk_api.list_repos()[0]['name'] == 'test'
+    finally:
+        assert sdk_api.remove_repo('test') == repos
+
+
+def test_service_calls(cluster, cli_cmds, route_requests):
+    sdk_install.install(PACKAGE_NAME, TASK_COUNT)
+    assert sdk_api.get_pods(PACKAGE_NAME) == ['hello-0', 'world-0', 'world-1']
+    assert set(sdk_api.get_pod_statuses(PACKAGE_NAME).keys()) == {'hello-0', 'world-0', 'world-1'}
+    assert [t['state'] for t in sdk_api.get_pod_status(PACKAGE_NAME, 'world-1')] == ['TASK_RUNNING']
+    assert sdk_api.get_plans(PACKAGE_NAME) == ['deploy', 'recovery']
+    assert sdk_api.get_plan(PACKAGE_NAME, 'deploy')['status'] == 'COMPLETE'
+    assert sdk_api.get_framework_id(PACKAGE_NAME)[0].startswith('emulator-')
+    assert sdk_api.restart_pod(PACKAGE_NAME, 'hello-0') == {'pod': 'hello-0', 'tasks': ['hello-0-server']}
+    # all served by the emulator, without falling back to the CLI:
+    assert route_requests('not_found') == 0
+    assert cli_cmds == []
+
+
+def test_service_error_not_retried_via_cli(cluster, cli_cmds):
+    with pytest.raises(dcos.errors.DCOSHTTPException):
+        sdk_api.get_pods('missing')
+    assert cli_cmds == []
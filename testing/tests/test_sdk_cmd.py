@@ -0,0 +1,68 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+import dcos.errors
+import pytest
+
+import sdk_cmd
+
+
+class EchoHandler(BaseHTTPRequestHandler):
+    '''Responds with the request's path and Authorization header, or with a 404 for /missing'''
+    # keep-alive, as served by adminrouter:
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        payload = json.dumps({'path': self.path, 'authorization': self.headers.get('Authorization')})
+        payload = payload.encode('utf-8')
+        self.send_response(404 if self.path == '/missing' else 200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class ThreadingServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+@pytest.fixture
+def server_url(dcos_config):
+    server = ThreadingServer(('127.0.0.1', 0), EchoHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = 'http://127.0.0.1:{}'.format(server.server_address[1])
+    dcos_config(url)
+    yield url
+    server.shutdown()
+    server.server_close()
+
+
+def test_request_reuses_connection(server_url):
+    for i in range(3):
+        response = sdk_cmd.request('get', '{}/path/{}'.format(server_url, i))
+        assert response.json() == {'path': '/path/{}'.format(i), 'authorization': 'token=test-token'}
+    assert sdk_cmd.connection_stats() == {'requests': 3, 'new_connections': 1, 'reused_connections': 2}
+
+
+def test_request_error(server_url):
+    with pytest.raises(dcos.errors.DCOSHTTPException) as e:
+        sdk_cmd.request('get', '{}/missing'.format(server_url), retry=False)
+    assert e.value.response.status_code == 404
+
+
+def test_request_with_exhausted_pool(server_url, monkeypatch):
+    monkeypatch.setattr(sdk_cmd, 'POOL_MAXSIZE', 1)
+    # keeps its connection checked out of the pool until closed:
+    leaked = sdk_cmd.request('get', '{}/leaked'.format(server_url), stream=True)
+    results = []
+    thread = threading.Thread(
+        target=lambda: results.append(sdk_cmd.request('get', '{}/path'.format(server_url), retry=False)))
+    thread.start()
+    thread.join(timeout=10)
+    leaked.close()
+    assert [r.json()['path'] for r in results] == ['/path']
@@ -0,0 +1,196 @@
+import collections
+import copy
+import time
+
+import pytest
+
+import sdk_cmd
+import sdk_install
+import sdk_marathon
+import sdk_spin
+
+APP_NAME = 'hello-world'
+# see dcos_emulator.DEFAULT_PACKAGES
+TASK_COUNT = 3
+
+
+class FakeResponse(object):
+    def __init__(self, payload):
+        self.ok = True
+        self._payload = payload
+
+    def json(self):
+        return copy.deepcopy(self._payload)
+
+
+class FakeMarathon(object):
+    '''Serves an app's /v2/apps/<id> to sdk_cmd.request(), and records the requests'''
+
+    def __init__(self, app_name):
+        self.app = {'id': '/' + app_name, 'env': {}, 'uris': [], 'version': '2017-01-01T00:00:00.000Z',
+                    'deployments': []}
+        self.requests = []
+        # bodies of the PUTs:
+        self.sent = []
+        self.updates = 0
+        # number of further polls for which the app's deployments remain in progress:
+        self.deployment_polls = 0
+
+    def request(self, method, url, retry=True, **kwargs):
+        path = url[len(sdk_marathon.api_url('')):]
+        self.requests.append((method, path))
+        assert path == 'apps{}'.format(self.app['id'])
+        if method == 'get':
+            if self.deployment_polls > 0:
+                self.deployment_polls -= 1
+            else:
+                self.app['deployments'] = []
+            return FakeResponse({'app': self.app})
+        if method == 'put':
+            self.sent.append(kwargs['json'])
+            self.app.update(kwargs['json'])
+            self.change_version()
+            deployment_id = 'deployment-{}'.format(self.app['version'])
+            self.deploy(deployment_id, polls=1)
+            return FakeResponse({'deploymentId': deployment_id, 'version': self.app['version']})
+        raise AssertionError('Unexpected {} {}'.format(method, url))
+
+    def change_version(self):
+        self.updates += 1
+        self.app['version'] = '2017-01-01T00:00:{:02d}.000Z'.format(self.updates)
+
+    def deploy(self, deployment_id, polls):
+        self.app['deployments'] = [{'id': deployment_id}]
+        self.deployment_polls = polls
+
+
+@pytest.fixture
+def marathon(dcos_config, monkeypatch):
+    dcos_config('http://dcos.test')
+    marathon = FakeMarathon(APP_NAME)
+    monkeypatch.setattr(sdk_cmd, 'request', marathon.request)
+    monkeypatch.setattr(sdk_spin, '_sleep_unless_woken', lambda seconds: False)
+    monkeypatch.setattr(sdk_marathon, '_finished_deployments', collections.OrderedDict())
+    sdk_marathon.invalidate_config()
+    yield marathon
+    sdk_marathon.invalidate_config()
+
+
+def test_get_config_cached(marathon):
+    config = sdk_marathon.get_config(APP_NAME)
+    assert 'uris' not in config
+    assert 'version' not in config
+
+    # callers get their own copy, and the cached config isn't fetched again:
+    config['env']['MODIFIED'] = 'true'
+    assert sdk_marathon.get_config(APP_NAME) != config
+    assert sdk_marathon.get_config_version(APP_NAME) == marathon.app['version']
+    assert marathon.requests == [('get', 'apps/' + APP_NAME)]
+
+
+def test_get_config_after_update(marathon):
+    version = sdk_marathon.get_config_version(APP_NAME)
+    config = sdk_marathon.get_config(APP_NAME)
+    config['env']['UPDATED'] = 'true'
+    sdk_marathon.wait_for_deployment(APP_NAME, sdk_marathon.update_app(APP_NAME, config))
+
+    assert sdk_marathon.get_config(APP_NAME)['env'] == {'UPDATED': 'true'}
+    assert sdk_marathon.get_config_version(APP_NAME) != version
+
+
+def test_get_config_after_external_update(marathon):
+    sdk_marathon.get_config(APP_NAME)
+    # eg by a test's own Marathon client:
+    marathon.app['env'] = {'EXTERNAL': 'true'}
+    marathon.change_version()
+    assert sdk_marathon.get_config(APP_NAME)['env'] == {}
+
+    # noticed when polling the app's deployments:
+    sdk_marathon.get_deployment_ids(APP_NAME)
+    assert sdk_marathon.get_config(APP_NAME)['env'] == {'EXTERNAL': 'true'}
+
+    marathon.app['env'] = {}
+    marathon.change_version()
+    sdk_marathon.invalidate_config(APP_NAME)
+    assert sdk_marathon.get_config(APP_NAME)['env'] == {}
+
+
+def test_patch_env(marathon):
+    marathon.app['env'] = {'KEPT': 'true', 'REMOVED': 'true'}
+    sdk_marathon.wait_for_deployment(
+        APP_NAME, sdk_marathon.patch_env(APP_NAME, {'PATCHED': 'true', 'REMOVED': None}))
+    assert sdk_marathon.get_config(APP_NAME)['env'] == {'KEPT': 'true', 'PATCHED': 'true'}
+
+    # only the env is sent, and nothing at all if it's already up to date:
+    assert marathon.sent == [{'env': {'KEPT': 'true', 'PATCHED': 'true'}}]
+    assert sdk_marathon.patch_env(APP_NAME, {'PATCHED': 'true', 'MISSING': None}) is None
+    assert len(marathon.sent) == 1
+
+
+def test_wait_for_deployment(marathon):
+    marathon.deploy('deployment-1', polls=3)
+    assert sdk_marathon.get_deployment_ids(APP_NAME) == ['deployment-1']
+    sdk_marathon.wait_for_deployment(APP_NAME, 'deployment-1')
+    assert sdk_marathon.get_deployment_ids(APP_NAME) == []
+    assert len(marathon.requests) == 5
+
+    marathon.deploy('deployment-2', polls=2)
+    sdk_marathon.wait_for_deployment(APP_NAME)
+    assert len(marathon.requests) == 8
+
+
+def test_wait_for_deployment_reported_by_event_stream(marathon):
+    marathon.deploy('deployment-1', polls=100)
+    sdk_marathon._add_finished_deployment('deployment-1')
+    sdk_marathon.wait_for_deployment(APP_NAME, 'deployment-1')
+    assert marathon.requests == []
+    # forgotten once waited on:
+    assert not sdk_marathon._finished_deployments
+
+
+def test_finished_deployments_bounded(marathon, monkeypatch):
+    monkeypatch.setattr(sdk_marathon, 'MAX_FINISHED_DEPLOYMENTS', 3)
+    for i in range(5):
+        sdk_marathon._add_finished_deployment('deployment-{}'.format(i))
+    assert list(sdk_marathon._finished_deployments) == ['deployment-2', 'deployment-3', 'deployment-4']
+    assert sdk_marathon._pop_finished_deployment('deployment-3')
+    assert not sdk_marathon._pop_finished_deployment('deployment-3')
+    assert not sdk_marathon._pop_finished_deployment('deployment-0')
+
+
+@pytest.fixture
+def service(cluster):
+    '''hello-world, installed in the emulator'''
+    sdk_install.install(APP_NAME, TASK_COUNT)
+    return APP_NAME
+
+
+def test_update_app_against_emulator(service, route_requests):
+    config = sdk_marathon.get_config(service)
+    app_requests = route_requests('marathon_app')
+    assert sdk_marathon.get_config(service) == config
+    assert route_requests('marathon_app') == app_requests
+
+    version = sdk_marathon.get_config_version(service)
+    sdk_marathon.wait_for_deployment(service, sdk_marathon.patch_env(service, {'PATCHED': 'true'}))
+    assert sdk_marathon.get_config(service)['env']['PATCHED'] == 'true'
+    assert sdk_marathon.get_config_version(service) != version
+
+    update_requests = route_requests('marathon_update_app')
+    assert sdk_marathon.patch_env(service, {'PATCHED': 'true', 'MISSING': None}) is None
+    assert route_requests('marathon_update_app') == update_requests
+
+
+def test_wait_for_deployment_woken_by_event_stream(service, monkeypatch):
+    monkeypatch.setattr(sdk_marathon, '_finished_deployments', collections.OrderedDict())
+    sdk_marathon.start_event_stream()
+    # ensure the stream is connected before it's relied on:
+    deployment_id = sdk_marathon.patch_env(service, {'STREAMED': '1'})
+    sdk_spin.time_wait_noisy(lambda: deployment_id in sdk_marathon._finished_deployments, timeout_seconds=10)
+
+    # without the event stream, the wait would only notice the deployment's completion at the timeout:
+    monkeypatch.setattr(sdk_spin, 'MIN_INTERVAL_SECONDS', 30)
+    deployment_id = sdk_marathon.patch_env(service, {'STREAMED': '2'})
+    start = time.time()
+    sdk_marathon.wait_for_deployment(service, deployment_id, timeout_seconds=10)
+    assert time.time() - start < 5
@@ -0,0 +1,111 @@
+import threading
+import time
+
+import pytest
+
+import sdk_spin
+import shakedown
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    '''Records the waiters' sleeps instead of sleeping, without jitter'''
+    sleeps = []
+
+    def sleep_unless_woken(seconds):
+        sleeps.append(seconds)
+        return False
+    monkeypatch.setattr(sdk_spin, '_sleep_unless_woken', sleep_unless_woken)
+    monkeypatch.setattr(sdk_spin.random, 'uniform', lambda a, b: 1)
+    return sleeps
+
+
+def test_time_wait_return_returns_first_truthy_value(sleeps):
+    values = iter([None, 0, '', 'done', 'later'])
+    assert sdk_spin.time_wait_return(lambda: next(values)) == 'done'
+    assert len(sleeps) == 3
+
+
+def test_time_wait_return_ignores_exceptions(sleeps):
+    calls = []
+
+    def fn():
+        calls.append(1)
+        if len(calls) < 3:
+            raise ValueError('not yet')
+        return 'done'
+    assert sdk_spin.time_wait_return(fn) == 'done'
+    assert len(calls) == 3
+
+    calls.clear()
+    with pytest.raises(ValueError):
+        sdk_spin.time_wait_return(fn, ignore_exceptions=False)
+    assert len(calls) == 1
+
+
+def test_backoff(sleeps):
+    values = iter([False] * 8 + [True])
+    sdk_spin.time_wait_noisy(lambda: next(values))
+    expected = []
+    interval = sdk_spin.MIN_INTERVAL_SECONDS
+    for _ in range(8):
+        expected.append(interval)
+        interval = min(interval * sdk_spin.BACKOFF_FACTOR, sdk_spin.MAX_INTERVAL_SECONDS)
+    assert sleeps == pytest.approx(expected)
+    assert sleeps[-1] == sdk_spin.MAX_INTERVAL_SECONDS
+
+
+def test_timeout():
+    start = time.time()
+    with pytest.raises(shakedown.TimeoutExpired):
+        sdk_spin.time_wait_noisy(lambda: False, timeout_seconds=0.3)
+    # the last sleep is cut short to end at the deadline:
+    assert time.time() - start < sdk_spin.MIN_INTERVAL_SECONDS * (1 + sdk_spin.JITTER)
+
+
+def test_wake_up_reevaluates_immediately(monkeypatch):
+    monkeypatch.setattr(sdk_spin, 'MIN_INTERVAL_SECONDS', 30)
+    done = threading.Event()
+
+    def wake_when_done():
+        time.sleep(0.2)
+        done.set()
+        sdk_spin.wake_up()
+    threading.Thread(target=wake_when_done).start()
+    assert sdk_spin.time_wait_noisy(lambda: done.is_set(), timeout_seconds=10) < 5
+
+
+def test_endpoint_interval(monkeypatch):
+    monkeypatch.setattr(sdk_spin, 'MIN_INTERVAL_SECONDS', 0.01)
+    monkeypatch.setattr(sdk_spin, '_endpoint_intervals', {})
+    monkeypatch.setattr(sdk_spin, '_endpoint_last_poll', {})
+    sdk_spin.set_endpoint_interval('test', 0.2)
+    poll_times = []
+
+    def fn():
+        poll_times.append(time.time())
+        return len(poll_times) == 3
+    sdk_spin.time_wait_noisy(fn, endpoint='test')
+    assert poll_times[1] - poll_times[0] >= 0.19
+    assert poll_times[2] - poll_times[1] >= 0.19
+
+
+def test_time_wait_all_shares_snapshots(sleeps):
+    snapshots = iter(range(10))
+    seen = {'a': [], 'b': []}
+
+    def predicate(name, done_at):
+        def fn(snapshot):
+            seen[name].append(snapshot)
+            return snapshot >= done_at
+        return fn
+    sdk_spin.time_wait_all({'a': predicate('a', 1), 'b': predicate('b', 3)}, snapshot_fn=lambda: next(snapshots))
+    # one snapshot per tick, and 'a' isn't evaluated again once it's done:
+    assert seen == {'a': [0, 1], 'b': [0, 1, 2, 3]}
+    assert len(sleeps) == 3
+
+
+def test_pretty_time():
+    assert sdk_spin.pretty_time(5) == '5.0s'
+    assert sdk_spin.pretty_time(65) == '1m5.0s'
+    assert sdk_spin.pretty_time(3600) == '1h'
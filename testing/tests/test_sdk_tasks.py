@@ -0,0 +1,113 @@
+import time
+
+import pytest
+
+import sdk_api
+import sdk_install
+import sdk_spin
+import sdk_tasks
+import shakedown
+
+SERVICE_NAME = 'hello-world'
+# see dcos_emulator.DEFAULT_PACKAGES
+TASK_COUNT = 3
+
+
+def task(task_id, state='TASK_RUNNING'):
+    return {'id': task_id, 'name': task_id.split('__')[0], 'state': state, 'slave_id': 'S0'}
+
+
+@pytest.fixture
+def listings(monkeypatch):
+    '''Returns a function which sets the task listings returned by shakedown.get_service_tasks() in
+    turn, repeating the last one. Waits don't sleep between ticks, but each tick gets a new snapshot as
+    if the poll interval had passed.'''
+    served = []
+
+    def set_listings(*tasks):
+        remaining = list(tasks)
+
+        def get_service_tasks(service_name):
+            served.append(service_name)
+            return remaining.pop(0) if len(remaining) > 1 else remaining[0]
+        monkeypatch.setattr(shakedown, 'get_service_tasks', get_service_tasks, raising=False)
+        return served
+    def sleep_unless_woken(seconds):
+        sdk_tasks.invalidate_snapshots()
+        return False
+    monkeypatch.setattr(sdk_spin, '_sleep_unless_woken', sleep_unless_woken)
+    sdk_tasks.invalidate_snapshots()
+    yield set_listings
+    sdk_tasks.invalidate_snapshots()
+
+
+def test_snapshot_indexes():
+    snapshot = sdk_tasks.TaskSnapshot('svc', [
+        {'id': 'hello-0__1', 'name': 'hello-0-server', 'state': 'TASK_RUNNING', 'slave_id': 'S0'},
+        {'id': 'world-0__1', 'name': 'world-0-server', 'state': 'TASK_STAGING', 'slave_id': 'S0'},
+        {'id': 'world-1__1', 'name': 'world-1-server', 'state': 'TASK_RUNNING', 'slave_id': 'S1'}])
+    assert snapshot.ids('world') == ['world-0__1', 'world-1__1']
+    assert snapshot.ids() == ['hello-0__1', 'world-0__1', 'world-1__1']
+    assert [t['id'] for t in snapshot.with_state('TASK_RUNNING')] == ['hello-0__1', 'world-1__1']
+    assert snapshot.with_state('TASK_FAILED') == []
+    assert [t['id'] for t in snapshot.on_agent('S1')] == ['world-1__1']
+
+
+def test_snapshot_reused_within_ttl(listings):
+    served = listings([task('hello-0-server__1'), task('world-0-server__1')])
+
+    snapshot = sdk_tasks.get_snapshot(SERVICE_NAME)
+    assert sdk_tasks.get_snapshot(SERVICE_NAME) is snapshot
+    assert sdk_tasks.get_task_ids(SERVICE_NAME, 'hello') == ['hello-0-server__1']
+    assert len(served) == 1
+
+    time.sleep(sdk_tasks.SNAPSHOT_TTL_SECONDS)
+    assert sdk_tasks.get_snapshot(SERVICE_NAME) is not snapshot
+    assert len(served) == 2
+
+    sdk_tasks.invalidate_snapshots(SERVICE_NAME)
+    sdk_tasks.get_snapshot(SERVICE_NAME)
+    assert len(served) == 3
+
+
+def test_check_tasks_shares_listings(listings):
+    world = [task('world-0-server__1'), task('world-1-server__1')]
+    served = listings(
+        [task('hello-0-server__1')] + world,
+        world,
+        [task('hello-0-server__2', 'TASK_STAGING')] + world)
+
+    sdk_tasks.check_tasks(SERVICE_NAME,
+                          updated={'hello': ['hello-0-server__1']},
+                          not_updated={'world': ['world-0-server__1', 'world-1-server__1']})
+    # one listing per tick, shared by the checks of both prefixes:
+    assert served == [SERVICE_NAME] * 3
+
+
+def test_check_tasks_nothing_to_check(listings):
+    listings([task('hello-0-server__1')])
+    sdk_tasks.check_tasks(SERVICE_NAME)
+
+
+def test_check_tasks_against_emulator(cluster, monkeypatch):
+    monkeypatch.setattr(sdk_tasks, 'NOT_UPDATED_TIMEOUT', 1)
+    sdk_install.install(SERVICE_NAME, TASK_COUNT)
+    hello_ids = sdk_tasks.get_task_ids(SERVICE_NAME, 'hello')
+    world_ids = sdk_tasks.get_task_ids(SERVICE_NAME, 'world')
+
+    sdk_api.restart_pod(SERVICE_NAME, 'hello-0')
+    sdk_tasks.check_tasks(SERVICE_NAME, updated={'hello': hello_ids}, not_updated={'world': world_ids})
+    assert not set(sdk_tasks.get_task_ids(SERVICE_NAME, 'hello')) & set(hello_ids)
+    assert sdk_tasks.get_task_ids(SERVICE_NAME, 'world') == world_ids
+
+
+def test_check_tasks_updated_and_running(cluster, route_requests):
+    sdk_install.install(SERVICE_NAME, TASK_COUNT)
+    world_ids = sdk_tasks.get_task_ids(SERVICE_NAME, 'world')
+
+    cluster.state.run_action({'action': 'kill_task', 'service': SERVICE_NAME, 'task': 'world-1-server',
+                              'relaunch_after': 0})
+    sdk_tasks.check_tasks_updated(SERVICE_NAME, 'world-1', [i for i in world_ids if i.startswith('world-1')])
+    sdk_tasks.check_running(SERVICE_NAME, TASK_COUNT)
+    assert sdk_tasks.get_task_ids(SERVICE_NAME, 'world-0') == [i for i in world_ids if i.startswith('world-0')]
+    assert route_requests('not_found') == 0
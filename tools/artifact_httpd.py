@@ -0,0 +1,212 @@
+#!/usr/bin/python
+#
+# Serves the files in a directory over HTTP, for use by publish_http.py.
+# Requests are handled concurrently, one thread per connection, with keep-alive. File content is sent
+# with os.sendfile() where available, which avoids copying it through userspace. Supports Range requests
+# (eg resumed downloads) and ETag/If-None-Match, and logs the throughput of each transfer.
+
+import email.utils
+import logging
+import mimetypes
+import os
+import os.path
+import re
+import sys
+import threading
+import time
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import unquote, urlparse
+except ImportError:
+    # Python 2
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urllib import unquote
+    from urlparse import urlparse
+
+logger = logging.getLogger(__name__)
+logging.basicConfig(level=logging.DEBUG, format="%(message)s")
+
+# matches 'bytes=0-499', 'bytes=500-', or 'bytes=-500' (the last 500 bytes)
+RANGE_PATTERN = re.compile(r'^bytes=(\d*)-(\d*)$')
+SENDFILE_MAX_BYTES = 64 * 1024 * 1024
+
+
+class ArtifactStats(object):
+    '''Cumulative transfer stats per artifact, across all connections'''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {}
+
+
+    def add(self, name, num_bytes, seconds):
+        '''Returns the updated (requests, bytes, seconds) totals for the artifact'''
+        with self._lock:
+            requests, total_bytes, total_seconds = self._stats.get(name, (0, 0, 0))
+            totals = (requests + 1, total_bytes + num_bytes, total_seconds + seconds)
+            self._stats[name] = totals
+            return totals
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    # don't let lingering downloads block shutdown:
+    daemon_threads = True
+    # many agents may connect at once during a deployment:
+    request_queue_size = 128
+
+    def __init__(self, rootdir, server_address):
+        HTTPServer.__init__(self, server_address, ArtifactRequestHandler)
+        self.rootdir = os.path.abspath(rootdir)
+        self.stats = ArtifactStats()
+
+
+class ArtifactRequestHandler(BaseHTTPRequestHandler):
+    # keep-alive: lets clients fetch several artifacts over one connection
+    protocol_version = 'HTTP/1.1'
+
+    def do_HEAD(self):
+        self._serve(send_body=False)
+
+
+    def do_GET(self):
+        self._serve(send_body=True)
+
+
+    def _serve(self, send_body):
+        path = self._get_local_path()
+        if not path or not os.path.isfile(path):
+            self._send_empty(404)
+            return
+        with open(path, 'rb') as fileobj:
+            stat = os.fstat(fileobj.fileno())
+            # same scheme as nginx: changes whenever the file is replaced or modified
+            etag = '"{:x}-{:x}-{:x}"'.format(stat.st_ino, int(stat.st_mtime), stat.st_size)
+            if_none_match = self.headers.get('If-None-Match', '')
+            if if_none_match.strip() == '*' or etag in [tag.strip() for tag in if_none_match.split(',')]:
+                self._send_empty(304, {'ETag': etag})
+                return
+
+            size = stat.st_size
+            start, end = 0, size - 1
+            status = 200
+            byte_range = self.headers.get('Range')
+            if byte_range and self.headers.get('If-Range', etag) == etag:
+                parsed_range = self._parse_range(byte_range, size)
+                if parsed_range is None:
+                    self._send_empty(416, {'Content-Range': 'bytes */{}'.format(size)})
+                    return
+                if parsed_range:
+                    start, end = parsed_range
+                    status = 206
+
+            self.send_response(status)
+            self.send_header('Content-Type', mimetypes.guess_type(path)[0] or 'application/octet-stream')
+            self.send_header('Content-Length', str(end - start + 1))
+            self.send_header('Last-Modified', email.utils.formatdate(stat.st_mtime, usegmt=True))
+            self.send_header('ETag', etag)
+            self.send_header('Accept-Ranges', 'bytes')
+            if status == 206:
+                self.send_header('Content-Range', 'bytes {}-{}/{}'.format(start, end, size))
+            self.end_headers()
+            if not send_body:
+                return
+
+            begin = time.time()
+            sent = self._send_file(fileobj, start, end - start + 1)
+            seconds = time.time() - begin
+            requests, total_bytes, total_seconds = self.server.stats.add(os.path.basename(path), sent, seconds)
+            logger.info('{} {}: {} bytes in {:.2f}s ({:.1f} MB/s). Total for artifact: {} requests, {:.1f} MB'.format(
+                self.client_address[0], self.path, sent, seconds, sent / 1048576. / max(seconds, 0.001),
+                requests, total_bytes / 1048576.))
+
+
+    def _get_local_path(self):
+        '''Returns the requested file's path within the served directory, or None if it's outside'''
+        relpath = unquote(urlparse(self.path).path).lstrip('/')
+        path = os.path.abspath(os.path.join(self.server.rootdir, relpath))
+        if not path.startswith(self.server.rootdir + os.sep):
+            return None
+        return path
+
+
+    def _parse_range(self, byte_range, size):
+        '''Returns (start, end) inclusive, False if the range should be ignored (ie serve the whole file),
+        or None if the range isn't satisfiable'''
+        match = RANGE_PATTERN.match(byte_range.strip())
+        if not match:
+            # includes multiple ranges, which we don't support: fall back to the whole file
+            return False
+        first, last = match.groups()
+        if not first and not last:
+            return False
+        if not first:
+            # suffix range: the last N bytes
+            if int(last) == 0:
+                return None
+            return (max(0, size - int(last)), size - 1)
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+        if start >= size or start > end:
+            return None
+        return (start, end)
+
+
+    def _send_file(self, fileobj, offset, count):
+        '''Returns the number of bytes sent'''
+        sent = 0
+        if hasattr(os, 'sendfile'):
+            try:
+                while sent < count:
+                    num = os.sendfile(self.connection.fileno(), fileobj.fileno(), offset + sent,
+                                      min(count - sent, SENDFILE_MAX_BYTES))
+                    if num == 0:
+                        break
+                    sent += num
+                return sent
+            except OSError as e:
+                if sent:
+                    # partially sent, eg the client disconnected
+                    raise
+                logger.info('sendfile() unavailable, falling back to copying: {}'.format(e))
+        fileobj.seek(offset)
+        remaining = count
+        while remaining > 0:
+            chunk = fileobj.read(min(remaining, 1024 * 1024))
+            if not chunk:
+                break
+            self.wfile.write(chunk)
+            remaining -= len(chunk)
+        return count - remaining
+
+
+    def _send_empty(self, status, headers=None):
+        self.send_response(status)
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+
+    def log_message(self, format, *args):
+        logger.info('{} {}'.format(self.client_address[0], format % args))
+
+
+def serve(rootdir, host, port):
+    httpd = ThreadingHTTPServer(rootdir, (host, port))
+    logger.info('Serving {} at http://{}:{}'.format(rootdir, host, httpd.server_address[1]))
+    httpd.serve_forever()
+
+
+def main(argv):
+    if len(argv) != 4:
+        logger.error('Syntax: {} <root-dir> <host> <port>'.format(argv[0]))
+        return 1
+    serve(argv[1], argv[2], int(argv[3]))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -8,15 +8,21 @@ Features:
 3. Formats volumes and configures fstab entires
 4. Configures Mesos Agent and relaunches instances for changes to take effect.
 
+Each step is performed for all private agents at once: volumes are created concurrently, waited on
+together, attached concurrently, and then the agents are configured in parallel over SSH.
+
 Note: Currently, enable_mount_volumes only works with AWS DC/OS clusters.
 """
 
 import boto3
 import botocore
+import concurrent.futures
 import logging
 import os
 import pprint
+import random
 import sys
+import threading
 import time
 import uuid
 
@@ -26,6 +32,82 @@ from fabric.tasks import execute
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO, format="%(message)s")
 
+# Max number of agents which are provisioned or configured at once
+DEFAULT_CONCURRENCY = 10
+
+# EC2 error codes which mean that we're sending requests too quickly
+THROTTLING_ERROR_CODES = ['RequestLimitExceeded', 'Throttling', 'ThrottlingException']
+MAX_ATTEMPTS = 16
+MAX_BACKOFF_SECONDS = 60
+
+# Volumes usually become available/attached within seconds, so poll more often than the default 15s
+WAITER_CONFIG = {'Delay': 3, 'MaxAttempts': 200}
+
+
+class RateLimitBackoff(object):
+    """
+    Retries EC2 calls which were throttled, with an exponential backoff that's shared by all threads:
+    once any call is throttled, every call waits out the backoff, rather than each thread continuing
+    to send requests into the limit.
+    """
+
+    def __init__(self, max_attempts=MAX_ATTEMPTS):
+        self._lock = threading.Lock()
+        self._max_attempts = max_attempts
+        self._throttled_count = 0
+        self._resume_time = 0
+
+    def call(self, description, fn, *args, **kwargs):
+        attempts = 0
+        while True:
+            self._wait()
+            attempts += 1
+            try:
+                result = fn(*args, **kwargs)
+            except (botocore.exceptions.ClientError, botocore.exceptions.WaiterError) as e:
+                if attempts >= self._max_attempts or not _is_throttled(e):
+                    logger.error('{} failed: {}'.format(description, e))
+                    raise
+                wait_seconds = self._throttled()
+                logger.error('{} was throttled, retrying in {:.1f}s: {}'.format(description, wait_seconds, e))
+                continue
+            self._succeeded()
+            return result
+
+    def _wait(self):
+        with self._lock:
+            wait_seconds = self._resume_time - time.time()
+        if wait_seconds > 0:
+            time.sleep(wait_seconds)
+
+    def _throttled(self):
+        """
+        Returns the number of seconds until calls may resume
+        """
+        with self._lock:
+            self._throttled_count += 1
+            backoff = min(2 ** self._throttled_count, MAX_BACKOFF_SECONDS) * random.uniform(0.5, 1)
+            now = time.time()
+            self._resume_time = max(self._resume_time, now + backoff)
+            return self._resume_time - now
+
+    def _succeeded(self):
+        with self._lock:
+            # ease off the backoff gradually, rather than returning straight to full speed
+            self._throttled_count = max(0, self._throttled_count - 1)
+
+
+def _is_throttled(e):
+    if isinstance(e, botocore.exceptions.WaiterError):
+        # a waiter gives up when it gets an unexpected error, eg from being throttled
+        error = (e.last_response or {}).get('Error', {})
+    else:
+        error = e.response.get('Error', {})
+    return error.get('Code') in THROTTLING_ERROR_CODES
+
+
+_backoff = RateLimitBackoff()
+
 
 def tag_match(instance, key, value):
     tags = instance.get('Tags')
@@ -69,11 +151,25 @@ def filter_instances_private(instances):
 
 
 def create_volume(client, zone):
-    response = client.create_volume(
+    response = _backoff.call(
+        'Create volume in {}'.format(zone),
+        client.create_volume,
         Size=12,
         AvailabilityZone=zone,
         VolumeType='gp2',
-        Encrypted=False
+        Encrypted=False,
+        # tag in the same request, rather than with a separate create_tags call
+        TagSpecifications=[
+            {
+                'ResourceType': 'volume',
+                'Tags': [
+                    {
+                        'Key': 'ccm_volume_name',
+                        'Value': 'infinity-' + str(uuid.uuid1())
+                    }
+                ]
+            }
+        ]
     )
 
     logger.info('Create volume response: {}'.format(response))
@@ -82,7 +178,9 @@ def create_volume(client, zone):
 
 
 def attach_volume(client, volume_id, instance_id, device='/dev/xvdm'):
-    response = client.attach_volume(
+    response = _backoff.call(
+        'Attach volume {} to {}'.format(volume_id, instance_id),
+        client.attach_volume,
         VolumeId=volume_id,
         InstanceId=instance_id,
         Device=device)
@@ -93,7 +191,9 @@ def attach_volume(client, volume_id, instance_id, device='/dev/xvdm'):
 
 
 def configure_delete_on_termination(client, volume_id, instance_id, device='/dev/xvdm'):
-    response = client.modify_instance_attribute(
+    response = _backoff.call(
+        'Set delete on termination for {}'.format(volume_id),
+        client.modify_instance_attribute,
         InstanceId=instance_id,
         BlockDeviceMappings=[
             {
@@ -111,18 +211,16 @@ def configure_delete_on_termination(client, volume_id, instance_id, device='/dev
     return response
 
 
-def tag_volume(client, volume_id):
-    response = client.create_tags(
-        Resources=[volume_id],
-        Tags=[
-            {
-                'Key': 'ccm_volume_name',
-                'Value': 'infinity-' + str(uuid.uuid1())
-            }
-        ]
-    )
-
-    return response
+def wait_for_volumes(client, waiter_name, volume_ids):
+    """
+    Waits for all of the volumes to reach the waiter's state, with a single waiter
+    """
+    _backoff.call(
+        'Wait for {} volumes ({})'.format(len(volume_ids), waiter_name),
+        client.get_waiter(waiter_name).wait,
+        VolumeIds=volume_ids,
+        WaiterConfig=WAITER_CONFIG)
+    logger.info('Volumes are now {}: {}'.format(waiter_name, ', '.join(volume_ids)))
 
 
 def detach_volume(client, volume_id, instance_id, device='/dev/xvdm'):
@@ -159,6 +257,14 @@ def configure_mesos():
     run("sudo systemctl start dcos-mesos-slave")
 
 
+def configure_agent():
+    """
+    Configures the attached EBS volume as a mount volume on the current host
+    """
+    configure_instance()
+    configure_mesos()
+
+
 def main(stack_id = ''):
     # Read inputs from environment
     aws_access_key = os.environ.get('AWS_ACCESS_KEY_ID', '')
@@ -204,91 +310,47 @@ def main(stack_id = ''):
     # Attach EBS volumes to private instances only
     private_instances = filter_instances_private(instances)
 
+    running_instances = []
     for instance in private_instances:
         # If an instance is not running, ignore it.
         if instance.get('State').get('Name') != 'running':
             logger.info('Ignoring instance that is not running: {}'.format(instance))
             continue
-
-        instance_id = instance['InstanceId']
-        azone = instance['Placement']['AvailabilityZone']
-
-        # Create volume for the instance in the same AvailabilityZone
-        volume = create_volume(ec2, azone)
-        logger.info('Creating volume: {}'.format(volume))
-
-        volume_id = volume['VolumeId']
-
-        # Wait for volume to be available.
-        volume_waiter = ec2.get_waiter('volume_available')
-
-        attempts = 0
-        max_attempts = 16
-        wait_time = 1
-        while attempts < max_attempts:
-            attempts += 1
-            try:
-                volume_waiter.wait(VolumeIds=[volume_id])
-                logger.info('Volume: {} is now available'.format(volume_id))
-                break
-            except botocore.exceptions.WaiterError as e:
-                logger.error('Error occured: {}'.format(e))
-                raise e
-            except botocore.exceptions.ClientError as e:
-                logger.error('Error occured: {}'.format(e))
-                if e.response['Error']['Code'] == 'RequestLimitExceeded':
-                    curr_wait_time = 2**attempts * wait_time
-                    logger.error('Going to wait for: {} before retrying.'.format(curr_wait_time))
-                    time.sleep(curr_wait_time)
-                else:
-                    raise e
-
-
-        # Attach the volume to our instance.
-        att_res = attach_volume(ec2, volume_id=volume_id, instance_id=instance_id)
-        logger.info('Attaching volume: {}'.format(att_res))
-
-        # Wait for volume to attach.
-        volume_attach = ec2.get_waiter('volume_in_use')
-
-        attempts = 0
-        max_attempts = 16
-        wait_time = 1
-        while attempts < max_attempts:
-            attempts += 1
-            try:
-                volume_attach.wait(VolumeIds=[volume_id])
-                logger.info('Volume: {} is now attached to instance: {}'.format(volume_id, instance_id))
-                break
-            except botocore.exceptions.WaiterError as e:
-                logger.error('Error occured: {}'.format(e))
-                raise e
-            except botocore.exceptions.ClientError as e:
-                logger.error('Error occured: {}'.format(e))
-                if e.response['Error']['Code'] == 'RequestLimitExceeded':
-                    curr_wait_time = 2**attempts * wait_time
-                    logger.error('Going to wait for: {} before retrying.'.format(curr_wait_time))
-                    time.sleep(curr_wait_time)
-                else:
-                    raise e
-
-
-        conf_res = configure_delete_on_termination(ec2, volume_id=volume_id, instance_id=instance_id)
-        logger.info('Delete on termination: {}'.format(conf_res))
-
-        tag_res = tag_volume(ec2, volume_id=volume_id)
-        logger.info('Tag volume: {}'.format(tag_res))
-
-        private_ip = instance.get('PrivateIpAddress')
-        env.hosts = [private_ip]
-        env.gateway = gateway_ip
-        env.user = 'core'
-
-        logger.info('Configuring instance for partition: {}'.format(private_ip))
-        execute(configure_instance)
-
-        logger.info('Configuring instance for mesos resources: {}'.format(private_ip))
-        execute(configure_mesos)
+        running_instances.append(instance)
+    if not running_instances:
+        logger.info('No running private instances found, nothing to do.')
+        return 0
+    instance_ids = [instance['InstanceId'] for instance in running_instances]
+
+    concurrency = int(os.environ.get('MOUNT_VOLUMES_CONCURRENCY', DEFAULT_CONCURRENCY))
+    with concurrent.futures.ThreadPoolExecutor(max_workers=min(concurrency, len(running_instances))) as executor:
+        # Create a volume for each instance in the same AvailabilityZone
+        volumes = list(executor.map(
+            lambda instance: create_volume(ec2, instance['Placement']['AvailabilityZone']),
+            running_instances))
+        volume_ids = [volume['VolumeId'] for volume in volumes]
+        logger.info('Created {} volumes: {}'.format(len(volume_ids), ', '.join(volume_ids)))
+        wait_for_volumes(ec2, 'volume_available', volume_ids)
+
+        # Attach each volume to its instance
+        list(executor.map(
+            lambda ids: attach_volume(ec2, volume_id=ids[0], instance_id=ids[1]),
+            zip(volume_ids, instance_ids)))
+        wait_for_volumes(ec2, 'volume_in_use', volume_ids)
+
+        list(executor.map(
+            lambda ids: configure_delete_on_termination(ec2, volume_id=ids[0], instance_id=ids[1]),
+            zip(volume_ids, instance_ids)))
+
+    private_ips = [instance.get('PrivateIpAddress') for instance in running_instances]
+    env.gateway = gateway_ip
+    env.user = 'core'
+    env.parallel = True
+    env.pool_size = concurrency
+
+    logger.info('Configuring {} instances for partition and mesos resources: {}'.format(
+        len(private_ips), ', '.join(private_ips)))
+    execute(configure_agent, hosts=private_ips)
 
     logger.info('Mount volumes enabled. Exiting now...')
     return 0
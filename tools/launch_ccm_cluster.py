@@ -12,6 +12,10 @@
 # CLUSTER_URL=...
 # CLUSTER_AUTH_TOKEN=...
 #
+# In 'pool' mode, launches several clusters at once and runs a list of jobs against them, handing each
+# job the next cluster to become ready and recycling clusters between jobs. stdout is then a list of
+# the jobs' results.
+#
 # Configuration: Mostly through env vars. See README.md.
 
 import json
@@ -22,7 +26,9 @@ import random
 import string
 import subprocess
 import sys
+import threading
 import time
+from multiprocessing.pool import ThreadPool
 
 import dcos_login
 import github_update
@@ -55,6 +61,9 @@ class CCMLauncher(object):
     # Reverse (name => number):
     _CCM_STATUS_LABELS = {v: k for k, v in _CCM_STATUSES.items()}
 
+    # Statuses which a newly created cluster passes through before reaching RUNNING:
+    _STARTING_STATUSES = ['CREATING', 'RUNNING_NEEDS_INFO']
+
     _CCM_HOST = 'ccm.mesosphere.com'
     _CCM_PATH = '/api/cluster/'
 
@@ -137,13 +146,46 @@ class CCMLauncher(object):
         return response
 
 
+    def _check_status(self, cluster_id, pending_status_labels, complete_status_label):
+        '''Queries the cluster's current status once. Returns a tuple of (result, status_label), where result is
+        the cluster_info once the cluster has reached the complete status, None if the cluster has entered a
+        status which isn't pending (or its cluster_info is invalid), or False if it's still pending.
+        status_label is None if the status couldn't be retrieved.'''
+        pending_state_codes = [self._CCM_STATUS_LABELS[label] for label in pending_status_labels]
+        complete_state_code = self._CCM_STATUS_LABELS[complete_status_label]
+
+        response = self._query_http('GET', self._CCM_PATH + str(cluster_id) + '/')
+        if not response:
+            return (False, None)
+        status_json = json.loads(response.read().decode('utf-8'))
+        status_code = status_json.get('status', -1)
+        status_label = self._CCM_STATUSES.get(status_code, 'unknown:{}'.format(status_code))
+        if status_code == complete_state_code:
+            # additional check: does the cluster have a non-empty 'cluster_info'?
+            cluster_info_str = status_json.get('cluster_info', '')
+            if cluster_info_str:
+                # cluster_info in the CCM API is a string containing a dict...:
+                logger.info('Cluster {} has entered state {}, returning cluster_info.'.format(
+                    cluster_id, status_label))
+                try:
+                    return (json.loads(cluster_info_str), status_label)
+                except:
+                    logger.error('Failed to parse cluster_info string as JSON. Operation failed?: "{}"'.format(cluster_info_str))
+                    return (None, status_label)
+            else:
+                logger.error('Cluster {} has entered state {}, but lacks cluster_info...'.format(
+                    cluster_id, status_label))
+        elif status_code not in pending_state_codes:
+            logger.error('Cluster {} has entered state {}. Giving up.'.format(
+                cluster_id, status_label))
+            return (None, status_label)
+        return (False, status_label)
+
+
     def wait_for_status(self, cluster_id, pending_status_labels, complete_status_label, timeout_minutes):
         logger.info('Waiting {} minutes for cluster {} to transition from {} to {}'.format(
             timeout_minutes, cluster_id, ', '.join(pending_status_labels), complete_status_label))
 
-        pending_state_codes = [self._CCM_STATUS_LABELS[label] for label in pending_status_labels]
-        complete_state_code = self._CCM_STATUS_LABELS[complete_status_label]
-
         start_time = time.time()
         stop_time = start_time + (60 * timeout_minutes)
         sleep_duration_s = 1
@@ -153,31 +195,10 @@ class CCMLauncher(object):
             if sleep_duration_s < 32:
                 sleep_duration_s *= 2
 
-            response = self._query_http('GET', self._CCM_PATH + str(cluster_id) + '/')
-            if response:
-                status_json = json.loads(response.read().decode('utf-8'))
-                status_code = status_json.get('status', -1)
-                status_label = self._CCM_STATUSES.get(status_code, 'unknown:{}'.format(status_code))
-                if status_code == complete_state_code:
-                    # additional check: does the cluster have a non-empty 'cluster_info'?
-                    cluster_info_str = status_json.get('cluster_info', '')
-                    if cluster_info_str:
-                        # cluster_info in the CCM API is a string containing a dict...:
-                        logger.info('Cluster {} has entered state {}, returning cluster_info.'.format(
-                            cluster_id, status_label))
-                        try:
-                            return json.loads(cluster_info_str)
-                        except:
-                            logger.error('Failed to parse cluster_info string as JSON. Operation failed?: "{}"'.format(cluster_info_str))
-                            return None
-                    else:
-                        logger.error('Cluster {} has entered state {}, but lacks cluster_info...'.format(
-                            cluster_id, status_label))
-                elif status_code not in pending_state_codes:
-                    logger.error('Cluster {} has entered state {}. Giving up.'.format(
-                        cluster_id, status_label))
-                    return None
-
+            result, status_label = self._check_status(cluster_id, pending_status_labels, complete_status_label)
+            if result is not False:
+                return result
+            if status_label:
                 logger.info('Cluster {} has state {} after {}, refreshing in {}. ({} left)'.format(
                     cluster_id,
                     status_label,
@@ -203,6 +224,19 @@ class CCMLauncher(object):
 
 
     def _start(self, config):
+        cluster_id, stack_id = self._create(config)
+        cluster_info = self.wait_for_status(
+            cluster_id,
+            self._STARTING_STATUSES,
+            'RUNNING', # desired state
+            config.start_timeout_mins)
+        if not cluster_info:
+            raise Exception('CCM cluster creation failed or timed out')
+        return self._setup(config, cluster_id, stack_id, cluster_info)
+
+
+    def _create(self, config):
+        '''Sends the cluster creation request. Returns the new cluster's (cluster_id, stack_id).'''
         is_17_cluster = config.ccm_channel in self._DCOS_17_CHANNELS
         if is_17_cluster:
             hostrepo = 's3.amazonaws.com/downloads.mesosphere.io/dcos'
@@ -257,14 +291,11 @@ class CCMLauncher(object):
         stack_id = response_json.get('stack_id', '')
         if not stack_id:
             raise Exception('No Stack ID returned in cluster creation response: {}'.format(response_content))
+        return (cluster_id, stack_id)
 
-        cluster_info = self.wait_for_status(
-            cluster_id,
-            ['CREATING', 'RUNNING_NEEDS_INFO'], # pending states
-            'RUNNING', # desired state
-            config.start_timeout_mins)
-        if not cluster_info:
-            raise Exception('CCM cluster creation failed or timed out')
+
+    def _setup(self, config, cluster_id, stack_id, cluster_info):
+        '''Configures a cluster which has reached RUNNING. Returns the cluster's id, url, and auth_token.'''
         dns_address = cluster_info.get('DnsAddress', '')
         if not dns_address:
             raise Exception('CCM cluster_info is missing DnsAddress: {}'.format(cluster_info))
@@ -381,6 +412,269 @@ class StopConfig(object):
         self.stop_timeout_mins = os.environ.get('CCM_TIMEOUT_MINS', stop_timeout_mins)
 
 
+class CCMClusterPool(object):
+    '''Launches several clusters concurrently, and hands them out to jobs as they become ready.
+
+    All of the clusters which are still starting are tracked by a single status polling loop, rather than
+    a wait_for_status() per cluster. A cluster which fails to start is replaced, up to the configured
+    number of attempts. When a job is done with a cluster, the cluster is recycled by running the recycle
+    command against it (eg to uninstall/janitor any leftover services), then handed to the next job. A
+    cluster which fails recycling is torn down and replaced.'''
+
+    def __init__(self, launcher, config, size, attempts=CCMLauncher.DEFAULT_ATTEMPTS, recycle_cmd=''):
+        self._launcher = launcher
+        self._config = config
+        self._size = size
+        self._attempts = attempts
+        self._recycle_cmd = recycle_cmd
+        # launches and post-launch setup, which may each take a while:
+        self._workers = ThreadPool(size)
+        self._condition = threading.Condition()
+        # cluster_id => (stack_id, attempt, deadline), for clusters which haven't reached RUNNING yet:
+        self._starting = {}
+        # clusters which are ready for acquire():
+        self._ready = []
+        # every cluster which was created, for close():
+        self._cluster_ids = []
+        # slots whose cluster is ready, in use, or on its way. reduced when a slot runs out of attempts:
+        self._live_slots = size
+        self._closed = False
+        self._poll_thread = None
+
+
+    def start(self):
+        '''Triggers the launch of all clusters in the pool, without waiting for any of them to be ready'''
+        logger.info('Launching pool of {} clusters'.format(self._size))
+        self._launcher._github_updater.update('pending', 'Launching {} clusters'.format(self._size))
+        for _ in range(self._size):
+            self._workers.apply_async(self._launch, (1,))
+        self._poll_thread = threading.Thread(target=self._poll)
+        self._poll_thread.daemon = True
+        self._poll_thread.start()
+
+
+    def acquire(self):
+        '''Returns the next ready cluster, waiting for one if needed. Raises if every slot in the pool has
+        run out of launch attempts.'''
+        with self._condition:
+            while not self._ready:
+                if not self._live_slots:
+                    raise Exception('All clusters in the pool of {} failed to launch'.format(self._size))
+                # with a timeout: in python 2 an untimed wait() can't be interrupted with ctrl+c
+                self._condition.wait(1)
+            return self._ready.pop(0)
+
+
+    def release(self, cluster):
+        '''Recycles a cluster returned by acquire() and makes it available to the next acquire()'''
+        if self._recycle(cluster):
+            with self._condition:
+                self._ready.append(cluster)
+                self._condition.notify_all()
+        else:
+            self._replace(cluster['id'], 'recycling failed')
+
+
+    def run_jobs(self, jobs):
+        '''Runs each job (a shell command) against the next available cluster, with the cluster's
+        CLUSTER_ID, CLUSTER_URL, and CLUSTER_AUTH_TOKEN in its environment. Returns a list of each job's
+        result, in the order that the jobs were provided.'''
+        job_runners = ThreadPool(self._size)
+        try:
+            return job_runners.map(self._run_job, jobs)
+        finally:
+            job_runners.close()
+
+
+    def close(self, stop_clusters=True):
+        '''Stops polling and tears down every cluster the pool created, without waiting for teardown
+        to complete.'''
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+            cluster_ids = list(self._cluster_ids)
+        self._workers.close()
+        if not stop_clusters:
+            logger.info('Leaving {} pool clusters running: {}'.format(len(cluster_ids), cluster_ids))
+            return
+        for cluster_id in cluster_ids:
+            self._trigger_stop(cluster_id)
+
+
+    def _launch(self, attempt):
+        try:
+            cluster_id, stack_id = self._launcher._create(self._config)
+        except Exception as e:
+            self._slot_failed(attempt, 'Launch request failed: {}'.format(e))
+            return
+        with self._condition:
+            closed = self._closed
+            if not closed:
+                self._cluster_ids.append(cluster_id)
+                self._starting[cluster_id] = (stack_id, attempt, time.time() + 60 * self._config.start_timeout_mins)
+                self._condition.notify_all()
+        if closed:
+            # launched after close() had already torn down the rest of the pool:
+            self._trigger_stop(cluster_id)
+
+
+    def _poll(self):
+        '''Polls the status of every starting cluster at once, until the pool is closed'''
+        sleep_duration_s = 1
+        while True:
+            with self._condition:
+                while not self._starting and not self._closed:
+                    # idle: start again with short intervals once there's something to poll
+                    sleep_duration_s = 1
+                    self._condition.wait(1)
+                if self._closed:
+                    return
+                starting = dict(self._starting)
+            if sleep_duration_s < 32:
+                sleep_duration_s *= 2
+
+            now = time.time()
+            for cluster_id, (stack_id, attempt, deadline) in starting.items():
+                try:
+                    cluster_info, status_label = self._launcher._check_status(
+                        cluster_id, self._launcher._STARTING_STATUSES, 'RUNNING')
+                except Exception as e:
+                    # eg a dropped connection: same as a failed query, try again on the next pass
+                    logger.error('Failed to get cluster {} state: {}'.format(cluster_id, e))
+                    cluster_info = False
+                if cluster_info is False and now < deadline:
+                    continue
+                with self._condition:
+                    del self._starting[cluster_id]
+                if cluster_info:
+                    logger.info('Pool cluster {} is now RUNNING: {}'.format(cluster_id, cluster_info))
+                    self._workers.apply_async(self._setup, (cluster_id, stack_id, attempt, cluster_info))
+                elif cluster_info is None:
+                    self._trigger_stop(cluster_id)
+                    self._slot_failed(attempt, 'Cluster {} failed to start'.format(cluster_id))
+                else:
+                    self._trigger_stop(cluster_id)
+                    self._slot_failed(attempt, 'Cluster {} timed out after {} minutes'.format(
+                        cluster_id, self._config.start_timeout_mins))
+
+            with self._condition:
+                logger.info('Pool: {} starting, {} ready, {} live slots. Refreshing in {}'.format(
+                    len(self._starting), len(self._ready), self._live_slots,
+                    self._launcher._pretty_time(sleep_duration_s)))
+                # other notifications (eg clusters becoming ready) don't warrant an early poll, but close() does:
+                wake_time = time.time() + sleep_duration_s
+                while not self._closed and time.time() < wake_time:
+                    self._condition.wait(wake_time - time.time())
+
+
+    def _setup(self, cluster_id, stack_id, attempt, cluster_info):
+        try:
+            cluster = self._launcher._setup(self._config, cluster_id, stack_id, cluster_info)
+        except Exception as e:
+            self._trigger_stop(cluster_id)
+            self._slot_failed(attempt, 'Setup of cluster {} failed: {}'.format(cluster_id, e))
+            return
+        with self._condition:
+            self._ready.append(cluster)
+            self._condition.notify_all()
+
+
+    def _slot_failed(self, attempt, reason):
+        if attempt < self._attempts and not self._closed:
+            logger.error('[{}/{}] {}. Launching a replacement.'.format(attempt, self._attempts, reason))
+            self._workers.apply_async(self._launch, (attempt + 1,))
+            return
+        logger.error('[{}/{}] {}. Giving up on this cluster.'.format(attempt, self._attempts, reason))
+        with self._condition:
+            self._live_slots -= 1
+            self._condition.notify_all()
+            live_slots = self._live_slots
+        self._launcher._github_updater.update(
+            'error' if not live_slots else 'pending',
+            'Pool down to {}/{} clusters'.format(live_slots, self._size))
+
+
+    def _replace(self, cluster_id, reason):
+        self._trigger_stop(cluster_id)
+        # the replacement gets a fresh set of attempts:
+        self._slot_failed(1, 'Cluster {}: {}'.format(cluster_id, reason))
+
+
+    def _trigger_stop(self, cluster_id):
+        try:
+            self._launcher.trigger_stop(StopConfig(str(cluster_id)))
+        except Exception as e:
+            logger.error('Failed to trigger teardown of cluster {}: {}'.format(cluster_id, e))
+
+
+    def _recycle(self, cluster):
+        if not self._recycle_cmd:
+            return True
+        logger.info('Recycling cluster {}: {}'.format(cluster['id'], self._recycle_cmd))
+        returncode = _run_against_cluster('recycle:{}'.format(cluster['id']), self._recycle_cmd, cluster)
+        if returncode != 0:
+            logger.error('Recycle command exited with {} for cluster {}'.format(returncode, cluster['id']))
+            return False
+        return True
+
+
+    def _run_job(self, job):
+        start = time.time()
+        try:
+            cluster = self.acquire()
+        except Exception as e:
+            logger.error('Job "{}" failed to get a cluster: {}'.format(job, e))
+            return {'job': job, 'cluster_id': None, 'returncode': None, 'error': str(e)}
+        logger.info('Job "{}" got cluster {} after {}'.format(
+            job, cluster['id'], self._launcher._pretty_time(time.time() - start)))
+        job_start = time.time()
+        try:
+            returncode = _run_against_cluster(job, job, cluster)
+        except Exception as e:
+            logger.error('Job "{}" failed to run against cluster {}: {}'.format(job, cluster['id'], e))
+            return {'job': job, 'cluster_id': cluster['id'], 'returncode': None, 'error': str(e)}
+        finally:
+            # the cluster is needed by the remaining jobs regardless of how this one went:
+            self.release(cluster)
+        duration = time.time() - job_start
+        logger.info('Job "{}" exited with {} after {}'.format(job, returncode, self._launcher._pretty_time(duration)))
+        return {'job': job, 'cluster_id': cluster['id'], 'returncode': returncode, 'duration_s': duration}
+
+
+def _run_against_cluster(name, cmd, cluster):
+    '''Runs the shell command with the cluster's info in its env, logging its output prefixed by name.
+    Returns the command's exit code.'''
+    env = os.environ.copy()
+    env['CLUSTER_ID'] = str(cluster['id'])
+    env['CLUSTER_URL'] = cluster['url']
+    env['CLUSTER_AUTH_TOKEN'] = cluster['auth_token']
+    proc = subprocess.Popen(cmd, shell=True, env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    # prefix each line, as several jobs' output is interleaved:
+    for line in iter(proc.stdout.readline, b''):
+        logger.info('[{}] {}'.format(name, line.decode('utf-8', 'replace').rstrip()))
+    return proc.wait()
+
+
+def _run_pool(launcher, size, jobs, attempts):
+    pool = CCMClusterPool(launcher, StartConfig(), size, attempts, os.environ.get('CCM_POOL_RECYCLE_CMD', ''))
+    # the rest of this script only writes to stderr, and setup of each cluster may temporarily swap stdout
+    # with stderr. with several setups in parallel, keep stdout pointed at stderr until we're done:
+    stdout = sys.stdout
+    sys.stdout = sys.stderr
+    try:
+        pool.start()
+        results = pool.run_jobs(jobs)
+    finally:
+        pool.close(stop_clusters=not os.environ.get('CCM_POOL_KEEP_CLUSTERS', ''))
+        sys.stdout = stdout
+    failed = [r for r in results if r['returncode'] != 0]
+    launcher._github_updater.update(
+        'error' if failed else 'success',
+        '{}/{} jobs succeeded across {} clusters'.format(len(results) - len(failed), len(results), size))
+    print(json.dumps(results))
+    return 1 if failed else 0
+
+
 def _write_jenkins_config(github_label, cluster_info, error = None):
     if not 'WORKSPACE' in os.environ:
         return
@@ -444,8 +738,16 @@ def main(argv):
             else:
                 logger.info('Usage: {} wait <ccm_id> <current_state> <new_state>'.format(argv[0]))
                 return 1
+        if argv[1] == 'pool':
+            if len(argv) >= 4:
+                jobs = argv[3:]
+                # no point in launching more clusters than there are jobs:
+                return _run_pool(launcher, min(int(argv[2]), len(jobs)), jobs, start_stop_attempts)
+            else:
+                logger.info('Usage: {} pool <size> <job cmd> [job cmd ...]'.format(argv[0]))
+                return 1
         else:
-            logger.info('Usage: {} [stop <ccm_id>|trigger-stop <ccm_id>|wait <ccm_id> <current_state> <new_state>]'.format(argv[0]))
+            logger.info('Usage: {} [stop <ccm_id>|trigger-stop <ccm_id>|wait <ccm_id> <current_state> <new_state>|pool <size> <job cmd> [job cmd ...]]'.format(argv[0]))
             return
 
     try:
@@ -7,10 +7,12 @@
 # Env:
 #   S3_BUCKET (default: infinity-artifacts)
 #   S3_DIR_PATH (default: autdelete7d)
-#   S3_URL (default: s3://${S3_BUCKET}/${S3_DIR_PATH}/<pkg_name>/<random>
+#   S3_URL (default: s3://${S3_BUCKET}/${S3_DIR_PATH}/<pkg_name>/<random>, or <date>-<content hash> with S3_DEDUP
 #   ARTIFACT_DIR (default: ...s3.amazonaws.com...)
 #     Base HTTP dir to use when rendering links
+#   S3_ENDPOINT_URL, S3_UPLOAD_*: see s3_upload.py
 
+import hashlib
 import logging
 import os
 import os.path
@@ -22,6 +24,12 @@ import time
 import github_update
 import universe_builder
 
+try:
+    import s3_upload
+except ImportError:
+    # boto3 isn't installed: fall back to the aws CLI
+    s3_upload = None
+
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.DEBUG, format="%(message)s")
 
@@ -39,14 +47,34 @@ class AWSPublisher(object):
         self._pkg_version = package_version
         self._input_dir_path = input_dir_path
 
+        self._github_updater = github_update.GithubStatusUpdater('upload:{}'.format(package_name))
+
+        if not os.path.isdir(input_dir_path):
+            err = 'Provided package path is not a directory: {}'.format(input_dir_path)
+            self._github_updater.update('error', err)
+            raise Exception(err)
+
+        self._artifact_paths = []
+        for artifact_path in artifact_paths:
+            if not os.path.isfile(artifact_path):
+                err = 'Provided package path is not a file: {} (full list: {})'.format(artifact_path, artifact_paths)
+                raise Exception(err)
+            if artifact_path in self._artifact_paths:
+                err = 'Duplicate filename between "{}" and "{}". Artifact filenames must be unique.'.format(prior_path, artifact_path)
+                self._github_updater.update('error', err)
+                raise Exception(err)
+            self._artifact_paths.append(artifact_path)
+
         self._aws_region = os.environ.get('AWS_UPLOAD_REGION', '')
         s3_bucket = os.environ.get('S3_BUCKET', 'infinity-artifacts')
         s3_dir_path = os.environ.get('S3_DIR_PATH', 'autodelete7d')
-        dir_name = '{}-{}'.format(
-            time.strftime("%Y%m%d-%H%M%S"),
-            ''.join([random.SystemRandom().choice(string.ascii_letters + string.digits) for i in range(16)]))
+        if s3_upload and os.environ.get('S3_DEDUP', ''):
+            # reruns of the same build reuse the directory, see _get_build_dir_name():
+            dir_name = _get_build_dir_name(package_name, package_version, input_dir_path, self._artifact_paths)
+        else:
+            dir_name = ''.join([random.SystemRandom().choice(string.ascii_letters + string.digits) for i in range(16)])
 
-        # sample s3_directory: 'infinity-artifacts/autodelete7d/kafka/20160815-134747-S6vxd0gRQBw43NNy'
+        # sample s3_directory: 'infinity-artifacts/autodelete7d/kafka/4c1f2e7a9b3d5f60'
         self._s3_directory = os.environ.get(
             'S3_URL',
             's3://{}/{}/{}/{}'.format(
@@ -63,35 +91,44 @@ class AWSPublisher(object):
                 self._pkg_name,
                 dir_name))
 
-        self._github_updater = github_update.GithubStatusUpdater('upload:{}'.format(package_name))
+        if s3_upload:
+            # in dedup mode, artifacts are looked up across all uploads of this package, eg
+            # 's3://infinity-artifacts/autodelete7d/kafka/sha256-manifest.json':
+            self._uploader = s3_upload.S3Uploader(
+                self._aws_region,
+                self._dry_run,
+                '{}/sha256-manifest.json'.format(self._s3_directory.rsplit('/', 1)[0]))
+        else:
+            self._uploader = None
+            logger.info('boto3 not found, uploading via the aws CLI')
+            # check if aws cli tools are installed
+            cmd = "aws --version"
+            ret = os.system(cmd)
+            if not ret == 0:
+                err = 'Required AWS cli tools not installed.'
+                self._github_updater.update('error', err)
+                raise Exception(err)
 
-        if not os.path.isdir(input_dir_path):
-            err = 'Provided package path is not a directory: {}'.format(input_dir_path)
-            self._github_updater.update('error', err)
-            raise Exception(err)
 
-        # check if aws cli tools are installed
-        cmd = "aws --version"
-        ret = os.system(cmd)
-        if not ret == 0:
-            err = 'Required AWS cli tools not installed.'
+    def _upload_artifacts(self, filepaths):
+        if not self._uploader:
+            for filepath in filepaths:
+                self._upload_artifact(filepath)
+            return
+        try:
+            self._uploader.upload_all([
+                (filepath, '{}/{}'.format(self._s3_directory, os.path.basename(filepath))) for filepath in filepaths])
+        except Exception as e:
+            err = 'Failed to upload artifacts to S3: {}'.format(e)
             self._github_updater.update('error', err)
-            raise Exception(err)
-
-        self._artifact_paths = []
-        for artifact_path in artifact_paths:
-            if not os.path.isfile(artifact_path):
-                err = 'Provided package path is not a file: {} (full list: {})'.format(artifact_path, artifact_paths)
-                raise Exception(err)
-            if artifact_path in self._artifact_paths:
-                err = 'Duplicate filename between "{}" and "{}". Artifact filenames must be unique.'.format(prior_path, artifact_path)
-                self._github_updater.update('error', err)
-                raise Exception(err)
-            self._artifact_paths.append(artifact_path)
+            raise
 
 
     def _upload_artifact(self, filepath):
         filename = os.path.basename(filepath)
+        if self._uploader:
+            self._upload_artifacts([filepath])
+            return '{}/{}'.format(self._http_directory, filename)
         if self._aws_region:
             cmd = 'aws s3 --region={} cp --acl public-read {} {}/{} 1>&2'.format(
                 self._aws_region, filepath, self._s3_directory, filename)
@@ -139,7 +176,7 @@ class AWSPublisher(object):
 
 
     def upload(self):
-        '''generates a unique directory, then uploads artifacts and a new stub universe to that directory'''
+        '''uploads artifacts and a new stub universe to the build's directory'''
         try:
             universe_path = universe_builder.UniversePackageBuilder(
                 self._pkg_name, self._pkg_version,
@@ -154,8 +191,9 @@ class AWSPublisher(object):
         logger.info('---')
         logger.info('Uploading {} artifacts:'.format(len(self._artifact_paths)))
 
-        for path in self._artifact_paths:
-            self._upload_artifact(path)
+        self._upload_artifacts(self._artifact_paths)
+        if self._uploader:
+            self._uploader.log_throughput()
 
         self._spam_universe_url(universe_url)
 
@@ -174,6 +212,34 @@ class AWSPublisher(object):
         return universe_url
 
 
+def _get_build_dir_name(package_name, package_version, input_dir_path, artifact_paths):
+    '''Returns a directory name which only changes if the build's content does, eg '20160815-4c1f2e7a9b3d5f60'.
+    Used in dedup mode, where reruns of a build then upload to the same directory: unchanged files are skipped
+    and interrupted uploads resume. Runs which share the directory upload identical content to it. The date is included so that objects reused this way are never close to
+    expiring from the autodelete7d directory.'''
+    hasher = hashlib.sha256()
+    def add(value):
+        if not isinstance(value, bytes):
+            value = value.encode('utf-8')
+        # length prefix to avoid ambiguity between eg ('ab', 'c') and ('a', 'bc'):
+        hasher.update('{}:'.format(len(value)).encode('utf-8'))
+        hasher.update(value)
+    add(package_name)
+    add(package_version)
+    for env_key in sorted(os.environ.keys()):
+        if env_key.startswith('TEMPLATE_'):
+            add('{}={}'.format(env_key, os.environ[env_key]))
+    for pkgfile in sorted(os.listdir(input_dir_path)):
+        add(pkgfile)
+        with open(os.path.join(input_dir_path, pkgfile), 'rb') as pkgfd:
+            add(pkgfd.read())
+    artifact_shas = universe_builder.get_sha256_cache().get_all(artifact_paths)
+    for artifact_path in sorted(artifact_paths, key=os.path.basename):
+        add(os.path.basename(artifact_path))
+        add(artifact_shas[artifact_path])
+    return '{}-{}'.format(time.strftime('%Y%m%d'), hasher.hexdigest()[:16])
+
+
 def print_help(argv):
     logger.info('Syntax: {} <package-name> <template-package-dir> [artifact files ...]'.format(argv[0]))
     logger.info('  Example: $ {} kafka /path/to/universe/jsons/ /path/to/artifact1.zip /path/to/artifact2.zip /path/to/artifact3.zip'.format(argv[0]))
@@ -7,7 +7,12 @@
 #   HTTP_DIR (default: /tmp/dcos-http-<pkgname>/)
 #   HTTP_HOST (default: 172.17.0.1, which is the ip of the VM when running dcos-docker)
 #   HTTP_PORT (default: 0, for an ephemeral port)
+#   HTTP_STORE_DIR (default: /tmp/dcos-http-store/)
+#     Content-addressed store of artifacts, which are hardlinked from their source (or copied) and into HTTP_DIR
+#   HTTP_STORE_MAX_AGE_DAYS (default: 7)
+#     Unused artifacts older than this are removed from HTTP_STORE_DIR
 
+import errno
 import json
 import logging
 import os
@@ -16,6 +21,14 @@ import shutil
 import socket
 import subprocess
 import sys
+import tempfile
+import time
+
+try:
+    import fcntl
+except ImportError:
+    # not available on windows
+    fcntl = None
 
 import github_update
 import universe_builder
@@ -23,6 +36,42 @@ import universe_builder
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.DEBUG, format="%(message)s")
 
+# linux ioctl for creating a copy-on-write clone of a file, on filesystems which support it (eg btrfs, xfs)
+FICLONE = 0x40049409
+
+# suffix of the file which records when the store entry of the same name was last published
+STORE_LAST_USED_SUFFIX = '.last-used'
+
+
+def _reflink_or_copy(srcpath, destpath):
+    '''Clones srcpath to destpath without copying its content where possible, or copies it otherwise.
+    Returns whether the clone succeeded.'''
+    with open(srcpath, 'rb') as src, open(destpath, 'wb') as dest:
+        if fcntl:
+            try:
+                fcntl.ioctl(dest.fileno(), FICLONE, src.fileno())
+                return True
+            except (IOError, OSError):
+                pass
+        shutil.copyfileobj(src, dest, 1024 * 1024)
+        return False
+
+
+def _link_or_copy(srcpath, destpath):
+    '''Hardlinks srcpath to destpath, or copies it if they're on different filesystems.
+    Any existing file at destpath is replaced atomically. Returns whether the hardlink succeeded.'''
+    tmppath = '{}.{}.tmp'.format(destpath, os.getpid())
+    try:
+        os.link(srcpath, tmppath)
+        linked = True
+    except OSError as e:
+        if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK):
+            raise
+        shutil.copyfile(srcpath, tmppath)
+        linked = False
+    os.rename(tmppath, destpath)
+    return linked
+
 
 class HTTPPublisher(object):
 
@@ -39,6 +88,9 @@ class HTTPPublisher(object):
         self._http_dir = os.environ.get('HTTP_DIR', '/tmp/dcos-http-{}/'.format(self._pkg_name))
         self._http_host = os.environ.get('HTTP_HOST', '172.17.0.1')
         self._http_port = int(os.environ.get('HTTP_PORT', '0'))
+        self._store_dir = os.environ.get('HTTP_STORE_DIR', '/tmp/dcos-http-store/')
+        self._store_max_age_seconds = float(os.environ.get('HTTP_STORE_MAX_AGE_DAYS', '7')) * 24 * 60 * 60
+        self._sha256_cache = universe_builder.get_sha256_cache()
 
         self._github_updater = github_update.GithubStatusUpdater('upload:{}'.format(package_name))
 
@@ -59,11 +111,70 @@ class HTTPPublisher(object):
             self._artifact_paths.append(artifact_path)
 
 
+    def _add_to_store(self, filepath):
+        '''Returns the path to the artifact's content in the store, adding it if it isn't there already'''
+        sha256 = self._sha256_cache.get(filepath)
+        storepath = os.path.join(self._store_dir, sha256)
+        # a hardlinked entry changes along with its source if a build rewrites the source in place:
+        if os.path.isfile(storepath) and self._sha256_cache.get(storepath) == sha256:
+            self._touch_store_entry(storepath)
+            return storepath
+        if not os.path.isdir(self._store_dir):
+            os.makedirs(self._store_dir)
+        tmppath = '{}.{}.tmp'.format(storepath, os.getpid())
+        try:
+            # no copy at all if the store is on the same filesystem as the source. the entry's permissions
+            # are left as-is, as they're shared with the source:
+            os.link(filepath, tmppath)
+            logger.info('Linked {} into store'.format(filepath))
+        except OSError as e:
+            if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK):
+                raise
+            if not _reflink_or_copy(filepath, tmppath):
+                logger.info('Copied {} into store (reflink not supported)'.format(filepath))
+            os.chmod(tmppath, 0o444)
+        os.rename(tmppath, storepath)
+        self._touch_store_entry(storepath)
+        return storepath
+
+
+    def _touch_store_entry(self, storepath):
+        '''Records the entry's last use, which _prune_store() checks. This is kept in a separate file: the
+        entry itself may share its inode (and therefore its mtime) with the source artifact, whose mtime
+        is part of its sha256 cache key.'''
+        with open(storepath + STORE_LAST_USED_SUFFIX, 'a'):
+            pass
+        os.utime(storepath + STORE_LAST_USED_SUFFIX, None)
+
+
+    def _prune_store(self):
+        '''Removes store entries which aren't hardlinked into any http dir (or from their source) and haven't
+        been used recently'''
+        now = time.time()
+        for filename in os.listdir(self._store_dir):
+            path = os.path.join(self._store_dir, filename)
+            if filename.endswith(STORE_LAST_USED_SUFFIX) or filename.endswith('.tmp'):
+                continue
+            last_used_path = path + STORE_LAST_USED_SUFFIX
+            last_used = os.path.getmtime(last_used_path if os.path.isfile(last_used_path) else path)
+            if os.stat(path).st_nlink == 1 and now - last_used > self._store_max_age_seconds:
+                logger.info('Removing unused artifact from store: {}'.format(path))
+                os.remove(path)
+                if os.path.isfile(last_used_path):
+                    os.remove(last_used_path)
+
+
     def _copy_artifact(self, http_url_root, filepath):
         filename = os.path.basename(filepath)
         destpath = os.path.join(self._http_dir, filename)
-        logger.info('- {}'.format(destpath))
-        shutil.copyfile(filepath, destpath)
+        storepath = self._add_to_store(filepath)
+        if os.path.isfile(destpath) and (os.path.samefile(storepath, destpath)
+                                         or self._sha256_cache.get(destpath) == self._sha256_cache.get(filepath)):
+            logger.info('- {} (unchanged)'.format(destpath))
+        elif _link_or_copy(storepath, destpath):
+            logger.info('- {} (linked)'.format(destpath))
+        else:
+            logger.info('- {} (copied, store is on another filesystem)'.format(destpath))
         return '{}/{}'.format(http_url_root, filename)
 
 
@@ -105,13 +216,19 @@ class HTTPPublisher(object):
             self._github_updater.update('error', err)
             raise
 
-        # wipe files in dir
+        # wipe any files in dir which aren't being republished. files which are being republished are
+        # replaced in _copy_artifact(), or kept as-is if they're unchanged.
         if not os.path.isdir(self._http_dir):
             os.makedirs(self._http_dir)
+        published_filenames = set([os.path.basename(path) for path in [universe_path] + self._artifact_paths])
         for filename in os.listdir(self._http_dir):
+            if filename in published_filenames:
+                continue
             path = os.path.join(self._http_dir, filename)
             logger.info('Deleting preexisting file in artifact dir: {}'.format(path))
             os.remove(path)
+        # hash any uncached artifacts in parallel up front:
+        self._sha256_cache.get_all([universe_path] + self._artifact_paths)
 
         # print universe url early
         universe_url = self._copy_artifact(http_url_root, universe_path)
@@ -123,6 +240,7 @@ class HTTPPublisher(object):
 
         for path in self._artifact_paths:
             self._copy_artifact(http_url_root, path)
+        self._prune_store()
 
         self._spam_universe_url(universe_url)
 
@@ -149,29 +267,32 @@ class HTTPPublisher(object):
         else:
             port = self._http_port
 
-        # hack: write httpd script then run it directly
-        httpd_py_content = '''#!/usr/bin/python
-import os, SimpleHTTPServer, SocketServer
-rootdir = '{}'
-host = '{}'
-port = {}
-os.chdir(rootdir)
-httpd = SocketServer.TCPServer((host, port), SimpleHTTPServer.SimpleHTTPRequestHandler)
-print('Serving %s at http://%s:%s' % (rootdir, host, port))
-httpd.serve_forever()
-'''.format(self._http_dir, self._http_host, port)
-        httpd_py_path = os.path.join(self._http_dir, procname)
+        # hack: write a uniquely named httpd script (for killall above) then run it directly.
+        # the script runs the concurrent server in artifact_httpd.py. it's written outside of the http dir,
+        # whose content is replaced by build().
+        httpd_py_content = '''#!{}
+import sys
+sys.path.insert(0, '{}')
+import artifact_httpd
+artifact_httpd.serve('{}', '{}', {})
+'''.format(sys.executable, os.path.dirname(os.path.abspath(__file__)), self._http_dir, self._http_host, port)
+        httpd_py_path = os.path.join(tempfile.gettempdir(), procname)
 
         if not os.path.isdir(self._http_dir):
             os.makedirs(self._http_dir)
-        httpd_py_file = file(httpd_py_path, 'w+')
+        httpd_py_file = open(httpd_py_path, 'w+')
         httpd_py_file.write(httpd_py_content)
         httpd_py_file.flush()
         httpd_py_file.close()
 
-        os.chmod(httpd_py_path, 0744)
-        logger.info('Launching HTTPD: {}'.format(httpd_py_path))
-        subprocess.Popen([httpd_py_path, "2&1>", "/dev/null"])
+        os.chmod(httpd_py_path, 0o744)
+        # the server's request/throughput logging goes to a file: if it inherited our stdout, callers
+        # reading our stdout (eg the universe url) would never see it close.
+        httpd_log_path = os.path.join(tempfile.gettempdir(), 'publish_httpd_{}.log'.format(self._pkg_name))
+        logger.info('Launching HTTPD: {} (log: {})'.format(httpd_py_path, httpd_log_path))
+        httpd_log_file = open(httpd_log_path, 'a')
+        subprocess.Popen([httpd_py_path], stdout=httpd_log_file, stderr=subprocess.STDOUT)
+        httpd_log_file.close()
 
         return 'http://{}:{}'.format(self._http_host, port)
 
@@ -1,9 +1,12 @@
 #!/usr/bin/python
 
 import base64
+import contextlib
 import difflib
+import hashlib
 import json
 import logging
+import multiprocessing.pool
 import os
 import os.path
 import pprint
@@ -11,21 +14,37 @@ import re
 import shutil
 import sys
 import tempfile
+import time
 import zipfile
 
 try:
+    from http.client import HTTPException
     from http.client import HTTPSConnection
+    from urllib.error import HTTPError
+    from urllib.request import Request
     from urllib.request import URLopener
     from urllib.request import urlopen
 except ImportError:
     # Python 2
+    from httplib import HTTPException
     from httplib import HTTPSConnection
     from urllib import URLopener
+    from urllib2 import HTTPError
+    from urllib2 import Request
     from urllib2 import urlopen
 
+try:
+    import s3_upload
+except ImportError:
+    # boto3 isn't installed: fall back to the aws CLI
+    s3_upload = None
+
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.DEBUG, format="%(message)s")
 
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+MAX_DOWNLOAD_ATTEMPTS = 5
+
 
 class UniverseReleaseBuilder(object):
 
@@ -76,32 +95,77 @@ class UniverseReleaseBuilder(object):
                 raise Exception("{} return non-zero exit status: {}".format(cmd, ret))
             return ret
 
+    def _download_stub_universe(self, local_zip_path):
+        '''Downloads the stub universe to the provided path, hashing it as it's written. If the connection
+        drops, the download is resumed via a Range request. Returns the sha256 of the download.'''
+        hasher = hashlib.sha256()
+        offset = 0
+        attempt = 1
+        with open(local_zip_path, 'wb') as dlfile:
+            while True:
+                request = Request(self._stub_universe_url)
+                if offset:
+                    request.add_header('Range', 'bytes={}-'.format(offset))
+                try:
+                    with contextlib.closing(urlopen(request)) as response:
+                        if offset and response.getcode() != 206:
+                            logger.info('Server doesn\'t support resuming downloads, restarting download')
+                            hasher = hashlib.sha256()
+                            offset = 0
+                            dlfile.seek(0)
+                            dlfile.truncate()
+                        content_length = response.info().get('Content-Length')
+                        expected_size = offset + int(content_length) if content_length else None
+                        while True:
+                            chunk = response.read(DOWNLOAD_CHUNK_SIZE)
+                            if not chunk:
+                                break
+                            dlfile.write(chunk)
+                            hasher.update(chunk)
+                            offset += len(chunk)
+                        if expected_size and offset < expected_size:
+                            raise IOError('Connection closed after {} of {} bytes'.format(offset, expected_size))
+                        return hasher.hexdigest()
+                except HTTPError:
+                    # eg 404: retrying won't help
+                    raise
+                except (IOError, HTTPException) as e:
+                    if attempt >= MAX_DOWNLOAD_ATTEMPTS:
+                        raise
+                    logger.info('Download of {} interrupted at {} bytes (attempt {}/{}), resuming: {}'.format(
+                        self._stub_universe_url, offset, attempt, MAX_DOWNLOAD_ATTEMPTS, e))
+                    time.sleep(attempt)
+                    attempt += 1
+
+
     def _download_unpack_stub_universe(self, scratchdir):
         '''Returns the path to the directory in the stub universe.'''
         local_zip_path = os.path.join(scratchdir, self._stub_universe_url.split('/')[-1])
-        result = urlopen(self._stub_universe_url)
-        dlfile = open(local_zip_path, 'wb')
-        dlfile.write(result.read())
-        dlfile.flush()
-        dlfile.close()
-        zipin = zipfile.ZipFile(local_zip_path, 'r')
-        badfile = zipin.testzip()
-        if badfile:
-            raise Exception('Bad file {} in downloaded {} => {}'.format(
-                badfile, self._stub_universe_url, local_zip_path))
-        zipin.extractall(scratchdir)
-        # check for stub-universe-pkgname/repo/packages/P/pkgname/0/:
-        pkgdir_path = os.path.join(
-            scratchdir,
+        sha256 = self._download_stub_universe(local_zip_path)
+        logger.info('Downloaded {} (sha256: {})'.format(self._stub_universe_url, sha256))
+        expected_sha256 = os.environ.get('STUB_UNIVERSE_SHA256', '')
+        if expected_sha256 and sha256 != expected_sha256:
+            raise Exception('Downloaded {} has sha256 {}, expected {}'.format(
+                self._stub_universe_url, sha256, expected_sha256))
+        # only extract stub-universe-pkgname/repo/packages/P/pkgname/0/, the rest is generated for the release.
+        # extraction checks the CRC of each file as it's read, so testzip() isn't needed.
+        pkgdir_zip_path = '/'.join([
             'stub-universe-{}'.format(self._pkg_name),
             'repo',
             'packages',
             self._pkg_name[0].upper(),
             self._pkg_name,
-            '0')
-        if not os.path.isdir(pkgdir_path):
-            raise Exception('Didn\'t find expected path {} after unzipping {}'.format(
-                pkgdir_path, local_zip_path))
+            '0']) + '/'
+        pkgdir_path = os.path.join(scratchdir, *pkgdir_zip_path.rstrip('/').split('/'))
+        with zipfile.ZipFile(local_zip_path, 'r') as zipin:
+            pkgfiles = [name for name in zipin.namelist()
+                        if name.startswith(pkgdir_zip_path) and not name.endswith('/')]
+            if not pkgfiles:
+                raise Exception('Didn\'t find expected path {} in {}'.format(
+                    pkgdir_zip_path, local_zip_path))
+            for name in pkgfiles:
+                # extract() sanitizes paths, eg any '..' elements
+                zipin.extract(name, scratchdir)
         os.unlink(local_zip_path)
         return pkgdir_path
 
@@ -164,7 +228,91 @@ class UniverseReleaseBuilder(object):
         return original_artifact_urls
 
 
-    def _copy_artifacts_s3(self, scratchdir, original_artifact_urls):
+    def _get_artifact_sha256s(self, pkgdir):
+        '''Returns a {filename: sha256} mapping of artifacts which have a contentHash in resource.json'''
+        artifact_sha256s = {}
+        def visit(node):
+            if isinstance(node, dict):
+                for content_hash in node.get('contentHash', []):
+                    if 'url' in node and content_hash.get('algo') == 'sha256':
+                        artifact_sha256s[node['url'].split('/')[-1]] = content_hash['value']
+                for value in node.values():
+                    visit(value)
+            elif isinstance(node, list):
+                for value in node:
+                    visit(value)
+        with open(os.path.join(pkgdir, 'resource.json'), 'r') as resource_file:
+            visit(json.load(resource_file))
+        return artifact_sha256s
+
+
+    def _get_source_s3_url(self, http_url):
+        '''Returns the s3:// equivalent of an artifact's http(s) url, or None if it isn't an S3 url'''
+        endpoint_url = os.environ.get('S3_ENDPOINT_URL', '').rstrip('/')
+        if endpoint_url and http_url.startswith(endpoint_url + '/'):
+            # eg a local S3 stand-in: path-style http://host:port/bucket/key
+            return 's3://{}'.format(http_url[len(endpoint_url) + 1:])
+        # virtual host style: https://bucket.s3.amazonaws.com/key, https://bucket.s3-us-west-2.amazonaws.com/key
+        match = re.match(r'^https?://(.+)\.s3[.-][^/]*amazonaws\.com/(.+)$', http_url)
+        if match:
+            return 's3://{}/{}'.format(match.group(1), match.group(2))
+        # path style: https://s3.amazonaws.com/bucket/key, https://s3-us-west-2.amazonaws.com/bucket/key
+        match = re.match(r'^https?://s3[.-][^/]*amazonaws\.com/(.+)$', http_url)
+        if match:
+            return 's3://{}'.format(match.group(1))
+        return None
+
+
+    def _copy_artifacts_s3(self, scratchdir, pkgdir, original_artifact_urls):
+        if not s3_upload:
+            logger.info('boto3 not found, copying artifacts via the aws CLI')
+            return self._copy_artifacts_s3_cli(scratchdir, original_artifact_urls)
+        uploader = s3_upload.S3Uploader(dry_run=self._dry_run)
+        # before we do anything else, verify that the upload directory doesn't already exist, to
+        # avoid automatically stomping on a previous release. if you *want* to do this, you must
+        # manually delete the destination directory first.
+        if not self._dry_run and uploader.exists(self._release_artifact_s3_dir):
+            raise Exception('Release artifact destination already exists. ' +
+                            'Refusing to continue until destination has been manually removed:\n' +
+                            'Do this: aws s3 rm --dryrun --recursive {}'.format(self._release_artifact_s3_dir))
+        logger.info('Destination {} doesnt exist, proceeding...'.format(self._release_artifact_s3_dir))
+
+        artifact_sha256s = self._get_artifact_sha256s(pkgdir)
+        def copy_artifact(src_url):
+            filename = src_url.split('/')[-1]
+            dest_s3_url = '{}/{}'.format(self._release_artifact_s3_dir, filename)
+            expected_sha256 = artifact_sha256s.get(filename)
+            src_s3_url = self._get_source_s3_url(src_url)
+            if src_s3_url:
+                try:
+                    uploader.copy(src_s3_url, dest_s3_url, expected_sha256)
+                    return
+                except Exception as e:
+                    # eg no read access to the dev bucket with the release credentials:
+                    logger.info('Unable to copy {} server-side, streaming it instead: {}'.format(src_s3_url, e))
+            if self._dry_run:
+                logger.info('[DRY RUN] Streaming {} to {}'.format(src_url, dest_s3_url))
+                return
+            # stream the artifact from the http url referenced in package into the release location,
+            # verifying the sha256 in transit:
+            logger.info('Streaming {} to {}'.format(src_url, dest_s3_url))
+            with contextlib.closing(urlopen(src_url)) as response:
+                uploader.upload_stream(response, dest_s3_url, expected_sha256)
+
+        pool = multiprocessing.pool.ThreadPool(max(1, min(len(original_artifact_urls), 4)))
+        try:
+            pool.map(copy_artifact, original_artifact_urls)
+        except Exception as e:
+            raise Exception(
+                'Failed to copy artifacts to {}: {}. '.format(self._release_artifact_s3_dir, e) +
+                'Partial release directory may need to be cleared manually before retrying. Exiting early.')
+        finally:
+            pool.close()
+            pool.join()
+        uploader.log_throughput()
+
+
+    def _copy_artifacts_s3_cli(self, scratchdir, original_artifact_urls):
         # before we do anything else, verify that the upload directory doesn't already exist, to
         # avoid automatically stomping on a previous release. if you *want* to do this, you must
         # manually delete the destination directory first. (and redirect stdout to stderr)
@@ -381,7 +529,7 @@ class UniverseReleaseBuilder(object):
         scratchdir = tempfile.mkdtemp(prefix='stub-universe-tmp')
         pkgdir = self._download_unpack_stub_universe(scratchdir)
         original_artifact_urls = self._update_package_get_artifact_source_urls(pkgdir)
-        self._copy_artifacts_s3(scratchdir, original_artifact_urls)
+        self._copy_artifacts_s3(scratchdir, pkgdir, original_artifact_urls)
         orig_docker_image = self._original_docker_image(pkgdir)
         if orig_docker_image and self._release_docker_image:
             self._copy_docker_image(pkgdir, orig_docker_image)
@@ -397,7 +545,7 @@ def print_help(argv):
     logger.info('- Github (Personal Access Token): GITHUB_TOKEN')
     logger.info('Required CLI programs:')
     logger.info('- git')
-    logger.info('- aws')
+    logger.info('- aws (if boto3 isn\'t installed)')
 
 
 def main(argv):
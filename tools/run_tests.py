@@ -1,5 +1,9 @@
 #!/usr/bin/python
 
+import contextlib
+import glob
+import hashlib
+import heapq
 import json
 import logging
 import os
@@ -11,6 +15,10 @@ import string
 import subprocess
 import sys
 import tempfile
+import threading
+import time
+import xml.etree.ElementTree as ElementTree
+from multiprocessing.pool import ThreadPool
 
 import dcos_login
 import github_update
@@ -21,9 +29,25 @@ except ImportError:
     # Python 2
     from urllib import URLopener
 
+try:
+    import fcntl
+except ImportError:
+    # not available on windows
+    fcntl = None
+
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.DEBUG, format="%(message)s")
 
+# Duration assumed for test modules which don't appear in any past report, if no other modules do either
+DEFAULT_MODULE_DURATION_SECONDS = 60
+# Attributes of a junit <testsuite> which are summed when merging reports
+JUNIT_COUNT_ATTRIBUTES = ['tests', 'errors', 'failures', 'skips', 'skipped']
+
+# Bump when changing how cached virtualenvs are built, so that older ones are no longer reused
+VIRTUALENV_FORMAT_VERSION = 1
+# Created in a cached virtualenv once all requirements were installed successfully
+VIRTUALENV_COMPLETE_MARKER = '.complete'
+
 
 class CITester(object):
 
@@ -31,6 +55,15 @@ class CITester(object):
         self._CLI_URL_TEMPLATE = 'https://downloads.dcos.io/binaries/cli/{}/x86-64/latest/{}'
         self._dcos_url = dcos_url
         self._sandbox_path = ''
+        # resolved up-front: setup_cli() points HOME at the sandbox
+        self._venv_cache_dir = os.environ.get(
+            'VENV_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.dcos-commons', 'venvs'))
+        self._venv_max_age_days = float(os.environ.get('VENV_CACHE_MAX_AGE_DAYS', '7'))
+        self._wheelhouse_dir = os.environ.get('VENV_WHEELHOUSE_DIR', '')
+        self._pip_cache_dir = os.environ.get(
+            'PIP_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'pip'))
+        # os.environ as configured for this cluster's CLI, once setup_cli() has completed:
+        self._env = {}
         self._github_updater = github_update.GithubStatusUpdater('test:{}'.format(github_label))
 
 
@@ -106,20 +139,28 @@ class CITester(object):
                 for name, url in stub_universes.items():
                     logger.info('Adding repository: {} {}'.format(name, url))
                     subprocess.check_call('dcos package repo add --index=0 {} {}'.format(name, url).split())
+            self._env = os.environ.copy()
         except:
             self._github_updater.update('error', 'CLI Setup failed')
             raise
 
 
-    def run_shakedown(self, test_dirs, requirements_txt='', pytest_types='sanity'):
-        # keep virtualenv in a consistent/reusable location:
+    def run_shakedown(self, test_dirs, requirements_txt='', pytest_types='sanity', shards=1, shard_testers=[]):
+        '''Runs the tests in test_dirs. With shards > 1, the test modules are split across that many
+        concurrent runs, each against its own cluster: this one, or one of the shard_testers' clusters.'''
+        if shards > 1 + len(shard_testers):
+            # tests use fixed service names, so shards sharing a cluster would clobber each other's services:
+            logger.info('Reducing TEST_SHARDS from {} to the number of clusters: {}'.format(
+                shards, 1 + len(shard_testers)))
+            shards = 1 + len(shard_testers)
+        # keep virtualenv in a consistent/reusable location, if it isn't cached:
         if 'WORKSPACE' in os.environ:
-            virtualenv_path = os.path.join(os.environ['WORKSPACE'], 'shakedown_env')
+            uncached_virtualenv_path = os.path.join(os.environ['WORKSPACE'], 'shakedown_env')
             # produce test report for consumption by Jenkins:
-            jenkins_args = '--junitxml=shakedown-report.xml '
+            report_path = 'shakedown-report.xml'
         else:
-            virtualenv_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'shakedown_env')
-            jenkins_args = ''
+            uncached_virtualenv_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'shakedown_env')
+            report_path = ''
         if requirements_txt:
             logger.info('Using provided requirements.txt: {}'.format(requirements_txt))
         else:
@@ -134,47 +175,155 @@ requests==2.10.0
 ''')
             requirements_file.flush()
             requirements_file.close()
+        try:
+            self._github_updater.update('pending', 'Running shakedown tests')
+            # the virtualenv is set up once, then shared by all shards:
+            virtualenv_path = self._setup_virtualenv(requirements_txt, uncached_virtualenv_path)
+            if shards > 1:
+                self._run_shakedown_shards(
+                    test_dirs, pytest_types, shards, [self] + shard_testers, virtualenv_path, report_path)
+            else:
+                script_path = self._write_shakedown_run_script(
+                    'run_shakedown.sh', virtualenv_path, test_dirs, pytest_types, report_path)
+                subprocess.check_call(['bash', script_path])
+            self._github_updater.update('success', 'Shakedown tests succeeded')
+        except:
+            self._github_updater.update('failure', 'Shakedown tests failed')
+            raise
+
+
+    def _setup_virtualenv(self, requirements_txt, uncached_path):
+        '''Returns the path to a virtualenv with the requirements installed.
+
+        Virtualenvs are cached in VENV_CACHE_DIR, keyed by a hash of the requirements and the python version,
+        and are reused as-is by later runs. They're used in place rather than being copied out of the cache,
+        as virtualenvs can't be relocated. Cached virtualenvs are rebuilt every VENV_CACHE_MAX_AGE_DAYS, to
+        pick up any changes to unpinned requirements (eg shakedown@master). If VENV_CACHE_DIR is empty, the
+        virtualenv is created or updated at uncached_path.'''
+        if not self._venv_cache_dir:
+            self._build_virtualenv(uncached_path, requirements_txt)
+            return uncached_path
+        if not os.path.isdir(self._venv_cache_dir):
+            os.makedirs(self._venv_cache_dir)
+        key = _get_virtualenv_key(requirements_txt)
+        # the age bucket is part of the path: a rebuild never touches a virtualenv which may be in use
+        bucket = int(time.time() / (self._venv_max_age_days * 24 * 60 * 60)) if self._venv_max_age_days > 0 else 0
+        virtualenv_path = os.path.join(self._venv_cache_dir, '{}-{}'.format(key, bucket))
+        marker_path = os.path.join(virtualenv_path, VIRTUALENV_COMPLETE_MARKER)
+        if not os.path.isfile(marker_path):
+            # other jobs on this machine may be building the same virtualenv:
+            with _file_lock(virtualenv_path + '.lock'):
+                if not os.path.isfile(marker_path):
+                    if os.path.exists(virtualenv_path):
+                        logger.info('Removing incomplete virtualenv: {}'.format(virtualenv_path))
+                        shutil.rmtree(virtualenv_path)
+                    self._build_virtualenv(virtualenv_path, requirements_txt)
+                    open(marker_path, 'w').close()
+        else:
+            logger.info('Using cached virtualenv for {}: {}'.format(requirements_txt, virtualenv_path))
+        _prune_virtualenvs(self._venv_cache_dir, key, bucket)
+        return virtualenv_path
+
+
+    def _build_virtualenv(self, venv_path, requirements_txt):
+        if self._wheelhouse_dir:
+            # install from the wheelhouse alone if possible. otherwise, add any missing wheels then retry:
+            install_cmd = '''pip install --no-index --find-links={wheelhouse} -r {reqs_file} || (
+    echo "WHEELHOUSE UPDATE: {wheelhouse}"
+    pip wheel --find-links={wheelhouse} --wheel-dir={wheelhouse} -r {reqs_file}
+    pip install --no-index --find-links={wheelhouse} -r {reqs_file})'''.format(
+                wheelhouse=self._wheelhouse_dir, reqs_file=requirements_txt)
+        else:
+            install_cmd = 'pip install -r {}'.format(requirements_txt)
         # to ensure the 'source' call works, just create a shell script and execute it directly:
-        script_path = os.path.join(self._sandbox_path, 'run_shakedown.sh')
+        script_path = os.path.join(self._sandbox_path, 'setup_virtualenv.sh')
         script_file = open(script_path, 'w')
         # TODO(nick): remove this inlined script with external templating
         #             (or find a way of entering the virtualenv that doesn't involve a shell script)
         script_file.write('''
 #!/bin/bash
 set -e
+# HOME is the CLI sandbox: keep using the original pip cache rather than starting an empty one
+export PIP_CACHE_DIR={pip_cache_dir}
 echo "VIRTUALENV CREATE/UPDATE: {venv_path}"
 virtualenv -p $(which python3) --always-copy {venv_path}
 echo "VIRTUALENV ACTIVATE: {venv_path}"
 source {venv_path}/bin/activate
 echo "REQUIREMENTS INSTALL: {reqs_file}"
-pip install -r {reqs_file}
+{install_cmd}
+'''.format(pip_cache_dir=self._pip_cache_dir,
+           venv_path=venv_path,
+           reqs_file=requirements_txt,
+           install_cmd=install_cmd))
+        script_file.flush()
+        script_file.close()
+        subprocess.check_call(['bash', script_path])
+
+
+    def _write_shakedown_run_script(self, script_name, venv_path, test_dirs, pytest_types, report_path):
+        script_path = os.path.join(self._sandbox_path, script_name)
+        script_file = open(script_path, 'w')
+        script_file.write('''
+#!/bin/bash
+set -e
+echo "VIRTUALENV ACTIVATE: {venv_path}"
+source {venv_path}/bin/activate
 echo "SHAKEDOWN RUN: {test_dirs} FILTER: {pytest_types}"
 py.test {jenkins_args}-vv --fulltrace -x -s -m "{pytest_types}" {test_dirs}
-'''.format(venv_path=virtualenv_path,
-           reqs_file=requirements_txt,
-           dcos_url=self._dcos_url,
-           jenkins_args=jenkins_args,
+'''.format(venv_path=venv_path,
+           jenkins_args='--junitxml={} '.format(report_path) if report_path else '',
            pytest_types=pytest_types,
            test_dirs=test_dirs))
         script_file.flush()
         script_file.close()
+        return script_path
+
+
+    def _run_shakedown_shards(self, test_dirs, pytest_types, shard_count, testers, venv_path, report_path):
+        modules = _find_test_modules(test_dirs.split())
+        durations = _get_module_durations(modules, _get_duration_report_paths(report_path))
+        shards = [shard for shard in _pack_shards(modules, durations, shard_count) if shard[1]]
+        if not shards:
+            raise Exception('No test modules found in: {}'.format(test_dirs))
+
+        def run_shard(shard_index):
+            estimate, shard_modules = shards[shard_index]
+            tester = testers[shard_index]
+            env = tester._env.copy()
+            env['TEST_SHARD_INDEX'] = str(shard_index)
+            env['TEST_SHARD_COUNT'] = str(len(shards))
+            shard_report_path = os.path.join(self._sandbox_path, 'shakedown-report-{}.xml'.format(shard_index))
+            script_path = self._write_shakedown_run_script(
+                'run_shakedown_{}.sh'.format(shard_index), venv_path, ' '.join(shard_modules), pytest_types,
+                shard_report_path)
+            logger.info('Shard {}: {} modules against {} (estimated {:.0f}s): {}'.format(
+                shard_index, len(shard_modules), tester._dcos_url, estimate, ' '.join(shard_modules)))
+            returncode = _run_prefixed('shard{}'.format(shard_index), ['bash', script_path], env)
+            logger.info('Shard {} exited with {}'.format(shard_index, returncode))
+            return (returncode, shard_report_path)
+
+        shard_runners = ThreadPool(len(shards))
         try:
-            self._github_updater.update('pending', 'Running shakedown tests')
-            subprocess.check_call(['bash', script_path])
-            self._github_updater.update('success', 'Shakedown tests succeeded')
-        except:
-            self._github_updater.update('failure', 'Shakedown tests failed')
-            raise
+            results = shard_runners.map(run_shard, range(len(shards)))
+        finally:
+            shard_runners.close()
+        if report_path:
+            _merge_junit_reports([path for _, path in results if os.path.isfile(path)], report_path)
+        failed = [str(i) for i, (returncode, _) in enumerate(results) if returncode != 0]
+        if failed:
+            raise Exception('Shakedown shard(s) failed: {}'.format(', '.join(failed)))
 
     def run_dcostests(self, test_dirs, dcos_tests_dir, pytest_types='sanity'):
         os.environ['DOCKER_CLI'] = 'false'
         if 'WORKSPACE' in os.environ:
-            virtualenv_path = os.path.join(os.environ['WORKSPACE'], 'dcostests_env')
+            uncached_virtualenv_path = os.path.join(os.environ['WORKSPACE'], 'dcostests_env')
             # produce test report for consumption by Jenkins:
             jenkins_args = '--junitxml=dcostests-report.xml '
         else:
-            virtualenv_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'dcostests_env')
+            uncached_virtualenv_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'dcostests_env')
             jenkins_args = ''
+        virtualenv_path = self._setup_virtualenv(
+            os.path.join(dcos_tests_dir, 'requirements.txt'), uncached_virtualenv_path)
         # to ensure the 'source' call works, just create a shell script and execute it directly:
         script_path = os.path.join(self._sandbox_path, 'run_dcos_tests.sh')
         script_file = open(script_path, 'w')
@@ -185,16 +334,11 @@ py.test {jenkins_args}-vv --fulltrace -x -s -m "{pytest_types}" {test_dirs}
 set -e
 cd {dcos_tests_dir}
 echo "{dcos_url}" > docker-context/dcos-url.txt
-echo "VIRTUALENV CREATE/UPDATE: {venv_path}"
-virtualenv -p $(which python3) --always-copy {venv_path}
 echo "VIRTUALENV ACTIVATE: {venv_path}"
 source {venv_path}/bin/activate
-echo "REQUIREMENTS INSTALL: {reqs_file}"
-pip install -r {reqs_file}
 echo "DCOS-TEST RUN $(pwd): {test_dirs} FILTER: {pytest_types}"
 SSH_KEY_FILE="" PYTHONPATH=$(pwd) py.test {jenkins_args}-vv -s -m "{pytest_types}" {test_dirs}
 '''.format(venv_path=virtualenv_path,
-           reqs_file=os.path.join(dcos_tests_dir, 'requirements.txt'),
            dcos_tests_dir=dcos_tests_dir,
            dcos_url=self._dcos_url,
            jenkins_args=jenkins_args,
@@ -223,10 +367,172 @@ def print_help(argv):
     logger.info('  Example (dcos-tests, deprecated): $ {} dcos-tests /path/to/your/tests/ /path/to/dcos-tests/'.format(argv[0]))
 
 
+def _get_virtualenv_key(requirements_txt):
+    python_version = subprocess.check_output(
+        ['python3', '-c', 'import sys; print(sys.version)']).decode('utf-8').strip()
+    requirements = open(requirements_txt, 'rb').read()
+    sha = hashlib.sha256()
+    for value in [str(VIRTUALENV_FORMAT_VERSION).encode('utf-8'), python_version.encode('utf-8'), requirements]:
+        # length-prefixed, so that values can't run together:
+        sha.update('{}:'.format(len(value)).encode('utf-8'))
+        sha.update(value)
+    return sha.hexdigest()[:16]
+
+
+def _prune_virtualenvs(cache_dir, key, bucket):
+    '''Removes this key's virtualenvs from before the previous age bucket. The previous bucket's virtualenv is
+    kept, as it may still be in use by a job which started before the current bucket.'''
+    for filename in os.listdir(cache_dir):
+        prefix, _, old_bucket = filename.partition('-')
+        if old_bucket.endswith('.lock'):
+            old_bucket = old_bucket[:-len('.lock')]
+        if prefix != key or not old_bucket.isdigit() or int(old_bucket) >= bucket - 1:
+            continue
+        path = os.path.join(cache_dir, filename)
+        logger.info('Removing expired virtualenv: {}'.format(path))
+        if os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+        else:
+            os.remove(path)
+
+
+@contextlib.contextmanager
+def _file_lock(lock_path):
+    with open(lock_path, 'w') as lock_file:
+        if fcntl:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        yield
+
+
+def _find_test_modules(test_paths):
+    '''Returns the test module files within the provided files or directories, following py.test's defaults'''
+    modules = []
+    for test_path in test_paths:
+        if os.path.isfile(test_path):
+            modules.append(test_path)
+            continue
+        for dirpath, dirnames, filenames in os.walk(test_path):
+            dirnames[:] = sorted([d for d in dirnames if not d.startswith('.') and d != '__pycache__'])
+            for filename in sorted(filenames):
+                if filename.endswith('.py') and (filename.startswith('test_') or filename.endswith('_test.py')):
+                    modules.append(os.path.join(dirpath, filename))
+    return modules
+
+
+def _get_duration_report_paths(report_path):
+    patterns = os.environ.get('TEST_DURATIONS_REPORTS', report_path)
+    paths = []
+    for pattern in patterns.split():
+        paths.extend(sorted(glob.glob(pattern)))
+    return paths
+
+
+def _get_module_durations(modules, report_paths):
+    '''Returns the duration of each test module, averaged across the past junit reports which include it'''
+    # eg 'frameworks/helloworld/tests/test_sanity.py' => 'frameworks.helloworld.tests.test_sanity', which
+    # would match a testcase classname of 'tests.test_sanity' or 'tests.test_sanity.TestClass'
+    dotted_modules = [(module, os.path.splitext(os.path.normpath(module))[0].replace(os.sep, '.'))
+                      for module in modules]
+    module_samples = {}
+    for report_path in report_paths:
+        try:
+            tree = ElementTree.parse(report_path)
+        except (IOError, ElementTree.ParseError) as e:
+            logger.info('Skipping unreadable test report {}: {}'.format(report_path, e))
+            continue
+        report_durations = {}
+        for testcase in tree.iter('testcase'):
+            module = _match_module(testcase.get('classname', ''), dotted_modules)
+            if module:
+                report_durations[module] = report_durations.get(module, 0) + float(testcase.get('time', 0))
+        for module, duration in report_durations.items():
+            module_samples.setdefault(module, []).append(duration)
+    durations = {module: sum(samples) / len(samples) for module, samples in module_samples.items()}
+    logger.info('Found past durations for {}/{} test modules in {} reports'.format(
+        len(durations), len(modules), len(report_paths)))
+    return durations
+
+
+def _match_module(classname, dotted_modules):
+    '''Returns the module which the junit classname refers to, or None if it doesn't refer to exactly one
+    module, eg 'tests.test_sanity' when several frameworks have a tests/test_sanity.py'''
+    parts = classname.split('.')
+    # try the longest prefix first: the classname may end with a class name
+    for end in range(len(parts), 0, -1):
+        prefix = '.'.join(parts[:end])
+        matches = [module for module, dotted in dotted_modules if dotted == prefix or dotted.endswith('.' + prefix)]
+        if matches:
+            # shorter prefixes would only be more ambiguous:
+            return matches[0] if len(matches) == 1 else None
+    return None
+
+
+def _pack_shards(modules, durations, shard_count):
+    '''Splits the modules into shard_count shards of similar total duration, using longest-processing-time
+    first: modules are assigned longest first, each to the shard with the least total duration so far.
+    Returns a list of (estimated seconds, [modules]) for each shard.'''
+    # modules without any history are assumed to take a typical amount of time:
+    known = sorted(durations.values())
+    default_duration = known[len(known) // 2] if known else DEFAULT_MODULE_DURATION_SECONDS
+    shards = [(0, i, []) for i in range(shard_count)]
+    for module in sorted(modules, key=lambda m: (-durations.get(m, default_duration), m)):
+        total, i, shard_modules = heapq.heappop(shards)
+        shard_modules.append(module)
+        heapq.heappush(shards, (total + durations.get(module, default_duration), i, shard_modules))
+    return [(total, shard_modules) for total, i, shard_modules in sorted(shards, key=lambda shard: shard[1])]
+
+
+def _merge_junit_reports(report_paths, output_path):
+    '''Combines the testcases of several junit reports into a single testsuite'''
+    merged = ElementTree.Element('testsuite', {'name': 'pytest'})
+    totals = {}
+    for report_path in report_paths:
+        root = ElementTree.parse(report_path).getroot()
+        # newer versions of py.test wrap the testsuite in a testsuites element:
+        for testsuite in ([root] if root.tag == 'testsuite' else root.findall('testsuite')):
+            for attr in JUNIT_COUNT_ATTRIBUTES:
+                if attr in testsuite.attrib:
+                    totals[attr] = totals.get(attr, 0) + int(testsuite.get(attr))
+            # shards ran concurrently: report the longest one rather than the sum
+            totals['time'] = max(totals.get('time', 0), float(testsuite.get('time', 0)))
+            for child in testsuite:
+                merged.append(child)
+    for attr, value in totals.items():
+        merged.set(attr, str(value))
+    ElementTree.ElementTree(merged).write(output_path, encoding='utf-8', xml_declaration=True)
+    logger.info('Merged {} test reports into {}'.format(len(report_paths), output_path))
+
+
+_output_lock = threading.Lock()
+
+
+def _run_prefixed(name, cmd, env):
+    '''Runs the command, writing its output to stdout with each line prefixed by name. Returns the exit code.'''
+    proc = subprocess.Popen(cmd, env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    for line in iter(proc.stdout.readline, b''):
+        with _output_lock:
+            sys.stdout.write('[{}] {}\n'.format(name, line.decode('utf-8', 'replace').rstrip()))
+            sys.stdout.flush()
+    return proc.wait()
+
+
 def _rand_str(size):
     return ''.join(random.choice(string.ascii_lowercase + string.digits) for _ in range(size))
 
 
+def _setup_shard_clis(shard_testers, stub_universes):
+    '''Sets up a separate CLI sandbox for each additional cluster, then restores the environment'''
+    original_env = os.environ.copy()
+    # CLUSTER_AUTH_TOKEN belongs to CLUSTER_URL, log in to the other clusters instead:
+    os.environ.pop('CLUSTER_AUTH_TOKEN', None)
+    try:
+        for shard_tester in shard_testers:
+            shard_tester.setup_cli(stub_universes)
+    finally:
+        os.environ.clear()
+        os.environ.update(original_env)
+
+
 def main(argv):
     if len(argv) < 3:
         print_help(argv)
@@ -258,6 +564,11 @@ def main(argv):
 
     pytest_types = os.environ.get('TEST_TYPES', 'sanity')
 
+    # additional clusters for shards to run against:
+    shard_testers = [CITester(url, os.environ.get('TEST_GITHUB_LABEL', test_type))
+                     for url in os.environ.get('TEST_SHARD_CLUSTER_URLS', '').split()]
+    shards = int(os.environ.get('TEST_SHARDS', 1 + len(shard_testers)))
+
     try:
         tester.setup_cli(stub_universes)
         if test_type == 'shakedown':
@@ -267,17 +578,17 @@ def main(argv):
             else:
                 # use default requirements
                 requirements_txt = ''
-            tester.run_shakedown(test_dirs, requirements_txt, pytest_types)
+            if shards > 1:
+                _setup_shard_clis(shard_testers, stub_universes)
+            tester.run_shakedown(test_dirs, requirements_txt, pytest_types, shards, shard_testers)
         elif test_type == 'dcos-tests':
             dcos_tests_dir = argv[3]
             tester.run_dcostests(test_dirs, dcos_tests_dir, pytest_types)
         else:
             raise Exception('Unsupported test type: {}'.format(test_type))
-
-        tester.delete_sandbox()
-    except:
-        tester.delete_sandbox()
-        raise
+    finally:
+        for t in [tester] + shard_testers:
+            t.delete_sandbox()
     return 0
 
 
@@ -0,0 +1,485 @@
+#!/usr/bin/python
+#
+# Uploads files to S3 in-process via boto3, rather than forking an 'aws s3 cp' per file.
+# Large files are sent as multipart uploads whose parts are uploaded concurrently, with per-part
+# retries. Multipart progress is saved locally so that an interrupted upload of the same file content
+# resumes where it left off, even if it's now being uploaded to a different key.
+# Each object is stored with its sha256 in its metadata. In dedup mode, a file isn't uploaded if an
+# identical object is already at the destination, or is copied server-side from an identical object
+# listed in a manifest of previous uploads.
+#
+# Env:
+#   AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY: credentials (or any other source supported by boto3)
+#   S3_ENDPOINT_URL (optional): alternate S3 endpoint, eg a local MinIO or moto server for testing
+#   S3_UPLOAD_CONCURRENCY (default: 8): parts uploaded in parallel
+#   S3_UPLOAD_PART_SIZE_MB (default: 16): files larger than this are uploaded in parts of this size
+#   S3_UPLOAD_STATE_DIR (default: ~/.dcos-commons/s3-uploads): where to save state of multipart uploads
+#   S3_DEDUP (optional): if non-empty, skip or server-side copy files which were already uploaded
+#   S3_DEDUP_MANIFEST (optional): s3:// URL of the manifest of previous uploads, overriding the caller's default
+
+import contextlib
+import hashlib
+import json
+import logging
+import multiprocessing.pool
+import os
+import os.path
+import sys
+import threading
+import time
+
+import boto3
+import botocore.config
+import botocore.exceptions
+
+import universe_builder
+
+logger = logging.getLogger(__name__)
+logging.basicConfig(level=logging.DEBUG, format="%(message)s")
+# boto's debug logging includes every request/response:
+for name in ['boto3', 'botocore', 's3transfer', 'urllib3']:
+    logging.getLogger(name).setLevel(logging.WARNING)
+
+MAX_PART_ATTEMPTS = 5
+MAX_RETRY_DELAY_SECONDS = 30
+# errors besides these (and 5xx responses) will fail the same way if retried, eg AccessDenied:
+RETRYABLE_ERROR_CODES = set(['RequestTimeout', 'SlowDown', 'Throttling', 'ThrottlingException'])
+
+
+def parse_s3_url(s3_url):
+    '''s3://bucket/some/key => ('bucket', 'some/key')'''
+    if not s3_url.startswith('s3://'):
+        raise Exception('Expected an s3:// URL, got: {}'.format(s3_url))
+    bucket, _, key = s3_url[len('s3://'):].partition('/')
+    return (bucket, key)
+
+
+class S3Uploader(object):
+
+    def __init__(self, region=None, dry_run=False, dedup_manifest_url=None):
+        self._dry_run = dry_run
+        self._dedup = bool(os.environ.get('S3_DEDUP', ''))
+        self._manifest_url = os.environ.get('S3_DEDUP_MANIFEST', dedup_manifest_url)
+        self._manifest = None
+        self._manifest_updates = {}
+        self._manifest_lock = threading.Lock()
+        self._sha256_cache = universe_builder.get_sha256_cache()
+        self._concurrency = int(os.environ.get('S3_UPLOAD_CONCURRENCY', '8'))
+        self._part_size = int(os.environ.get('S3_UPLOAD_PART_SIZE_MB', '16')) * 1024 * 1024
+        self._state_dir = os.environ.get(
+            'S3_UPLOAD_STATE_DIR', os.path.join(os.path.expanduser('~'), '.dcos-commons', 's3-uploads'))
+        # boto3 clients are thread-safe, but creating them isn't:
+        self._client = boto3.session.Session().client(
+            's3',
+            region_name=region or None,
+            endpoint_url=os.environ.get('S3_ENDPOINT_URL') or None,
+            config=botocore.config.Config(max_pool_connections=self._concurrency))
+        # shared by all multipart uploads in progress, see _parts():
+        self._part_pool = None
+        self._part_pool_users = 0
+        self._part_pool_lock = threading.Lock()
+        # limits the parts held in memory by upload_stream() across all streams:
+        self._stream_buffers = threading.BoundedSemaphore(self._concurrency)
+        self._stats = []
+        self._stats_lock = threading.Lock()
+
+
+    def upload(self, filepath, s3_url, acl='public-read'):
+        '''Uploads a single file to the provided s3://bucket/key URL'''
+        bucket, key = parse_s3_url(s3_url)
+        size = os.path.getsize(filepath)
+        if self._dry_run:
+            logger.info('[DRY RUN] Upload {} ({} bytes) to {}'.format(filepath, size, s3_url))
+            return
+        start = time.time()
+        sha256 = self._sha256_cache.get(filepath)
+        action = None
+        if self._dedup:
+            action = self._dedup_upload(sha256, bucket, key, acl)
+        if not action:
+            logger.info('Uploading {} ({} bytes) to {}'.format(filepath, size, s3_url))
+            metadata = {'sha256': sha256}
+            if size <= self._part_size:
+                with open(filepath, 'rb') as body:
+                    self._retry('upload of {}'.format(s3_url), lambda: self._client.put_object(
+                        Bucket=bucket, Key=key, ACL=acl, Metadata=metadata, Body=body.read()))
+            else:
+                self._upload_multipart(filepath, size, bucket, key, acl, metadata)
+            action = 'uploaded'
+        if self._dedup:
+            with self._manifest_lock:
+                self._manifest_updates[sha256] = s3_url
+        with self._stats_lock:
+            self._stats.append((filepath, size, time.time() - start, action))
+
+
+    def upload_all(self, filepaths_urls, acl='public-read'):
+        '''Uploads a list of (filepath, s3_url) concurrently'''
+        if not filepaths_urls:
+            return
+        # hash any uncached files in parallel up front:
+        self._sha256_cache.get_all([filepath for filepath, s3_url in filepaths_urls])
+        # files get their own pool: their parts are all sent via the shared part pool
+        file_pool = multiprocessing.pool.ThreadPool(min(len(filepaths_urls), self._concurrency))
+        try:
+            with self._parts():
+                file_pool.map(lambda filepath_url: self.upload(filepath_url[0], filepath_url[1], acl), filepaths_urls)
+        finally:
+            file_pool.close()
+            file_pool.join()
+            self._save_manifest()
+
+
+    def copy(self, source_s3_url, dest_s3_url, expected_sha256=None, acl='public-read'):
+        '''Copies an object server-side. Requires read access to the source with our credentials.
+        If expected_sha256 is provided, the source must have a matching sha256 in its metadata.'''
+        source_bucket, source_key = parse_s3_url(source_s3_url)
+        dest_bucket, dest_key = parse_s3_url(dest_s3_url)
+        if self._dry_run:
+            logger.info('[DRY RUN] Copy {} to {} (server-side)'.format(source_s3_url, dest_s3_url))
+            return
+        start = time.time()
+        source = self._client.head_object(Bucket=source_bucket, Key=source_key)
+        if expected_sha256:
+            _check_sha256(source_s3_url, source.get('Metadata', {}).get('sha256'), expected_sha256)
+        size = source['ContentLength']
+        logger.info('Copying {} to {} (server-side)'.format(source_s3_url, dest_s3_url))
+        # managed copy: uses multipart copy for large objects, and retains the source's metadata
+        self._retry('copy of {}'.format(source_s3_url), lambda: self._client.copy(
+            {'Bucket': source_bucket, 'Key': source_key}, dest_bucket, dest_key, ExtraArgs={'ACL': acl}))
+        with self._stats_lock:
+            self._stats.append((dest_key, size, time.time() - start, 'copied'))
+
+
+    def upload_stream(self, fileobj, s3_url, expected_sha256=None, acl='public-read'):
+        '''Uploads the content of a file-like object (eg an HTTP response) without writing it to disk.
+        Parts are uploaded concurrently as they're read. If expected_sha256 is provided and doesn't
+        match the content, the upload is aborted before the object is created.'''
+        bucket, key = parse_s3_url(s3_url)
+        if self._dry_run:
+            logger.info('[DRY RUN] Upload stream to {}'.format(s3_url))
+            return
+        logger.info('Uploading stream to {}'.format(s3_url))
+        start = time.time()
+        hasher = hashlib.sha256()
+        data = self._read_stream_buffer(fileobj, hasher)
+        if len(data) < self._part_size:
+            # small enough for a single request:
+            try:
+                sha256 = hasher.hexdigest()
+                _check_sha256(s3_url, sha256, expected_sha256)
+                self._retry('upload of {}'.format(s3_url), lambda: self._client.put_object(
+                    Bucket=bucket, Key=key, ACL=acl, Metadata={'sha256': sha256}, Body=data))
+            finally:
+                self._stream_buffers.release()
+            size = len(data)
+        else:
+            size = self._upload_stream_multipart(fileobj, data, hasher, bucket, key, acl, expected_sha256)
+        with self._stats_lock:
+            self._stats.append((key, size, time.time() - start, 'uploaded'))
+
+
+    def _read_stream_buffer(self, fileobj, hasher):
+        '''Reads and hashes the next part of the stream. The caller must release _stream_buffers once the
+        returned data has been uploaded.'''
+        self._stream_buffers.acquire()
+        try:
+            data = _read_fully(fileobj, self._part_size)
+        except:
+            self._stream_buffers.release()
+            raise
+        hasher.update(data)
+        return data
+
+
+    def _upload_stream_multipart(self, fileobj, data, hasher, bucket, key, acl, expected_sha256):
+        '''Uploads data, followed by the rest of fileobj. Returns the number of bytes uploaded.'''
+        def upload_part(upload_id, part_number, data):
+            try:
+                return self._retry('part {} of {}'.format(part_number, key), lambda: self._client.upload_part(
+                    Bucket=bucket, Key=key, UploadId=upload_id, PartNumber=part_number, Body=data)['ETag'])
+            finally:
+                self._stream_buffers.release()
+        try:
+            # the sha256 isn't known until the end, so unlike upload() it can't be included as metadata
+            upload_id = self._retry('start of multipart upload to {}'.format(key), lambda: self._client.create_multipart_upload(
+                Bucket=bucket, Key=key, ACL=acl)['UploadId'])
+        except:
+            self._stream_buffers.release()
+            raise
+        results = []
+        size = 0
+        with self._parts() as part_pool:
+            try:
+                while data:
+                    size += len(data)
+                    results.append(part_pool.apply_async(upload_part, (upload_id, len(results) + 1, data)))
+                    data = self._read_stream_buffer(fileobj, hasher)
+                self._stream_buffers.release()
+                # wait for all parts before checking the sha256, even if it's going to be a mismatch:
+                # otherwise a part may be uploaded after the abort, leaving it (and its storage cost) behind
+                etags = [result.get() for result in results]
+                _check_sha256('s3://{}/{}'.format(bucket, key), hasher.hexdigest(), expected_sha256)
+                self._retry('completion of multipart upload to {}'.format(key), lambda: self._client.complete_multipart_upload(
+                    Bucket=bucket, Key=key, UploadId=upload_id, MultipartUpload={'Parts': [
+                        {'PartNumber': i + 1, 'ETag': etag} for i, etag in enumerate(etags)]}))
+            except:
+                for result in results:
+                    result.wait()
+                logger.error('Aborting upload to {}'.format(key))
+                self._client.abort_multipart_upload(Bucket=bucket, Key=key, UploadId=upload_id)
+                raise
+        return size
+
+
+    def exists(self, s3_dir_url):
+        '''Returns whether any objects are present under the provided s3://bucket/dir URL'''
+        bucket, prefix = parse_s3_url(s3_dir_url)
+        response = self._client.list_objects_v2(Bucket=bucket, Prefix=prefix.rstrip('/') + '/', MaxKeys=1)
+        return response.get('KeyCount', 0) > 0
+
+
+    def log_throughput(self):
+        '''Logs the size, duration, and throughput of each upload so far'''
+        if not self._stats:
+            return
+        logger.info('---')
+        logger.info('Upload throughput:')
+        total_bytes = 0
+        for filepath, size, seconds, action in self._stats:
+            total_bytes += size
+            logger.info('  {}: {:.1f} MB {} in {:.1f}s ({:.1f} MB/s)'.format(
+                os.path.basename(filepath), size / 1048576., action, seconds, size / 1048576. / max(seconds, 0.001)))
+        logger.info('  Total: {:.1f} MB in {} file(s)'.format(total_bytes / 1048576., len(self._stats)))
+
+
+    def _dedup_upload(self, sha256, bucket, key, acl):
+        '''Returns 'skipped' or 'copied' if an object matching sha256 was already uploaded, or None if the
+        file needs to be uploaded'''
+        if self._get_object_sha256(bucket, key) == sha256:
+            logger.info('Skipping upload to s3://{}/{}: identical object already exists'.format(bucket, key))
+            return 'skipped'
+        source_url = self._get_manifest().get(sha256)
+        if not source_url:
+            return None
+        source_bucket, source_key = parse_s3_url(source_url)
+        # the manifest may be stale, eg if the object has since expired:
+        if self._get_object_sha256(source_bucket, source_key) != sha256:
+            return None
+        logger.info('Copying {} to s3://{}/{} (server-side)'.format(source_url, bucket, key))
+        # managed copy: uses multipart copy for large objects, and retains the source's metadata
+        self._retry('copy of {}'.format(source_url), lambda: self._client.copy(
+            {'Bucket': source_bucket, 'Key': source_key}, bucket, key, ExtraArgs={'ACL': acl}))
+        return 'copied'
+
+
+    def _get_object_sha256(self, bucket, key):
+        '''Returns the sha256 recorded in the object's metadata, or None if it doesn't exist'''
+        try:
+            response = self._retry('lookup of s3://{}/{}'.format(bucket, key), lambda: self._client.head_object(
+                Bucket=bucket, Key=key))
+        except botocore.exceptions.ClientError as e:
+            if e.response.get('ResponseMetadata', {}).get('HTTPStatusCode') in (403, 404):
+                return None
+            raise
+        return response.get('Metadata', {}).get('sha256')
+
+
+    def _get_manifest(self):
+        '''Returns the manifest of previous uploads, as {sha256: s3_url}'''
+        with self._manifest_lock:
+            if self._manifest is None:
+                self._manifest = self._fetch_manifest()
+            return self._manifest
+
+
+    def _fetch_manifest(self):
+        if not self._manifest_url:
+            return {}
+        bucket, key = parse_s3_url(self._manifest_url)
+        try:
+            response = self._client.get_object(Bucket=bucket, Key=key)
+        except botocore.exceptions.ClientError as e:
+            if e.response.get('ResponseMetadata', {}).get('HTTPStatusCode') in (403, 404):
+                return {}
+            raise
+        return json.loads(response['Body'].read().decode('utf-8'))
+
+
+    def _save_manifest(self):
+        with self._manifest_lock:
+            updates = self._manifest_updates
+            self._manifest_updates = {}
+        if not self._manifest_url or not updates:
+            return
+        # refetch first to pick up any other uploads in the meantime. concurrent publishers may still
+        # drop each other's entries, which just results in a redundant upload later.
+        manifest = self._fetch_manifest()
+        if all(manifest.get(sha256) == s3_url for sha256, s3_url in updates.items()):
+            return
+        manifest.update(updates)
+        bucket, key = parse_s3_url(self._manifest_url)
+        logger.info('Updating upload manifest at {} with {} entries'.format(self._manifest_url, len(updates)))
+        self._retry('update of {}'.format(self._manifest_url), lambda: self._client.put_object(
+            Bucket=bucket, Key=key, Body=json.dumps(manifest, indent=2, sort_keys=True).encode('utf-8')))
+        with self._manifest_lock:
+            self._manifest = manifest
+
+
+    def _upload_multipart(self, filepath, size, bucket, key, acl, metadata):
+        # an interrupted upload of the same content is resumed, even if it was headed elsewhere, eg to a
+        # prior run's directory: it's then completed there and moved to the requested key server-side
+        state_path = self._get_state_path(filepath, metadata['sha256'])
+        upload_bucket, upload_key, upload_id, parts = self._resume_multipart(state_path)
+        if not upload_id:
+            upload_bucket, upload_key = bucket, key
+            upload_id = self._retry('start of multipart upload to {}'.format(key), lambda: self._client.create_multipart_upload(
+                Bucket=bucket, Key=key, ACL=acl, Metadata=metadata)['UploadId'])
+            parts = {}
+            self._save_state(state_path, {'bucket': bucket, 'key': key, 'upload_id': upload_id, 'part_size': self._part_size})
+
+        num_parts = (size + self._part_size - 1) // self._part_size
+        def part_size(part_number):
+            return min(self._part_size, size - (part_number - 1) * self._part_size)
+        pending = [n for n in range(1, num_parts + 1) if parts.get(n, {}).get('Size') != part_size(n)]
+        logger.info('Uploading {} of {} parts for {} (upload id {})'.format(len(pending), num_parts, upload_key, upload_id))
+
+        def upload_part(part_number):
+            with open(filepath, 'rb') as fd:
+                fd.seek((part_number - 1) * self._part_size)
+                data = fd.read(self._part_size)
+            etag = self._retry('part {}/{} of {}'.format(part_number, num_parts, upload_key), lambda: self._client.upload_part(
+                Bucket=upload_bucket, Key=upload_key, UploadId=upload_id, PartNumber=part_number, Body=data)['ETag'])
+            return (part_number, {'ETag': etag, 'Size': len(data)})
+        # failed parts are retried above. if they still fail, the state is kept for resuming later.
+        with self._parts() as part_pool:
+            parts.update(dict(part_pool.map(upload_part, pending)))
+
+        self._retry('completion of multipart upload to {}'.format(upload_key), lambda: self._client.complete_multipart_upload(
+            Bucket=upload_bucket, Key=upload_key, UploadId=upload_id, MultipartUpload={'Parts': [
+                {'PartNumber': n, 'ETag': parts[n]['ETag']} for n in range(1, num_parts + 1)]}))
+        os.remove(state_path)
+        if (upload_bucket, upload_key) != (bucket, key):
+            logger.info('Moving resumed upload from s3://{}/{} to s3://{}/{} (server-side)'.format(
+                upload_bucket, upload_key, bucket, key))
+            # managed copy: uses multipart copy for large objects, and retains the source's metadata
+            self._retry('copy of {}'.format(upload_key), lambda: self._client.copy(
+                {'Bucket': upload_bucket, 'Key': upload_key}, bucket, key, ExtraArgs={'ACL': acl}))
+            self._retry('removal of {}'.format(upload_key), lambda: self._client.delete_object(
+                Bucket=upload_bucket, Key=upload_key))
+
+
+    @contextlib.contextmanager
+    def _parts(self):
+        '''Yields the pool which uploads parts. It's shared by all uploads in progress, so that the total
+        number of concurrent parts is limited, and it's shut down once none are left.'''
+        with self._part_pool_lock:
+            if not self._part_pool_users:
+                self._part_pool = multiprocessing.pool.ThreadPool(self._concurrency)
+            self._part_pool_users += 1
+            part_pool = self._part_pool
+        try:
+            yield part_pool
+        finally:
+            with self._part_pool_lock:
+                self._part_pool_users -= 1
+                if not self._part_pool_users:
+                    self._part_pool = None
+                    part_pool.close()
+                    part_pool.join()
+
+
+    def _resume_multipart(self, state_path):
+        '''Returns (bucket, key, upload id, {part number: {'ETag', 'Size'}}) for a prior incomplete upload,
+        or (None, None, None, {})'''
+        if not os.path.isfile(state_path):
+            return (None, None, None, {})
+        with open(state_path, 'r') as state_file:
+            state = json.load(state_file)
+        bucket, key = state['bucket'], state['key']
+        if state.get('part_size') != self._part_size:
+            logger.info('Part size has changed, restarting upload to {}'.format(key))
+            return (None, None, None, {})
+        parts = {}
+        try:
+            paginator = self._client.get_paginator('list_parts')
+            for page in paginator.paginate(Bucket=bucket, Key=key, UploadId=state['upload_id']):
+                for part in page.get('Parts', []):
+                    parts[part['PartNumber']] = {'ETag': part['ETag'], 'Size': part['Size']}
+        except botocore.exceptions.ClientError as e:
+            # eg NoSuchUpload if the upload was aborted or expired:
+            logger.info('Unable to resume upload to {}, restarting: {}'.format(key, e))
+            return (None, None, None, {})
+        logger.info('Resuming upload to {} with {} parts already uploaded'.format(key, len(parts)))
+        return (bucket, key, state['upload_id'], parts)
+
+
+    def _get_state_path(self, filepath, sha256):
+        # keyed on the content rather than the destination, which may differ between runs. a changed file
+        # shouldn't resume an upload of its prior content:
+        state_key = '{}:{}'.format(os.path.abspath(filepath), sha256)
+        return os.path.join(self._state_dir, '{}.json'.format(hashlib.sha256(state_key.encode('utf-8')).hexdigest()))
+
+
+    def _save_state(self, state_path, state):
+        if not os.path.isdir(self._state_dir):
+            os.makedirs(self._state_dir)
+        with open(state_path, 'w') as state_file:
+            json.dump(state, state_file)
+
+
+    def _retry(self, label, fn):
+        attempt = 1
+        while True:
+            try:
+                return fn()
+            except (botocore.exceptions.BotoCoreError, botocore.exceptions.ClientError) as e:
+                if isinstance(e, botocore.exceptions.ClientError) and not _is_retryable(e):
+                    raise
+                if attempt >= MAX_PART_ATTEMPTS:
+                    logger.error('Failed {} after {} attempts: {}'.format(label, attempt, e))
+                    raise
+                delay = min(2 ** attempt, MAX_RETRY_DELAY_SECONDS)
+                logger.warning('Failed {} (attempt {}/{}), retrying in {}s: {}'.format(
+                    label, attempt, MAX_PART_ATTEMPTS, delay, e))
+                time.sleep(delay)
+                attempt += 1
+
+
+def _read_fully(fileobj, size):
+    '''Reads until size bytes or EOF, as HTTP responses may return fewer bytes than requested'''
+    chunks = []
+    remaining = size
+    while remaining > 0:
+        chunk = fileobj.read(remaining)
+        if not chunk:
+            break
+        chunks.append(chunk)
+        remaining -= len(chunk)
+    return b''.join(chunks)
+
+
+def _check_sha256(s3_url, sha256, expected_sha256):
+    if expected_sha256 and sha256 != expected_sha256:
+        raise Exception('Content for {} has sha256 {}, expected {}'.format(s3_url, sha256, expected_sha256))
+
+
+def _is_retryable(client_error):
+    response = client_error.response
+    return (response.get('Error', {}).get('Code') in RETRYABLE_ERROR_CODES
+            or response.get('ResponseMetadata', {}).get('HTTPStatusCode', 0) >= 500)
+
+
+def main(argv):
+    if len(argv) < 3:
+        logger.error('Syntax: {} <s3://bucket/dir> <file> [files ...]'.format(argv[0]))
+        return 1
+    s3_dir = argv[1].rstrip('/')
+    uploader = S3Uploader(os.environ.get('AWS_UPLOAD_REGION', ''), os.environ.get('DRY_RUN', ''))
+    uploader.upload_all([(path, '{}/{}'.format(s3_dir, os.path.basename(path))) for path in argv[2:]])
+    uploader.log_throughput()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -8,6 +8,12 @@ import logging
 import os
 import sys
 
+try:
+    import s3_upload
+except ImportError:
+    # boto3 isn't installed: fall back to the aws CLI
+    s3_upload = None
+
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.DEBUG, format="%(message)s")
 
@@ -21,6 +27,13 @@ def upload_to_s3(s3_dir_uri):
         err = 'Could not find properties file: {}'.format(properties_file_path)
         raise Exception(err)
 
+    if s3_upload:
+        # skips the upload if the properties are unchanged, in dedup mode (S3_DEDUP)
+        s3_upload.S3Uploader(os.environ.get('AWS_UPLOAD_REGION', ''), os.environ.get('DRY_RUN', '')).upload_all([(
+            properties_file_path,
+            '{}/{}'.format(s3_dir_uri.rstrip('/'), os.path.basename(properties_file_path)))])
+        return
+
     # check if aws cli tools are installed
     cmd = "aws --version"
     ret = os.system(cmd)
@@ -0,0 +1,8 @@
+'''Unit tests for the build and CI tools. Run with:
+  $ python3 -m pytest tools/tests'''
+
+import os.path
+import sys
+
+# the tools are run as scripts, and import each other by name:
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
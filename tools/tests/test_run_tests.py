@@ -0,0 +1,67 @@
+import os.path
+
+import run_tests
+
+MODULES = [
+    'frameworks/helloworld/tests/test_sanity.py',
+    'frameworks/helloworld/tests/test_recovery.py',
+    'frameworks/kafka/tests/test_sanity.py',
+    'frameworks/hdfs/tests/test_shakedown.py',
+]
+DOTTED_MODULES = [(module, os.path.splitext(module)[0].replace('/', '.')) for module in MODULES]
+
+
+def test_match_module():
+    assert run_tests._match_module(
+        'frameworks.helloworld.tests.test_sanity', DOTTED_MODULES) == MODULES[0]
+    # trailing class name:
+    assert run_tests._match_module(
+        'frameworks.helloworld.tests.test_recovery.TestRecovery', DOTTED_MODULES) == MODULES[1]
+    # as reported when py.test is run from within the framework's directory:
+    assert run_tests._match_module('tests.test_recovery', DOTTED_MODULES) == MODULES[1]
+    assert run_tests._match_module('tests.test_shakedown.TestClass', DOTTED_MODULES) == MODULES[3]
+
+
+def test_match_module_ambiguous_or_unknown():
+    # helloworld and kafka both have a tests/test_sanity.py:
+    assert run_tests._match_module('tests.test_sanity', DOTTED_MODULES) is None
+    assert run_tests._match_module('tests.test_sanity.TestClass', DOTTED_MODULES) is None
+    assert run_tests._match_module('tests.test_other', DOTTED_MODULES) is None
+    # partial names don't match:
+    assert run_tests._match_module('sanity', DOTTED_MODULES) is None
+    assert run_tests._match_module('', DOTTED_MODULES) is None
+
+
+def test_pack_shards():
+    durations = {'a': 100, 'b': 70, 'c': 60, 'd': 40, 'e': 30}
+    shards = run_tests._pack_shards(sorted(durations.keys()), durations, 2)
+    # longest first, each to the least loaded shard:
+    assert shards == [(140, ['a', 'd']), (160, ['b', 'c', 'e'])]
+
+
+def test_pack_shards_unknown_durations():
+    # modules without history are assumed to take the median of the known durations:
+    shards = run_tests._pack_shards(['a', 'b', 'c', 'new'], {'a': 10, 'b': 20, 'c': 30}, 2)
+    assert shards == [(40, ['c', 'a']), (40, ['b', 'new'])]
+
+    # or a default duration if there's no history at all:
+    shards = run_tests._pack_shards(['b', 'a', 'c'], {}, 2)
+    assert shards == [(2 * run_tests.DEFAULT_MODULE_DURATION_SECONDS, ['a', 'c']),
+                      (run_tests.DEFAULT_MODULE_DURATION_SECONDS, ['b'])]
+
+
+def test_pack_shards_more_shards_than_modules():
+    shards = run_tests._pack_shards(['a', 'b'], {'a': 10, 'b': 20}, 4)
+    assert shards == [(20, ['b']), (10, ['a']), (0, []), (0, [])]
+
+
+def test_find_test_modules(tmp_path):
+    tests_dir = tmp_path / 'tests'
+    for path in ['test_a.py', 'b_test.py', 'helper.py', 'sub/test_c.py', '.hidden/test_d.py',
+                 '__pycache__/test_e.py', 'test_f.txt']:
+        (tests_dir / path).parent.mkdir(parents=True, exist_ok=True)
+        (tests_dir / path).write_text('')
+    other = tmp_path / 'test_other.py'
+    other.write_text('')
+    assert run_tests._find_test_modules([str(tests_dir), str(other)]) == [
+        str(tests_dir / 'b_test.py'), str(tests_dir / 'test_a.py'), str(tests_dir / 'sub' / 'test_c.py'), str(other)]
@@ -0,0 +1,191 @@
+import hashlib
+import json
+import os
+
+import boto3
+import botocore.exceptions
+import moto
+import pytest
+
+import s3_upload
+
+BUCKET = 'test-bucket'
+PART_SIZE = 5 * 1024 * 1024
+
+
+@pytest.fixture
+def s3(tmp_path, monkeypatch):
+    '''An empty bucket in a moto stand-in for S3, with small parts and without retry delays'''
+    monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'testing')
+    monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', 'testing')
+    monkeypatch.setenv('AWS_DEFAULT_REGION', 'us-east-1')
+    monkeypatch.delenv('S3_ENDPOINT_URL', raising=False)
+    monkeypatch.delenv('S3_DEDUP', raising=False)
+    monkeypatch.setenv('S3_UPLOAD_PART_SIZE_MB', str(PART_SIZE // (1024 * 1024)))
+    monkeypatch.setenv('S3_UPLOAD_STATE_DIR', str(tmp_path / 's3-uploads'))
+    monkeypatch.setenv('SHA256_CACHE_PATH', str(tmp_path / 'sha256-cache.json'))
+    monkeypatch.setattr(s3_upload.time, 'sleep', lambda seconds: None)
+    with moto.mock_aws():
+        client = boto3.client('s3')
+        client.create_bucket(Bucket=BUCKET)
+        yield client
+
+
+@pytest.fixture
+def large_file(tmp_path):
+    path = tmp_path / 'artifact.zip'
+    # three parts, the last one short:
+    path.write_bytes(os.urandom(2 * PART_SIZE + 1024))
+    return str(path)
+
+
+def _get(s3, key):
+    return s3.get_object(Bucket=BUCKET, Key=key)
+
+
+def _sent_parts(uploader, fail_part=None, error=None):
+    '''Records the part numbers sent by the uploader, optionally failing the first attempt of a part'''
+    sent = []
+    upload_part = uploader._client.upload_part
+
+    def record(**kwargs):
+        sent.append(kwargs['PartNumber'])
+        if kwargs['PartNumber'] == fail_part and sent.count(fail_part) == 1:
+            raise error
+        return upload_part(**kwargs)
+    uploader._client.upload_part = record
+    return sent
+
+
+def test_small_upload(s3, tmp_path):
+    path = tmp_path / 'small.json'
+    path.write_bytes(b'{}')
+    uploader = s3_upload.S3Uploader()
+    uploader.upload_all([(str(path), 's3://{}/dir/small.json'.format(BUCKET))])
+    obj = _get(s3, 'dir/small.json')
+    assert obj['Body'].read() == b'{}'
+    assert obj['Metadata'] == {'sha256': hashlib.sha256(b'{}').hexdigest()}
+
+
+def test_multipart_upload(s3, large_file):
+    uploader = s3_upload.S3Uploader()
+    sent = _sent_parts(uploader)
+    uploader.upload_all([(large_file, 's3://{}/dir/artifact.zip'.format(BUCKET))])
+    assert sorted(sent) == [1, 2, 3]
+    with open(large_file, 'rb') as f:
+        content = f.read()
+    obj = _get(s3, 'dir/artifact.zip')
+    assert obj['Body'].read() == content
+    assert obj['Metadata'] == {'sha256': hashlib.sha256(content).hexdigest()}
+    # no upload state or part uploaders are left behind:
+    assert os.listdir(os.environ['S3_UPLOAD_STATE_DIR']) == []
+    assert uploader._part_pool is None
+
+
+def test_failed_part_retried(s3, large_file):
+    uploader = s3_upload.S3Uploader()
+    sent = _sent_parts(uploader, fail_part=2, error=botocore.exceptions.ClientError(
+        {'Error': {'Code': 'InternalError'}, 'ResponseMetadata': {'HTTPStatusCode': 500}}, 'UploadPart'))
+    uploader.upload(large_file, 's3://{}/dir/artifact.zip'.format(BUCKET))
+    assert sorted(sent) == [1, 2, 2, 3]
+    with open(large_file, 'rb') as f:
+        assert _get(s3, 'dir/artifact.zip')['Body'].read() == f.read()
+
+
+def test_failed_part_not_retried(s3, large_file):
+    uploader = s3_upload.S3Uploader()
+    sent = _sent_parts(uploader, fail_part=2, error=botocore.exceptions.ClientError(
+        {'Error': {'Code': 'AccessDenied'}, 'ResponseMetadata': {'HTTPStatusCode': 403}}, 'UploadPart'))
+    with pytest.raises(botocore.exceptions.ClientError):
+        uploader.upload(large_file, 's3://{}/dir/artifact.zip'.format(BUCKET))
+    assert sent.count(2) == 1
+
+
+def test_resumed_upload(s3, large_file):
+    # the first run fails on its last part, after the other parts have been uploaded:
+    uploader = s3_upload.S3Uploader()
+    _sent_parts(uploader, fail_part=3, error=ValueError('interrupted'))
+    with pytest.raises(ValueError):
+        uploader.upload_all([(large_file, 's3://{}/run1/artifact.zip'.format(BUCKET))])
+    assert len(os.listdir(os.environ['S3_UPLOAD_STATE_DIR'])) == 1
+
+    # the next run of the same content only sends the missing part, even though it's headed elsewhere:
+    uploader = s3_upload.S3Uploader()
+    sent = _sent_parts(uploader)
+    uploader.upload_all([(large_file, 's3://{}/run2/artifact.zip'.format(BUCKET))])
+    assert sent == [3]
+    with open(large_file, 'rb') as f:
+        content = f.read()
+    obj = _get(s3, 'run2/artifact.zip')
+    assert obj['Body'].read() == content
+    assert obj['Metadata'] == {'sha256': hashlib.sha256(content).hexdigest()}
+    # the resumed upload was moved to the new destination:
+    assert [o['Key'] for o in s3.list_objects_v2(Bucket=BUCKET)['Contents']] == ['run2/artifact.zip']
+    assert os.listdir(os.environ['S3_UPLOAD_STATE_DIR']) == []
+
+
+def test_changed_file_not_resumed(s3, large_file):
+    uploader = s3_upload.S3Uploader()
+    _sent_parts(uploader, fail_part=3, error=ValueError('interrupted'))
+    with pytest.raises(ValueError):
+        uploader.upload(large_file, 's3://{}/dir/artifact.zip'.format(BUCKET))
+
+    with open(large_file, 'r+b') as f:
+        f.write(b'changed')
+    uploader = s3_upload.S3Uploader()
+    sent = _sent_parts(uploader)
+    uploader.upload(large_file, 's3://{}/dir/artifact.zip'.format(BUCKET))
+    assert sorted(sent) == [1, 2, 3]
+
+
+
+def test_dedup_skips_identical_object(s3, tmp_path, monkeypatch):
+    monkeypatch.setenv('S3_DEDUP', 'true')
+    path = tmp_path / 'small.json'
+    path.write_bytes(b'{}')
+    url = 's3://{}/dir/small.json'.format(BUCKET)
+    s3_upload.S3Uploader().upload_all([(str(path), url)])
+
+    uploader = s3_upload.S3Uploader()
+    uploader._client.put_object = None
+    uploader.upload_all([(str(path), url)])
+    assert [stat[3] for stat in uploader._stats] == ['skipped']
+
+
+def test_dedup_copies_from_manifest(s3, large_file, monkeypatch):
+    monkeypatch.setenv('S3_DEDUP', 'true')
+    manifest_url = 's3://{}/sha256-manifest.json'.format(BUCKET)
+    s3_upload.S3Uploader(dedup_manifest_url=manifest_url).upload_all(
+        [(large_file, 's3://{}/run1/artifact.zip'.format(BUCKET))])
+    with open(large_file, 'rb') as f:
+        content = f.read()
+    sha256 = hashlib.sha256(content).hexdigest()
+    manifest = json.loads(_get(s3, 'sha256-manifest.json')['Body'].read().decode('utf-8'))
+    assert manifest == {sha256: 's3://{}/run1/artifact.zip'.format(BUCKET)}
+
+    uploader = s3_upload.S3Uploader(dedup_manifest_url=manifest_url)
+    sent = _sent_parts(uploader)
+    uploader.upload_all([(large_file, 's3://{}/run2/artifact.zip'.format(BUCKET))])
+    assert sent == []
+    assert [stat[3] for stat in uploader._stats] == ['copied']
+    obj = _get(s3, 'run2/artifact.zip')
+    assert obj['Body'].read() == content
+    assert obj['Metadata'] == {'sha256': sha256}
+    manifest = json.loads(_get(s3, 'sha256-manifest.json')['Body'].read().decode('utf-8'))
+    assert manifest == {sha256: 's3://{}/run2/artifact.zip'.format(BUCKET)}
+
+
+def test_upload_stream(s3, large_file):
+    uploader = s3_upload.S3Uploader()
+    with open(large_file, 'rb') as f:
+        content = f.read()
+        f.seek(0)
+        uploader.upload_stream(f, 's3://{}/dir/streamed.zip'.format(BUCKET), hashlib.sha256(content).hexdigest())
+    assert _get(s3, 'dir/streamed.zip')['Body'].read() == content
+    assert uploader._part_pool is None
+
+    with open(large_file, 'rb') as f:
+        with pytest.raises(Exception) as e:
+            uploader.upload_stream(f, 's3://{}/dir/mismatch.zip'.format(BUCKET), 'wrong')
+    assert 'expected wrong' in str(e.value)
+    assert 'dir/mismatch.zip' not in [o['Key'] for o in s3.list_objects_v2(Bucket=BUCKET)['Contents']]
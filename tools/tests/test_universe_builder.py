@@ -0,0 +1,174 @@
+import hashlib
+import io
+import json
+import os
+import os.path
+import time
+import zipfile
+
+import pytest
+
+import universe_builder
+
+
+@pytest.fixture
+def package(tmp_path, monkeypatch):
+    '''Returns a function which creates a UniversePackageBuilder for a package which references the first
+    of two artifacts by sha256'''
+    monkeypatch.setenv('SHA256_CACHE_PATH', str(tmp_path / 'sha256-cache.json'))
+    monkeypatch.setenv('UNIVERSE_CACHE_DIR', str(tmp_path / 'stub-universes'))
+    for env_key in list(os.environ.keys()):
+        if env_key.startswith('TEMPLATE_'):
+            monkeypatch.delenv(env_key)
+    input_dir = tmp_path / 'universe'
+    input_dir.mkdir()
+    (input_dir / 'resource.json').write_text(
+        '{"uri": "{{artifact-dir}}/referenced.txt", "sha": "{{sha256:referenced.txt}}", "name": "{{service.name}}"}')
+    (input_dir / 'package.json').write_text('{"version": "{{package-version}}", "custom": "{{custom-param}}"}')
+    (input_dir / 'README.txt').write_text('{{package-version}}')
+    artifacts = tmp_path / 'artifacts'
+    artifacts.mkdir()
+    (artifacts / 'referenced.txt').write_text('referenced')
+    (artifacts / 'unreferenced.txt').write_text('unreferenced')
+
+    def builder():
+        return universe_builder.UniversePackageBuilder(
+            'test', '1.2.3', str(input_dir), 'http://example.com/artifacts',
+            [str(artifacts / 'referenced.txt'), str(artifacts / 'unreferenced.txt')])
+    builder.input_dir = input_dir
+    builder.artifacts = artifacts
+    return builder
+
+
+def _read_zip(zippath):
+    with zipfile.ZipFile(zippath, 'r') as zipin:
+        return dict((name, zipin.read(name).decode('utf-8')) for name in zipin.namelist())
+
+
+def test_templating(package, monkeypatch):
+    monkeypatch.setenv('TEMPLATE_CUSTOM_PARAM', 'custom-value')
+    files = _read_zip(package().build_zip())
+    pkgdir = 'stub-universe-test/repo/packages/T/test/0/'
+    assert json.loads(files[pkgdir + 'resource.json']) == {
+        'uri': 'http://example.com/artifacts/referenced.txt',
+        'sha': hashlib.sha256(b'referenced').hexdigest(),
+        # unknown params are left for mustache:
+        'name': '{{service.name}}'}
+    assert json.loads(files[pkgdir + 'package.json']) == {'version': '1.2.3', 'custom': 'custom-value'}
+    # only json files are templated:
+    assert files[pkgdir + 'README.txt'] == '{{package-version}}'
+    assert json.loads(files['stub-universe-test/repo/meta/index.json'])['packages'][0]['currentVersion'] == '1.2.3'
+    assert 'stub-universe-test/repo/' in files
+
+
+def test_missing_sha256_artifact(package):
+    (package.input_dir / 'marathon.json.mustache').write_text('{"sha": "{{sha256:missing.txt}}"}')
+    with pytest.raises(Exception) as e:
+        package().build_zip()
+    assert 'missing.txt' in str(e.value)
+
+
+def test_fingerprint(package, monkeypatch):
+    fingerprint = package().get_fingerprint()
+    assert package().get_fingerprint() == fingerprint
+
+    # artifacts which aren't referenced by sha256 don't affect the zip:
+    (package.artifacts / 'unreferenced.txt').write_text('changed')
+    assert package().get_fingerprint() == fingerprint
+
+    (package.artifacts / 'referenced.txt').write_text('changed')
+    changed_artifact = package().get_fingerprint()
+    assert changed_artifact != fingerprint
+
+    (package.input_dir / 'package.json').write_text('{}')
+    changed_template = package().get_fingerprint()
+    assert changed_template not in (fingerprint, changed_artifact)
+
+    monkeypatch.setenv('TEMPLATE_CUSTOM_PARAM', 'custom-value')
+    assert package().get_fingerprint() not in (fingerprint, changed_artifact, changed_template)
+
+
+def test_build_zip_reused(package):
+    builder = package()
+    zippath = builder.build_zip()
+    assert os.path.basename(os.path.dirname(zippath)) == builder.get_fingerprint()
+    mtime = os.path.getmtime(zippath)
+    assert package().build_zip() == zippath
+    assert os.path.getmtime(zippath) == mtime
+
+    (package.artifacts / 'referenced.txt').write_text('changed')
+    rebuilt_zippath = package().build_zip()
+    assert rebuilt_zippath != zippath
+    assert os.path.isfile(zippath)
+
+
+def test_build_zip_uncached(package, monkeypatch):
+    monkeypatch.setenv('UNIVERSE_CACHE_DIR', '')
+    zippath = package().build_zip()
+    assert package().build_zip() != zippath
+
+
+def test_zip_cache_pruned(package, tmp_path):
+    old_zippath = package().build_zip()
+    expired = time.time() - 8 * 24 * 60 * 60
+    os.utime(os.path.dirname(old_zippath), (expired, expired))
+    # reused zips are kept:
+    assert package().build_zip() == old_zippath
+
+    os.utime(os.path.dirname(old_zippath), (expired, expired))
+    (package.artifacts / 'referenced.txt').write_text('changed')
+    zippath = package().build_zip()
+    assert os.listdir(str(tmp_path / 'stub-universes')) == [os.path.basename(os.path.dirname(zippath))]
+
+
+class StreamOutput(object):
+    '''An unseekable output, eg stdout when piped to another process'''
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+
+def test_write_zip_to_stream(package):
+    output = StreamOutput()
+    package().write_zip(output)
+    assert _read_zip(io.BytesIO(b''.join(output.chunks))) == _read_zip(package().build_zip())
+
+
+def test_sha256_cache(tmp_path):
+    cache_path = str(tmp_path / 'cache.json')
+    paths = []
+    for i in range(3):
+        path = tmp_path / 'file{}'.format(i)
+        path.write_text('content{}'.format(i))
+        paths.append(str(path))
+    expected = dict((path, hashlib.sha256('content{}'.format(i).encode('utf-8')).hexdigest())
+                    for i, path in enumerate(paths))
+    assert universe_builder.Sha256Cache(cache_path).get_all(paths) == expected
+
+    # reloaded from disk rather than rehashed:
+    with open(cache_path, 'r') as cache_file:
+        cached = json.load(cache_file)
+    cached = dict((key, 'cached') for key in cached.keys())
+    with open(cache_path, 'w') as cache_file:
+        json.dump(cached, cache_file)
+    assert universe_builder.Sha256Cache(cache_path).get(paths[0]) == 'cached'
+
+    # entries for removed or changed files are dropped on save:
+    os.remove(paths[1])
+    with open(paths[2], 'w') as changed_file:
+        changed_file.write('changed content')
+    new_path = str(tmp_path / 'new')
+    with open(new_path, 'w') as new_file:
+        new_file.write('new')
+    universe_builder.Sha256Cache(cache_path).get_all([paths[2], new_path])
+    with open(cache_path, 'r') as cache_file:
+        cached = json.load(cache_file)
+    assert sorted(key.rsplit(':', 3)[0] for key in cached.keys()) == sorted([paths[0], paths[2], new_path])
+    assert universe_builder.Sha256Cache(cache_path).get(paths[2]) == hashlib.sha256(b'changed content').hexdigest()
@@ -2,7 +2,10 @@
 
 import difflib
 import hashlib
+import json
 import logging
+import mmap
+import multiprocessing
 import os
 import os.path
 import re
@@ -19,6 +22,119 @@ jre_url = 'https://downloads.mesosphere.com/java/jre-8u121-linux-x64.tar.gz'
 jre_jce_unlimited_url = 'https://downloads.mesosphere.com/java/jre-8u112-linux-x64-jce-unlimited.tar.gz'
 libmesos_bundle_url = 'https://downloads.mesosphere.com/libmesos-bundle/libmesos-bundle-1.9.0-rc2-1.2.0-rc2-1.tar.gz'
 
+# matches template params of the form '{{some-param}}', with 'some-param' in group 1:
+TEMPLATE_PARAM_PATTERN = re.compile('{{([^{}]+)}}')
+
+# files at least this large are hashed via mmap rather than via a chain of read() calls:
+SHA256_MMAP_MIN_SIZE = 16 * 1024 * 1024
+SHA256_BLOCKSIZE = 1024 * 1024
+
+# bump this when changing the zip's layout or content, to avoid reusing cached zips from older builders:
+FINGERPRINT_FORMAT_VERSION = 1
+
+
+def _calculate_sha256(filepath):
+    # module-level function for use with multiprocessing
+    hasher = hashlib.sha256()
+    with open(filepath, 'rb') as fd:
+        if os.fstat(fd.fileno()).st_size >= SHA256_MMAP_MIN_SIZE:
+            mapped = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                for offset in range(0, len(mapped), SHA256_BLOCKSIZE):
+                    hasher.update(mapped[offset:offset + SHA256_BLOCKSIZE])
+            finally:
+                mapped.close()
+        else:
+            buf = fd.read(SHA256_BLOCKSIZE)
+            while len(buf) > 0:
+                hasher.update(buf)
+                buf = fd.read(SHA256_BLOCKSIZE)
+    return hasher.hexdigest()
+
+
+def get_sha256_cache():
+    '''Returns a Sha256Cache stored at SHA256_CACHE_PATH, or at a default location in the home directory'''
+    return Sha256Cache(os.environ.get(
+        'SHA256_CACHE_PATH', os.path.join(os.path.expanduser('~'), '.dcos-commons', 'sha256-cache.json')))
+
+
+class Sha256Cache(object):
+    '''Persistent cache of file sha256 sums, keyed on each file's (path, size, mtime, inode).
+    If any of those change, the file is rehashed. Files missing from the cache are hashed in parallel
+    across processes. Entries for files which have since changed or been removed are dropped whenever
+    the cache is saved.'''
+
+    def __init__(self, cache_path):
+        self._cache_path = cache_path
+        self._entries = {}
+        if cache_path and os.path.isfile(cache_path):
+            try:
+                with open(cache_path, 'r') as cache_file:
+                    self._entries = json.load(cache_file)
+            except ValueError as e:
+                logger.warning('Ignoring malformed sha256 cache {}: {}'.format(cache_path, e))
+
+
+    def _key(self, filepath):
+        stat = os.stat(filepath)
+        return '{}:{}:{}:{}'.format(os.path.abspath(filepath), stat.st_size, stat.st_mtime, stat.st_ino)
+
+
+    def get(self, filepath):
+        return self.get_all([filepath])[filepath]
+
+
+    def get_all(self, filepaths):
+        '''Returns a {filepath: sha256} dict for the provided files'''
+        keys = dict((filepath, self._key(filepath)) for filepath in set(filepaths))
+        misses = sorted([filepath for filepath, key in keys.items() if not key in self._entries])
+        if misses:
+            logger.info('Calculating sha256 of {} file(s): {}'.format(len(misses), ', '.join(misses)))
+            if len(misses) == 1:
+                shas = [_calculate_sha256(misses[0])]
+            else:
+                pool = multiprocessing.Pool(min(len(misses), multiprocessing.cpu_count()))
+                try:
+                    shas = pool.map(_calculate_sha256, misses)
+                finally:
+                    pool.close()
+                    pool.join()
+            for filepath, sha in zip(misses, shas):
+                self._entries[keys[filepath]] = sha
+            self._save()
+        return dict((filepath, self._entries[key]) for filepath, key in keys.items())
+
+
+    def _save(self):
+        if not self._cache_path:
+            return
+        self._prune()
+        cache_dir = os.path.dirname(self._cache_path)
+        if cache_dir and not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        # write then rename, so that concurrent builds never see a partially written cache:
+        tmp_path = '{}.{}.tmp'.format(self._cache_path, os.getpid())
+        with open(tmp_path, 'w') as tmp_file:
+            json.dump(self._entries, tmp_file, indent=2, sort_keys=True)
+        os.rename(tmp_path, self._cache_path)
+
+
+    def _prune(self):
+        '''Drops entries for files which have since been removed or changed, eg temporary zips from past
+        builds, so that the cache doesn't grow forever'''
+        current_keys = {}
+        for key in list(self._entries.keys()):
+            # 'path:size:mtime:ino' => 'path'
+            filepath = key.rsplit(':', 3)[0]
+            if filepath not in current_keys:
+                try:
+                    current_keys[filepath] = self._key(filepath)
+                except OSError:
+                    current_keys[filepath] = None
+            if current_keys[filepath] != key:
+                del self._entries[key]
+
+
 class UniversePackageBuilder(object):
 
     def __init__(self, package_name, package_version, input_dir_path, upload_dir_url, artifact_paths):
@@ -39,19 +155,53 @@ class UniversePackageBuilder(object):
                 raise Exception('Duplicate filename between "{}" and "{}". Artifact filenames must be unique.'.format(prior_path, artifact_path))
             self._artifact_files[os.path.basename(artifact_path)] = artifact_path
 
+        self._sha256_cache = get_sha256_cache()
+        self._zip_cache_dir = os.environ.get(
+            'UNIVERSE_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.dcos-commons', 'stub-universes'))
+        self._zip_cache_max_age_seconds = float(os.environ.get('UNIVERSE_CACHE_MAX_AGE_DAYS', '7')) * 24 * 60 * 60
+        self._fingerprint = None
+
 
-    def _create_version_json(self, metadir):
-        version = open(os.path.join(metadir, 'version.json'), 'w')
-        version.write('''{
+    def get_fingerprint(self):
+        '''Returns a hash of everything that goes into the zip: the template files, the template mapping,
+        and the artifacts whose sha256 is referenced by the templates. If the fingerprint hasn't changed,
+        neither has the (templated) package.'''
+        if self._fingerprint:
+            return self._fingerprint
+        hasher = hashlib.sha256()
+        def add(*values):
+            for value in values:
+                if not isinstance(value, bytes):
+                    value = value.encode('utf-8')
+                # length prefix to avoid ambiguity between eg ('ab', 'c') and ('a', 'bc'):
+                hasher.update('{}:'.format(len(value)).encode('utf-8'))
+                hasher.update(value)
+        add(str(FINGERPRINT_FORMAT_VERSION), self._pkg_name, self._pkg_version)
+        pkg_contents = []
+        for pkgfile in sorted(os.listdir(self._input_dir_path)):
+            with open(os.path.join(self._input_dir_path, pkgfile), 'rb') as pkgfd:
+                pkg_contents.append(pkgfd.read())
+            add(pkgfile, pkg_contents[-1])
+        template_mapping = self._get_template_mapping()
+        for key in sorted(template_mapping.keys()):
+            add(key, template_mapping[key])
+        # other artifacts don't affect the zip's content:
+        sha_artifact_files = self._get_sha256_artifact_files([content.decode('utf-8') for content in pkg_contents])
+        artifact_shas = self._sha256_cache.get_all(sha_artifact_files.values())
+        for filename in sorted(sha_artifact_files.keys()):
+            add(filename, artifact_shas[sha_artifact_files[filename]])
+        self._fingerprint = hasher.hexdigest()
+        return self._fingerprint
+
+
+    def _get_version_json(self):
+        return '''{
   "version": "2.0.0"
 }
-''')
-        version.flush()
-        version.close()
+'''
 
 
-    def _create_index_json(self, metadir):
-        index = open(os.path.join(metadir, 'index.json'), 'w')
+    def _get_index_json(self):
         template = '''{
   "packages":[ {
     "name": "%(name)s",
@@ -66,52 +216,60 @@ class UniversePackageBuilder(object):
 }
 '''
         # "".format() is confused by all the {}'s, so use % for formatting:
-        index.write(template % {
+        return template % {
             'ver': self._pkg_version,
             'name': self._pkg_name,
-            'time': time.ctime()})
-        index.flush()
-        index.close()
-
-
-    def _create_tree(self, scratchdir):
-        treedir = os.path.join(scratchdir, 'stub-universe-{}'.format(self._pkg_name))
-        # create stub-universe-PKG/scripts/.stub_dir
-        scriptsdir = os.path.join(treedir, 'scripts')
-        os.makedirs(scriptsdir)
-        stubfile = open(os.path.join(scriptsdir, '.stub_dir'), 'w')
-        stubfile.write('this a stub directory, install will fail without it.')
-        stubfile.flush()
-        stubfile.close()
-        # create stub-universe-PKG/repo/meta/[version.json|index.json]
-        metadir = os.path.join(treedir, 'repo', 'meta')
-        os.makedirs(metadir)
-        self._create_version_json(metadir)
-        self._create_index_json(metadir)
-        # create stub-universe/repo/packages/P/package/0/[*.json*]
-        pkgdir = os.path.join(treedir, 'repo', 'packages', self._pkg_name[0].upper(), self._pkg_name, '0')
-        os.makedirs(pkgdir)
-        for pkgfile in os.listdir(self._input_dir_path):
-            shutil.copyfile(os.path.join(self._input_dir_path, pkgfile), os.path.join(pkgdir, pkgfile))
-        return treedir
-
-
-    def _calculate_sha256(self, filepath):
-        BLOCKSIZE = 65536
-        hasher = hashlib.sha256()
-        with open(filepath, 'rb') as fd:
-            buf = fd.read(BLOCKSIZE)
-            while len(buf) > 0:
-                hasher.update(buf)
-                buf = fd.read(BLOCKSIZE)
-        return hasher.hexdigest()
+            'time': time.ctime()}
+
+
+    def _get_tree_files(self):
+        '''Returns a list of (path in zip, content) for every file in the stub universe, with templating
+        applied to the package files'''
+        treedir = 'stub-universe-{}'.format(self._pkg_name)
+        # stub-universe-PKG/scripts/.stub_dir
+        tree_files = [(
+            '/'.join([treedir, 'scripts', '.stub_dir']),
+            'this a stub directory, install will fail without it.')]
+        # stub-universe-PKG/repo/packages/P/package/0/[*.json*]
+        pkgdir = '/'.join([treedir, 'repo', 'packages', self._pkg_name[0].upper(), self._pkg_name, '0'])
+        pkg_files = []
+        for pkgfile in sorted(os.listdir(self._input_dir_path)):
+            pkg_files.append((pkgfile, open(os.path.join(self._input_dir_path, pkgfile), 'r').read()))
+        for pkgfile, content in self._apply_templating_files(pkg_files):
+            tree_files.append(('/'.join([pkgdir, pkgfile]), content))
+        # stub-universe-PKG/repo/meta/[index.json|version.json]
+        metadir = '/'.join([treedir, 'repo', 'meta'])
+        tree_files.append(('/'.join([metadir, 'index.json']), self._get_index_json()))
+        tree_files.append(('/'.join([metadir, 'version.json']), self._get_version_json()))
+        return tree_files
+
+
+    def _get_sha256_artifact_files(self, contents):
+        '''Returns {filename: path} of the artifacts referenced by '{{sha256:...}}' params in the contents'''
+        sha_artifact_files = {}
+        for content in contents:
+            for key in TEMPLATE_PARAM_PATTERN.findall(content):
+                if not key.startswith('sha256:'):
+                    continue
+                # unknown artifacts are left for _get_template_value() to complain about:
+                shafilename = key[len('sha256:'):]
+                if shafilename in self._artifact_files:
+                    sha_artifact_files[shafilename] = self._artifact_files[shafilename]
+        return sha_artifact_files
+
+
+    def _precalculate_sha256s(self, contents):
+        '''Finds all '{{sha256:...}}' params in the contents and hashes the referenced artifacts all at once,
+        so that uncached artifacts are hashed in parallel rather than as each param is reached.'''
+        self._sha256_cache.get_all(self._get_sha256_artifact_files(contents).values())
 
 
-    def _get_file_template_mapping(self, filepath):
+    def _get_template_mapping(self):
         '''Returns a template mapping (dict) for the following cases:
         - Default params like '{{package-version}}' and '{{artifact-dir}}'
-        - SHA256 params like '{{sha256:artifact.zip}}' (requires user-provided paths to artifact files)
         - Custom environment params like 'TEMPLATE_SOME_PARAM' which maps to '{{some-param}}'
+        SHA256 params like '{{sha256:artifact.zip}}' are resolved separately, only when they're found in
+        a template.
         '''
         # default template values (may be overridden via eg TEMPLATE_PACKAGE_VERSION envvars):
         template_mapping = {
@@ -121,18 +279,6 @@ class UniversePackageBuilder(object):
             'jre-jce-unlimited-url': jre_jce_unlimited_url,
             'libmesos-bundle-url': libmesos_bundle_url}
 
-        # look for any 'sha256:filename' template params, and get shas for those.
-        # this avoids calculating shas unless they're requested by the template.
-        orig_content = open(filepath, 'r').read()
-        for shafilename in re.findall('{{sha256:(.+)}}', orig_content):
-            # somefile.txt => sha256:somefile.txt
-            shafilepath = self._artifact_files.get(shafilename, '')
-            if not shafilepath:
-                raise Exception(
-                    'Missing path for artifact file named \'{}\' (to calculate sha256). '.format(shafilename) +
-                    'Please provide the full path to this artifact (known artifacts: {})'.format(self._artifact_files))
-            template_mapping['sha256:{}'.format(shafilename)] = self._calculate_sha256(shafilepath)
-
         # import any custom TEMPLATE_SOME_PARAM environment variables:
         for env_key, env_val in os.environ.items():
             if env_key.startswith('TEMPLATE_'):
@@ -142,87 +288,170 @@ class UniversePackageBuilder(object):
         return template_mapping
 
 
-    def _apply_templating_file(self, filepath):
+    def _get_template_value(self, template_mapping, key):
+        '''Returns the value for a '{{key}}' template param, or None if the key isn't known'''
+        if key.startswith('sha256:'):
+            # somefile.txt => sha256:somefile.txt
+            shafilename = key[len('sha256:'):]
+            shafilepath = self._artifact_files.get(shafilename, '')
+            if not shafilepath:
+                raise Exception(
+                    'Missing path for artifact file named \'{}\' (to calculate sha256). '.format(shafilename) +
+                    'Please provide the full path to this artifact (known artifacts: {})'.format(self._artifact_files))
+            return self._sha256_cache.get(shafilepath)
+        return template_mapping.get(key, None)
+
+
+    def _render_template(self, template_mapping, orig_content):
+        '''Replaces all known '{{key}}' params in a single scan of the content.
+        Returns a tuple of (new content, {used key: value}, set(unknown keys)).
+        Unknown keys (eg mustache params like '{{service.name}}') are left as-is.'''
+        used_params = {}
+        unknown_keys = set()
+        def replace(match):
+            key = match.group(1)
+            if key in used_params:
+                return used_params[key]
+            value = self._get_template_value(template_mapping, key)
+            if value is None:
+                unknown_keys.add(key)
+                return match.group(0)
+            used_params[key] = value
+            return value
+        new_content = TEMPLATE_PARAM_PATTERN.sub(replace, orig_content)
+        return (new_content, used_params, unknown_keys)
+
+
+    def _apply_templating_content(self, template_mapping, filename, orig_content):
+        '''Returns a tuple of (new content, set(template keys used in the content))'''
         # basic checks to avoid files that we shouldn't edit:
-        if not '.json' in os.path.basename(filepath):
-            logger.warning('')
-            logger.warning('Ignoring non-json file: {}'.format(filepath))
-            return
-        if os.stat(filepath).st_size > (1024 * 1024):
+        if not '.json' in filename:
             logger.warning('')
-            logger.warning('Ignoring file larger than 1MB: {}'.format(filepath))
-            return
+            logger.warning('Ignoring non-json file: {}'.format(filename))
+            return (orig_content, set())
 
-        template_mapping = self._get_file_template_mapping(filepath)
-        orig_content = open(filepath, 'r').read()
-        new_content = orig_content
-        for template_key, template_val in template_mapping.items():
-            new_content = new_content.replace('{{%s}}' % template_key, template_val)
+        new_content, used_params, unknown_keys = self._render_template(template_mapping, orig_content)
+        if unknown_keys:
+            logger.info('')
+            logger.info('Leaving unknown template params as-is in {}: {}'.format(
+                filename, ', '.join(sorted(unknown_keys))))
         if orig_content == new_content:
             logger.info('')
-            logger.info('No templating detected in {}, leaving file as-is'.format(filepath))
-            return
+            logger.info('No templating detected in {}, leaving file as-is'.format(filename))
+            return (orig_content, set(used_params.keys()))
         logger.info('')
-        logger.info('Applied templating changes to {}:'.format(filepath))
+        logger.info('Applied templating changes to {}:'.format(filename))
         logger.info('Template params used:')
-        template_keys = list(template_mapping.keys())
-        template_keys.sort()
-        for key in template_keys:
-            logger.info('  {{%s}} => %s' % (key, template_mapping[key]))
+        for key in sorted(used_params.keys()):
+            logger.info('  {{%s}} => %s' % (key, used_params[key]))
         logger.info('Resulting diff:')
         logger.info('\n'.join(difflib.ndiff(orig_content.split('\n'), new_content.split('\n'))))
-        rewrite = open(filepath, 'w')
-        rewrite.write(new_content)
-        rewrite.flush()
-        rewrite.close()
-
-
-    def _apply_templating_tree(self, scratchdir):
-        for root, dirs, files in os.walk(scratchdir):
-            files.sort() # nice to have: process in consistent order
-            for f in files:
-                self._apply_templating_file(os.path.join(root, f))
+        return (new_content, set(used_params.keys()))
+
+
+    def _apply_templating_files(self, files):
+        '''Accepts and returns a list of (filename, content)'''
+        self._precalculate_sha256s([content for filename, content in files])
+        template_mapping = self._get_template_mapping()
+        used_keys = set()
+        templated_files = []
+        for filename, content in files:
+            new_content, file_used_keys = self._apply_templating_content(template_mapping, filename, content)
+            used_keys |= file_used_keys
+            templated_files.append((filename, new_content))
+        unused_keys = set(template_mapping.keys()) - used_keys
+        if unused_keys:
+            logger.info('')
+            logger.info('Template params not used by any file: {}'.format(', '.join(sorted(unused_keys))))
+        return templated_files
 
 
-    def _create_zip(self, scratchdir):
+    def write_zip(self, fileobj):
+        '''Writes a universe zip to the provided file object. The zip is built in memory and streamed out
+        without touching disk, so fileobj may be eg stdout or a socket (unseekable streams require python3).'''
         # if compression is enabled, cosmos returns 'invalid stored block lengths'.
         # this only happens with python-generated files, mutual format incompatibility?:
-        zippath = os.path.join(scratchdir, 'stub-universe-{}.zip'.format(self._pkg_name))
-        zipout = zipfile.ZipFile(zippath, 'w', zipfile.ZIP_STORED)
-        for root, dirs, files in os.walk(scratchdir):
-            destroot = root[len(scratchdir):]
-            logger.info('  adding: {}/ => {}/'.format(root, destroot))
-            # cosmos requires a preceding explicit directory entry:
-            zipout.write(root, destroot)
-            files.sort() # nice to have: process in consistent order
-            for f in files:
-                srcpath = os.path.join(root, f)
-                if srcpath == zippath:
-                    # don't include the (newly created) zipfile itself!
-                    continue
-                destpath = srcpath[len(scratchdir):]
-                logger.info('  adding: {} => {}'.format(srcpath, destpath))
-                zipout.write(srcpath, destpath)
-        return zippath
+        with zipfile.ZipFile(fileobj, 'w', zipfile.ZIP_STORED) as zipout:
+            date_time = time.localtime()[:6]
+            added_dirs = set()
+            for path, content in self._get_tree_files():
+                # cosmos requires a preceding explicit directory entry for each directory:
+                dirs = path.split('/')[:-1]
+                for i in range(1, len(dirs) + 1):
+                    dirpath = '/'.join(dirs[:i]) + '/'
+                    if dirpath in added_dirs:
+                        continue
+                    logger.info('  adding: {}'.format(dirpath))
+                    dirinfo = zipfile.ZipInfo(dirpath, date_time)
+                    dirinfo.external_attr = (0o40755 << 16) | 0x10 # drwxr-xr-x + MS-DOS directory flag
+                    zipout.writestr(dirinfo, b'')
+                    added_dirs.add(dirpath)
+                logger.info('  adding: {}'.format(path))
+                fileinfo = zipfile.ZipInfo(path, date_time)
+                fileinfo.external_attr = 0o100644 << 16 # -rw-r--r--
+                if not isinstance(content, bytes):
+                    content = content.encode('utf-8')
+                zipout.writestr(fileinfo, content)
 
 
     def build_zip(self):
-        '''builds a universe zip and returns its location on disk'''
-        scratchdir = tempfile.mkdtemp(prefix='stub-universe-tmp')
-        treedir = self._create_tree(scratchdir)
-        self._apply_templating_tree(scratchdir)
-        zippath = self._create_zip(scratchdir)
-        shutil.rmtree(treedir)
+        '''builds a universe zip and returns its location on disk. if an identical zip was already built,
+        per get_fingerprint(), then the previously built zip is returned instead.'''
+        zipname = 'stub-universe-{}.zip'.format(self._pkg_name)
+        if not self._zip_cache_dir:
+            zippath = os.path.join(tempfile.mkdtemp(prefix='stub-universe-tmp'), zipname)
+            with open(zippath, 'wb') as zipfd:
+                self.write_zip(zipfd)
+            return zippath
+
+        zipdir = os.path.join(self._zip_cache_dir, self.get_fingerprint())
+        zippath = os.path.join(zipdir, zipname)
+        self._prune_zip_cache(zipdir)
+        if os.path.isfile(zippath):
+            logger.info('Reusing previously built stub universe with fingerprint {}'.format(self.get_fingerprint()))
+            # keeps it from being pruned:
+            os.utime(zipdir, None)
+            return zippath
+        if not os.path.isdir(zipdir):
+            os.makedirs(zipdir)
+        # write then rename, so that concurrent builds never see a partially written zip:
+        tmp_path = '{}.{}.tmp'.format(zippath, os.getpid())
+        with open(tmp_path, 'wb') as zipfd:
+            self.write_zip(zipfd)
+        os.rename(tmp_path, zippath)
         return zippath
 
 
+    def _prune_zip_cache(self, keep_dir):
+        '''Removes cached zips which haven't been built or reused within UNIVERSE_CACHE_MAX_AGE_DAYS'''
+        if not self._zip_cache_max_age_seconds or not os.path.isdir(self._zip_cache_dir):
+            return
+        cutoff = time.time() - self._zip_cache_max_age_seconds
+        for filename in os.listdir(self._zip_cache_dir):
+            path = os.path.join(self._zip_cache_dir, filename)
+            if path == keep_dir or not os.path.isdir(path):
+                continue
+            try:
+                if os.path.getmtime(path) >= cutoff:
+                    continue
+                logger.info('Removing expired stub universe: {}'.format(path))
+                shutil.rmtree(path)
+            except OSError as e:
+                # eg already removed by a concurrent build:
+                logger.info('Failed to remove expired stub universe {}: {}'.format(path, e))
+
+
 def print_help(argv):
-    logger.info('Syntax: {} <package-name> <package-version> <template-package-dir> <artifact-base-path> [artifact files ...]'.format(argv[0]))
+    logger.info('Syntax: {} [--stdout] <package-name> <package-version> <template-package-dir> <artifact-base-path> [artifact files ...]'.format(argv[0]))
     logger.info('  Example: $ {} kafka 1.2.3-4.5.6 /path/to/template/jsons/ https://example.com/path/to/kafka-artifacts /path/to/artifact1.zip /path/to/artifact2.zip /path/to/artifact3.zip'.format(argv[0]))
+    logger.info('With --stdout, the zip itself is written to stdout, rather than its location on disk')
     logger.info('In addition, environment variables named \'TEMPLATE_SOME_PARAMETER\' will be inserted against the provided package template (with params of the form \'{{some-parameter}}\')')
 
 
 def main(argv):
+    to_stdout = '--stdout' in argv
+    if to_stdout:
+        argv = [arg for arg in argv if arg != '--stdout']
     if len(argv) < 5:
         print_help(argv)
         return 1
@@ -245,6 +474,12 @@ Artifacts:       {}
 
     builder = UniversePackageBuilder(
         package_name, package_version, package_dir_path, upload_dir_url, artifact_paths)
+    if to_stdout:
+        # python3 stdout only accepts text, its underlying binary stream is .buffer:
+        stdout = getattr(sys.stdout, 'buffer', sys.stdout)
+        builder.write_zip(stdout)
+        stdout.flush()
+        return 0
     package_path = builder.build_zip()
     if not package_path:
         return -1